@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Lokalny magazyn barów OHLC (SQLite) dla PivotBacktester.
+
+- jedna baza, tabela bars: (symbol, interval, ts) -> OHLC
+- tabela coverage: jaki zakres dat był już pobrany ze źródła
+  (żeby nie pytać ponownie o okresy, w których źródło nie ma danych)
+- WAL: wiele procesów (sweep, cron) może czytać równolegle
+"""
+
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+os.makedirs("data", exist_ok=True)
+
+BAR_DB = os.environ.get("PIVOT_BAR_DB", "data/bars.db")
+
+OHLC_COLUMNS = ['Date', 'Open', 'High', 'Low', 'Close']
+
+
+def _to_ns(value):
+    return int(pd.Timestamp(value).value)
+
+
+class BarStore:
+    """Magazyn barów OHLC per symbol i interwał"""
+
+    def __init__(self, path=BAR_DB):
+        self.path = path
+        conn = self.get_connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS bars (
+            symbol TEXT NOT NULL,
+            interval TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL,
+            PRIMARY KEY (symbol, interval, ts)
+        ) WITHOUT ROWID
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS coverage (
+            symbol TEXT NOT NULL,
+            interval TEXT NOT NULL,
+            start_ts INTEGER,
+            end_ts INTEGER,
+            fetched_at REAL,
+            PRIMARY KEY (symbol, interval)
+        )
+        """)
+        conn.commit()
+        conn.close()
+
+    def get_connection(self):
+        return sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+
+    def write(self, symbol, interval, df):
+        """Zapisz/nadpisz bary (kolumny Date/Open/High/Low/Close)"""
+        if df is None or len(df) == 0:
+            return 0
+
+        ts = pd.to_datetime(df['Date']).to_numpy(dtype='datetime64[ns]').view(np.int64)
+        rows = zip(
+            [symbol] * len(df), [interval] * len(df), ts.tolist(),
+            df['Open'].astype(float).tolist(), df['High'].astype(float).tolist(),
+            df['Low'].astype(float).tolist(), df['Close'].astype(float).tolist()
+        )
+
+        conn = self.get_connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO bars (symbol, interval, ts, open, high, low, close) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+        conn.close()
+        return len(df)
+
+    def _range_query(self, symbol, interval, start, end):
+        query = "SELECT ts, open, high, low, close FROM bars WHERE symbol = ? AND interval = ?"
+        params = [symbol, interval]
+        if start is not None:
+            query += " AND ts >= ?"
+            params.append(_to_ns(start))
+        if end is not None:
+            query += " AND ts < ?"
+            params.append(_to_ns(end))
+        return query + " ORDER BY ts", params
+
+    @staticmethod
+    def _to_frame(raw):
+        df = pd.DataFrame({
+            'Date': pd.to_datetime(raw['ts'].to_numpy(dtype=np.int64), unit='ns'),
+            'Open': raw['open'].astype(float),
+            'High': raw['high'].astype(float),
+            'Low': raw['low'].astype(float),
+            'Close': raw['close'].astype(float)
+        })
+        return df.reset_index(drop=True)
+
+    def read(self, symbol, interval='1d', start=None, end=None):
+        """Bary z zakresu [start, end) posortowane po Date"""
+        query, params = self._range_query(symbol, interval, start, end)
+        conn = self.get_connection()
+        raw = pd.read_sql_query(query, conn, params=params)
+        conn.close()
+        return self._to_frame(raw)
+
+    def iter_chunks(self, symbol, interval='1d', start=None, end=None, chunksize=500_000):
+        """Bary w paczkach po chunksize wierszy (bez ładowania całości do RAM)"""
+        query, params = self._range_query(symbol, interval, start, end)
+        conn = self.get_connection()
+        try:
+            for raw in pd.read_sql_query(query, conn, params=params, chunksize=chunksize):
+                yield self._to_frame(raw)
+        finally:
+            conn.close()
+
+    def date_range(self, symbol, interval='1d'):
+        """(pierwsza, ostatnia) data w magazynie albo (None, None)"""
+        conn = self.get_connection()
+        first, last = conn.execute(
+            "SELECT MIN(ts), MAX(ts) FROM bars WHERE symbol = ? AND interval = ?",
+            (symbol, interval)
+        ).fetchone()
+        conn.close()
+        if first is None:
+            return None, None
+        return pd.Timestamp(first), pd.Timestamp(last)
+
+    def coverage(self, symbol, interval='1d'):
+        """(start, end, fetched_at) pobranego już zakresu albo None"""
+        conn = self.get_connection()
+        row = conn.execute(
+            "SELECT start_ts, end_ts, fetched_at FROM coverage WHERE symbol = ? AND interval = ?",
+            (symbol, interval)
+        ).fetchone()
+        conn.close()
+        if row is None:
+            return None
+        return pd.Timestamp(row[0]), pd.Timestamp(row[1]), row[2]
+
+    def mark_fetched(self, symbol, interval, start, end):
+        """Rozszerz zapisany zakres pobrania o [start, end]"""
+        current = self.coverage(symbol, interval)
+        if current is not None:
+            start = min(pd.Timestamp(start), current[0])
+            end = max(pd.Timestamp(end), current[1])
+
+        conn = self.get_connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO coverage (symbol, interval, start_ts, end_ts, fetched_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (symbol, interval, _to_ns(start), _to_ns(end), time.time())
+            )
+        conn.close()
+
+    def missing_ranges(self, symbol, interval, start, end, max_age=3600):
+        """
+        Zakresy [od, do) do pobrania, żeby pokryć [start, end].
+
+        - brak pokrycia: cały zakres
+        - początek przed pokryciem: dociągnięcie historii
+        - koniec: od ostatniego zapisanego baru (ostatni bar mógł być niepełny),
+          ale tylko jeśli ostatnie pobranie jest starsze niż max_age sekund
+        """
+        start, end = pd.Timestamp(start), pd.Timestamp(end)
+        current = self.coverage(symbol, interval)
+        if current is None:
+            return [(start, end)]
+
+        covered_start, covered_end, fetched_at = current
+        ranges = []
+        if start < covered_start:
+            ranges.append((start, covered_start))
+
+        if end > covered_end or time.time() - fetched_at > max_age:
+            _, last_bar = self.date_range(symbol, interval)
+            tail_start = min(covered_end, last_bar) if last_bar is not None else covered_end
+            if tail_start < end:
+                ranges.append((tail_start, end))
+        return ranges
+
+    def symbols(self, interval=None):
+        """Lista symboli w magazynie"""
+        conn = self.get_connection()
+        if interval is None:
+            rows = conn.execute("SELECT DISTINCT symbol FROM bars ORDER BY symbol").fetchall()
+        else:
+            rows = conn.execute(
+                "SELECT DISTINCT symbol FROM bars WHERE interval = ? ORDER BY symbol", (interval,)
+            ).fetchall()
+        conn.close()
+        return [row[0] for row in rows]
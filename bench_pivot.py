@@ -0,0 +1,468 @@
+#!/usr/bin/env python3
+"""
+Benchmark silnika pivot: pivoty, backtest (w pamięci i paczkami, z modelem kosztów), portfel, fees.
+
+Dane z deterministycznego generatora barów FX (GBM, seed) - bez sieci i plików:
+
+    python bench_pivot.py                         # szybki zestaw (1k-100k barów, 1 i 5 symboli)
+    python bench_pivot.py --full                  # 1k-10M barów, 1-50 symboli
+    python bench_pivot.py --cases backtest --sizes 1000000
+    python bench_pivot.py --save-baseline         # zapisz wynik jako bench_baseline.json
+    python bench_pivot.py --baseline bench_baseline.json --tolerance 0.25
+    python bench_pivot.py --check                 # tylko kontrola poprawności cache wyników
+
+Raport: czas wywołania (najlepsza z --repeat próbek), przepustowość (bary/s,
+dla fees transakcje/s), szczytowa pamięć (tracemalloc, osobny przebieg)
+i zmiana względem zapisanego baseline.
+Przypadki pivots, backtest, portfolio i fees mierzone też w funkcji liczby
+symboli (--symbols; --full: 1, 10, 50).
+
+bench_baseline.json w repozytorium to referencja szybkiego zestawu (wersje
+i maszyna w nagłówku pliku) - odświeżana przez --save-baseline razem ze zmianą,
+która świadomie zmienia wydajność. CI: python bench_pivot.py --check, potem
+python bench_pivot.py --tolerance 0.5 (pamięć jest powtarzalna co do procentów,
+czas zależy od maszyny - na runnerze innym niż referencyjny baseline zapisuje
+się najpierw z gałęzi main i porównuje z nim zmianę).
+Kod wyjścia 1, jeśli któryś przypadek jest wolniejszy / zużywa więcej pamięci niż
+baseline o więcej niż --tolerance albo kontrola cache (--check) się nie powiodła.
+"""
+
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from cost_model import CostModel
+from ohlc_csv import CHUNK_ROWS
+from pivot_backtester import (
+    PivotBacktester, ResultCache, assemble_portfolio, calculate_yearly_stats_with_fees, process_symbol
+)
+from pivot_engine import portfolio_capital_curve, run_backtest_chunked, run_portfolio_backtest
+
+BASELINE_PATH = 'bench_baseline.json'
+
+QUICK_SIZES = [1_000, 10_000, 100_000]
+FULL_SIZES = [1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+QUICK_SYMBOLS = [1, 5]
+FULL_SYMBOLS = [1, 10, 50]
+
+# Minimalny czas jednej próbki pomiaru (krótkie przypadki powtarzane w pętli)
+MIN_SAMPLE_SECONDS = 0.2
+
+# Przypadki wielosymbolowe: symbole × bary na symbol nie więcej niż tyle barów łącznie
+MAX_TOTAL_BARS = 10_000_000
+
+BAR_MINUTES = {'D': 1440, 'h': 60, 'min': 1}
+TRADING_MINUTES_PER_YEAR = 260 * 1440
+
+SYMBOL_PRICES = {
+    'EURUSD': 1.10, 'GBPUSD': 1.27, 'USDJPY': 145.0, 'AUDUSD': 0.66, 'USDCHF': 0.88,
+    'USDCAD': 1.36, 'NZDUSD': 0.61, 'EURPLN': 4.30, 'USDPLN': 4.00, 'EURGBP': 0.86
+}
+
+
+# ============================================
+# GENERATOR DANYCH
+# ============================================
+
+def bar_frequency(n_bars):
+    """Interwał danych typowy dla rozmiaru: D do 50k barów, H1 do 1M, dalej M1"""
+    if n_bars <= 50_000:
+        return 'D'
+    if n_bars <= 1_000_000:
+        return 'h'
+    return 'min'
+
+
+def _weekday_dates(start, count, freq, cursor=None):
+    """count kolejnych znaczników czasu pn-pt od start (albo po cursor)"""
+    step = pd.Timedelta(1, unit=freq)
+    first = pd.Timestamp(start) if cursor is None else cursor + step
+    dates = []
+    needed = count
+    while needed > 0:
+        # Weekend to 2/7 kalendarza - zapas, żeby zwykle wystarczył jeden zakres
+        candidates = pd.date_range(first, periods=int(needed * 1.45) + 16, freq=step)
+        candidates = candidates[candidates.weekday < 5][:needed]
+        dates.append(candidates)
+        needed -= len(candidates)
+        first = candidates[-1] + step if len(candidates) > 0 else first + step * 16
+    return dates[0] if len(dates) == 1 else dates[0].append(dates[1:])
+
+
+def iter_synthetic_ohlc(n_bars, seed=0, freq=None, start='2000-01-03', s0=1.10,
+                        annual_vol=0.08, drift=0.0, chunksize=CHUNK_ROWS):
+    """
+    Paczki Date/Open/High/Low/Close z geometrycznego ruchu Browna (tylko dni pn-pt).
+
+    Close: GBM z roczną zmiennością annual_vol. High/Low: dokładne losowanie
+    maksimum/minimum mostu Browna między Open i Close w barze (realistyczny zakres,
+    High >= max(Open, Close), Low <= min(Open, Close)). Osobne strumienie losowe
+    dla zwrotów, High i Low - wynik nie zależy od chunksize.
+    """
+    freq = freq or bar_frequency(n_bars)
+    dt = BAR_MINUTES[freq] / TRADING_MINUTES_PER_YEAR
+    sigma = annual_vol * np.sqrt(dt)
+    mu = (drift - 0.5 * annual_vol ** 2) * dt
+
+    returns_rng, high_rng, low_rng = [
+        np.random.default_rng(child) for child in np.random.SeedSequence(seed).spawn(3)
+    ]
+
+    log_open = np.log(s0)
+    cursor = None
+    produced = 0
+    while produced < n_bars:
+        size = min(chunksize, n_bars - produced)
+
+        moves = mu + sigma * returns_rng.standard_normal(size)
+        # Kumulacja od kursu otwarcia (ta sama kolejność dodawań przy dowolnym chunksize)
+        log_close = np.cumsum(np.r_[log_open, moves])[1:]
+        log_opens = np.r_[log_open, log_close[:-1]]
+
+        # max/min mostu Browna od 0 do x z wariancją s²: (x ± sqrt(x² - 2 s² ln U)) / 2
+        spread_high = np.sqrt(moves ** 2 - 2 * sigma ** 2 * np.log(1 - high_rng.random(size)))
+        spread_low = np.sqrt(moves ** 2 - 2 * sigma ** 2 * np.log(1 - low_rng.random(size)))
+
+        dates = _weekday_dates(start, size, freq, cursor)
+        yield pd.DataFrame({
+            'Date': dates,
+            'Open': np.exp(log_opens),
+            'High': np.exp(log_opens + (moves + spread_high) / 2),
+            'Low': np.exp(log_opens + (moves - spread_low) / 2),
+            'Close': np.exp(log_close)
+        })
+
+        log_open = log_close[-1]
+        cursor = dates[-1]
+        produced += size
+
+
+def synthetic_ohlc(n_bars, seed=0, freq=None, start='2000-01-03', s0=1.10, annual_vol=0.08, drift=0.0):
+    """Cały szereg z iter_synthetic_ohlc jako jeden DataFrame"""
+    chunks = list(iter_synthetic_ohlc(n_bars, seed, freq, start, s0, annual_vol, drift))
+    return pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+
+
+def synthetic_symbols(n_symbols, n_bars, seed=0, freq=None):
+    """{symbol: df} dla n_symbols par (znane nazwy, potem SYM010, SYM011, ...)"""
+    names = list(SYMBOL_PRICES) + [f"SYM{i:03d}" for i in range(len(SYMBOL_PRICES), n_symbols)]
+    return {
+        name: synthetic_ohlc(n_bars, seed + i, freq, s0=SYMBOL_PRICES.get(name, 1.0))
+        for i, name in enumerate(names[:n_symbols])
+    }
+
+
+def synthetic_trades(n_trades, seed=0, initial_capital=10000, start='2000-01-03', n_symbols=1):
+    """
+    Tabela transakcji (kolumny używane przez statystyki z fees), ~1 zamknięcie na godzinę
+    na każdą z n_symbols par - razem n_trades * n_symbols wierszy jak combined_trades portfela
+    """
+    rng = np.random.default_rng(seed)
+    exit_dates = _weekday_dates(start, n_trades, 'h').repeat(n_symbols)
+    pnl_pct = rng.normal(0.02, 0.5, n_trades * n_symbols)
+    profits = initial_capital * pnl_pct / 100
+    return pd.DataFrame({
+        'Exit Date': exit_dates,
+        'Profit (base)': profits,
+        'P&L %': pnl_pct,
+        'Pips': pnl_pct * 25,
+        'Portfolio Capital': portfolio_capital_curve(profits, initial_capital)
+    })
+
+
+# ============================================
+# PRZYPADKI
+# ============================================
+
+BACKTEST_PARAMS = dict(initial_capital=10000, spread_value=0.0002, holding_days=5, stop_loss_pct=None,
+                       support_level='S3', resistance_level='R3', trade_direction='Both',
+                       leverage=1, capital_usage_pct=100)
+
+
+def _case_pivots(n_bars, n_symbols, seed):
+    backtester = PivotBacktester(lookback_days=7)
+    frames = synthetic_symbols(n_symbols, n_bars, seed)
+    return lambda: [backtester.calculate_pivot_points(df) for df in frames.values()], n_bars * n_symbols
+
+
+def _case_backtest(n_bars, n_symbols, seed):
+    backtester = PivotBacktester(lookback_days=7)
+    frames = {symbol: backtester.calculate_pivot_points(df)
+              for symbol, df in synthetic_symbols(n_symbols, n_bars, seed).items()}
+
+    def run():
+        return [backtester.run_backtest(df, symbol, **BACKTEST_PARAMS) for symbol, df in frames.items()]
+
+    return run, n_bars * n_symbols
+
+
+def synthetic_costs(frames, seed=0):
+    """CostModel z dziennym spreadem (1-4 pipsy) i stałym swapem dla symboli z frames"""
+    rng = np.random.default_rng(seed)
+    spreads, swaps = {}, {}
+    for symbol, df in frames.items():
+        days = pd.date_range(df['Date'].iloc[0].normalize(), df['Date'].iloc[-1], freq='D')
+        pip = 0.01 if 'JPY' in symbol else 0.0001
+        spreads[symbol] = pd.DataFrame({'Date': days, 'Spread': rng.uniform(1, 4, len(days)) * pip})
+        swaps[symbol] = pd.DataFrame({'Date': days[:1], 'Long': [-0.5], 'Short': [0.1]})
+    return CostModel(spreads, swaps, BACKTEST_PARAMS['spread_value'])
+
+
+def _case_backtest_costs(n_bars, n_symbols, seed):
+    frames = synthetic_symbols(n_symbols, n_bars, seed)
+    backtester = PivotBacktester(lookback_days=7, costs=synthetic_costs(frames, seed))
+    frames = {symbol: backtester.calculate_pivot_points(df) for symbol, df in frames.items()}
+
+    def run():
+        return [backtester.run_backtest(df, symbol, **BACKTEST_PARAMS) for symbol, df in frames.items()]
+
+    return run, n_bars * n_symbols
+
+
+def _case_backtest_chunked(n_bars, n_symbols, seed):
+    # Dane generowane w trakcie (jak czytanie pliku paczkami) - mierzy cały tryb out-of-core
+    def run():
+        return [
+            run_backtest_chunked(iter_synthetic_ohlc(n_bars, seed + i), f"SYM{i:03d}", 7, **BACKTEST_PARAMS)
+            for i in range(n_symbols)
+        ]
+
+    return run, n_bars * n_symbols
+
+
+def _case_portfolio(n_bars, n_symbols, seed):
+    backtester = PivotBacktester(lookback_days=7)
+    frames = {symbol: backtester.calculate_pivot_points(df)
+              for symbol, df in synthetic_symbols(n_symbols, n_bars, seed).items()}
+    return lambda: run_portfolio_backtest(frames, **BACKTEST_PARAMS), n_bars * n_symbols
+
+
+def _case_fees(n_trades, n_symbols, seed):
+    trades = synthetic_trades(n_trades, seed, n_symbols=n_symbols)
+    return lambda: calculate_yearly_stats_with_fees(trades, 10000, 1.5, 12.0), n_trades * n_symbols
+
+
+# nazwa: (przygotowanie -> (funkcja, liczba elementów), jednostka, czy zależy od liczby symboli)
+CASES = {
+    'pivots': (_case_pivots, 'bars', True),
+    'backtest': (_case_backtest, 'bars', True),
+    'backtest_costs': (_case_backtest_costs, 'bars', False),
+    'backtest_chunked': (_case_backtest_chunked, 'bars', False),
+    'portfolio': (_case_portfolio, 'bars', True),
+    'fees': (_case_fees, 'trades', True)
+}
+
+
+def case_key(case, size, n_symbols):
+    return f"{case}/n={size}/symbols={n_symbols}"
+
+
+def plan_cases(cases, sizes, symbol_counts):
+    """Lista (case, size, n_symbols); przypadki wielosymbolowe do MAX_TOTAL_BARS barów łącznie"""
+    plan = []
+    for case in cases:
+        per_symbols = CASES[case][2]
+        for size in sizes:
+            for n_symbols in (symbol_counts if per_symbols else [1]):
+                if per_symbols and size * n_symbols > MAX_TOTAL_BARS:
+                    continue
+                plan.append((case, size, n_symbols))
+    return plan
+
+
+def measure(case, size, n_symbols, repeat=5, seed=0, memory=True):
+    """Najlepszy czas z repeat próbek + szczytowa pamięć z osobnego przebiegu"""
+    setup, unit, _ = CASES[case]
+    run, items = setup(size, n_symbols, seed)
+
+    gc.collect()
+    started = time.perf_counter()
+    run()
+    first = time.perf_counter() - started
+
+    # Szybkie przypadki w pętli min. MIN_SAMPLE_SECONDS na próbkę (jak timeit.autorange),
+    # duże raz - tu liczy się skala, nie szum pomiaru
+    timings = [first]
+    if first < MIN_SAMPLE_SECONDS * repeat:
+        loops = max(1, int(np.ceil(MIN_SAMPLE_SECONDS / max(first, 1e-6))))
+        timings = []
+        for _ in range(repeat):
+            gc.collect()
+            started = time.perf_counter()
+            for _ in range(loops):
+                run()
+            timings.append((time.perf_counter() - started) / loops)
+
+    peak_mb = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        run()
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        tracemalloc.stop()
+
+    seconds = min(timings)
+    return {
+        'case': case,
+        'size': size,
+        'symbols': n_symbols,
+        'items': items,
+        'unit': unit,
+        'seconds': seconds,
+        'throughput': items / seconds if seconds > 0 else float('inf'),
+        'peak_mb': peak_mb
+    }
+
+
+# ============================================
+# KONTROLA CACHE WYNIKÓW
+# ============================================
+
+def check_portfolio_cache(n_bars=2000, n_symbols=2, seed=0, lookbacks=(7, 14, 7)):
+    """
+    Wspólny margin z ResultCache: te same pliki przeliczane kolejno z różnym lookback.
+    Portfel z cache musi być równy przeliczonemu bez cache. Zwraca listę opisów niezgodności.
+    """
+    files = {symbol: df.to_csv(index=False) for symbol, df in synthetic_symbols(n_symbols, n_bars, seed).items()}
+    params = tuple(BACKTEST_PARAMS.values())
+    cache = ResultCache()
+    failures = []
+    for lookback in lookbacks:
+        backtester = PivotBacktester(lookback_days=lookback)
+        outcomes = {
+            symbol: process_symbol(backtester, symbol, io.StringIO(text), None, params,
+                                   shared_margin=True, result_cache=cache)
+            for symbol, text in files.items()
+        }
+        cached, _ = assemble_portfolio(list(files), outcomes, params[0], params, True, cache)
+        fresh, _ = assemble_portfolio(list(files), outcomes, params[0], params, True)
+        if not cached.equals(fresh):
+            failures.append(f"lookback={lookback}: portfel z cache ({len(cached)} transakcji) "
+                            f"różny od przeliczonego ({len(fresh)})")
+    return failures
+
+
+# ============================================
+# BASELINE I RAPORT
+# ============================================
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as handle:
+        return json.load(handle).get('results', {})
+
+
+def save_baseline(path, results):
+    payload = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'results': {case_key(r['case'], r['size'], r['symbols']): r for r in results}
+    }
+    with open(path, 'w', encoding='utf-8') as handle:
+        json.dump(payload, handle, indent=2)
+
+
+def compare(result, baseline, tolerance):
+    """(zmiana przepustowości, zmiana pamięci, czy regresja) względem baseline"""
+    reference = baseline.get(case_key(result['case'], result['size'], result['symbols']))
+    if reference is None:
+        return None, None, False
+
+    speed_change = result['throughput'] / reference['throughput'] - 1
+    memory_change = None
+    if result['peak_mb'] is not None and reference.get('peak_mb'):
+        memory_change = result['peak_mb'] / reference['peak_mb'] - 1
+
+    regressed = speed_change < -tolerance or (memory_change is not None and memory_change > tolerance)
+    return speed_change, memory_change, regressed
+
+
+def format_row(result, speed_change, memory_change, regressed):
+    peak = f"{result['peak_mb']:9.1f}" if result['peak_mb'] is not None else f"{'-':>9}"
+    speed = f"{speed_change * 100:+7.1f}%" if speed_change is not None else f"{'-':>8}"
+    memory = f"{memory_change * 100:+7.1f}%" if memory_change is not None else f"{'-':>8}"
+    flag = '  REGRESJA' if regressed else ''
+    return (f"{result['case']:<17}{result['size']:>11,}{result['symbols']:>5}"
+            f"{result['seconds']:>10.3f}{result['throughput']:>14,.0f} {result['unit']:<7}"
+            f"{peak}{speed}{memory}{flag}")
+
+
+HEADER = (f"{'case':<17}{'n':>11}{'sym':>5}{'czas [s]':>10}{'przepustowość/s':>22}"
+          f"{'peak MB':>9}{'Δ speed':>8}{'Δ mem':>8}")
+
+
+def _int_list(text):
+    return [int(value.replace('_', '')) for value in text.replace(',', ' ').split()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark silnika pivot (dane syntetyczne GBM)")
+    parser.add_argument('--full', action='store_true', help="pełny zakres: 1k-10M barów, 1-50 symboli")
+    parser.add_argument('--cases', default=','.join(CASES), help=f"przypadki: {', '.join(CASES)}")
+    parser.add_argument('--sizes', type=_int_list, help="liczby barów, np. 1000,100000")
+    parser.add_argument('--symbols', type=_int_list,
+                        help="liczby symboli (pivots, backtest, portfolio, fees), np. 1,10,50")
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help="bez przebiegu tracemalloc")
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="zapisz wyniki jako baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="dopuszczalna zmiana (0.25 = 25%%)")
+    parser.add_argument('--check', action='store_true', help="tylko kontrola cache wyników (bez pomiarów)")
+    args = parser.parse_args(argv)
+
+    if args.check:
+        failures = check_portfolio_cache(seed=args.seed)
+        for failure in failures:
+            print(f"BŁĄD cache: {failure}")
+        print("Cache wyników: OK" if not failures else f"{len(failures)} niezgodności cache")
+        return 1 if failures else 0
+
+    cases = [case.strip() for case in args.cases.split(',') if case.strip()]
+    unknown = [case for case in cases if case not in CASES]
+    if unknown:
+        parser.error(f"nieznane przypadki: {', '.join(unknown)}")
+
+    sizes = args.sizes or (FULL_SIZES if args.full else QUICK_SIZES)
+    symbol_counts = args.symbols or (FULL_SYMBOLS if args.full else QUICK_SYMBOLS)
+    baseline = {} if args.save_baseline else load_baseline(args.baseline)
+
+    print(f"Python {platform.python_version()} | numpy {np.__version__} | pandas {pd.__version__} | "
+          f"CPU {os.cpu_count()} | baseline: {args.baseline if baseline else 'brak'}")
+    print(HEADER)
+
+    results = []
+    regressions = 0
+    for case, size, n_symbols in plan_cases(cases, sizes, symbol_counts):
+        result = measure(case, size, n_symbols, args.repeat, args.seed, not args.no_memory)
+        speed_change, memory_change, regressed = compare(result, baseline, args.tolerance)
+        regressions += regressed
+        results.append(result)
+        print(format_row(result, speed_change, memory_change, regressed), flush=True)
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"Zapisano baseline: {args.baseline}")
+    elif regressions:
+        print(f"{regressions} regresji (tolerancja {args.tolerance:.0%})")
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
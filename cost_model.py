@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Model kosztów transakcyjnych dla silnika pivot: spread zmienny w czasie + swap (carry).
+
+- spread: seria per symbol (Date, Spread w jednostkach ceny), wartość obowiązuje
+  od swojej daty do następnej; przed pierwszą obserwacją - default_spread
+- swap: tabela per symbol (Date, Long, Short) w punktach (pipsach) za noc
+  na jednostkę wolumenu; dodatni = dopisany, ujemny = pobrany
+
+Pliki CSV albo Parquet w układzie długim (kolumna Symbol) - wczytywane raz,
+potem tylko tablice NumPy. Swap liczony z sum narastających po dniach
+kalendarzowych, więc koszt carry pozycji to różnica dwóch wartości (O(1)),
+niezależnie od holding_days. Noce piątek->poniedziałek liczone jako 3
+(jak potrójny swap u brokera, rozłożony na dni kalendarzowe).
+"""
+
+import bisect
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+DAY_NS = 86_400 * 10 ** 9
+_NS = np.dtype('datetime64[ns]')
+
+SPREAD_COLUMNS = ['Date', 'Symbol', 'Spread']
+SWAP_COLUMNS = ['Date', 'Symbol', 'Long', 'Short']
+
+
+def _to_ns(date):
+    """Data -> int ns (szybka ścieżka dla np.datetime64[ns] z silnika)"""
+    if isinstance(date, np.datetime64) and date.dtype == _NS:
+        return date.item()
+    return int(np.datetime64(date, 'ns').view(np.int64))
+
+
+def _pip_value(symbol):
+    return 0.01 if 'JPY' in symbol else 0.0001
+
+
+def _read_table(path, columns):
+    """CSV/Parquet (ścieżka albo plik z atrybutem name) z wymaganymi kolumnami"""
+    name = str(getattr(path, 'name', path))
+    if name.lower().endswith('.parquet'):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+
+    renamed = {col: name for col in df.columns for name in columns if str(col).strip().lower() == name.lower()}
+    df = df.rename(columns=renamed)
+    missing = [name for name in columns if name not in df.columns]
+    if missing:
+        raise ValueError(f"{os.path.basename(name)}: brak kolumn {', '.join(missing)}")
+
+    df = df[columns].dropna()
+    df['Date'] = pd.to_datetime(df['Date'])
+    df['Symbol'] = df['Symbol'].astype(str).str.strip().str.upper().str.replace('=X', '', regex=False)
+    return df.sort_values(['Symbol', 'Date'], kind='stable')
+
+
+class _SwapCarry:
+    """Suma narastająca swapu (w cenie) na dziennej siatce od pierwszej daty tabeli"""
+    __slots__ = ('start_day', 'cum_long', 'cum_short', 'last_long', 'last_short',
+                 'first_long', 'first_short')
+
+    def __init__(self, days, long_price, short_price):
+        self.start_day = int(days[0])
+        grid = np.arange(self.start_day, int(days[-1]) + 1)
+        row = np.searchsorted(days, grid, side='right') - 1
+        daily_long, daily_short = long_price[row], short_price[row]
+        # cum[k] = swap za noce dni start..start+k-1 (listy: szybki dostęp skalarny)
+        self.cum_long = np.r_[0.0, np.cumsum(daily_long)].tolist()
+        self.cum_short = np.r_[0.0, np.cumsum(daily_short)].tolist()
+        self.first_long, self.first_short = float(daily_long[0]), float(daily_short[0])
+        self.last_long, self.last_short = float(daily_long[-1]), float(daily_short[-1])
+
+    def cumulative(self, day, is_long):
+        """Swap narastający do początku dnia `day` (poza tabelą: stawka skrajna)"""
+        cum = self.cum_long if is_long else self.cum_short
+        k = day - self.start_day
+        if k < 0:
+            return k * (self.first_long if is_long else self.first_short)
+        last = len(cum) - 1
+        if k > last:
+            return cum[last] + (k - last) * (self.last_long if is_long else self.last_short)
+        return cum[k]
+
+
+class CostModel:
+    """
+    Spread i swap per symbol dla _PortfolioState (silnik tablicowy).
+
+    spreads: {symbol: df Date/Spread}, swaps: {symbol: df Date/Long/Short (pipsy)}.
+    Symbol bez serii spreadu używa default_spread, bez tabeli swapów - zero carry.
+    Zapytania skalarne (per transakcja w silniku) idą po listach Pythona (bisect),
+    serie dla całych osi czasu - po tablicach NumPy.
+
+    Silnik pyta o koszt przy każdym otwarciu/zamknięciu zamiast rozliczać koszty
+    wszystkich transakcji jednym searchsorted po symulacji: spread wejścia i wynik
+    z kosztami zmieniają kapitał, od którego liczony jest wolumen kolejnych pozycji
+    (compound, podłoga 0, margin), a IncrementalPivotStrategy dostaje bary pojedynczo.
+    Koszt zapytania jest stały (bisect + różnica sum narastających), nie zależy od holding_days.
+    """
+
+    def __init__(self, spreads=None, swaps=None, default_spread=0.0002):
+        self.default_spread = default_spread
+        self._spreads = {}
+        self._spread_lists = {}
+        self._swaps = {}
+
+        digest = hashlib.blake2b(repr(float(default_spread)).encode(), digest_size=16)
+
+        for symbol, df in sorted((spreads or {}).items()):
+            dates = df['Date'].to_numpy(dtype='datetime64[ns]').view(np.int64)
+            values = df['Spread'].to_numpy(dtype=np.float64)
+            self._spreads[symbol] = (dates, values)
+            self._spread_lists[symbol] = (dates.tolist(), values.tolist())
+            digest.update(f"spread:{symbol}".encode())
+            digest.update(dates.tobytes())
+            digest.update(values.tobytes())
+
+        for symbol, df in sorted((swaps or {}).items()):
+            if len(df) == 0:
+                continue
+            days = df['Date'].to_numpy(dtype='datetime64[ns]').view(np.int64) // DAY_NS
+            pip_value = _pip_value(symbol)
+            long_points = df['Long'].to_numpy(dtype=np.float64)
+            short_points = df['Short'].to_numpy(dtype=np.float64)
+            self._swaps[symbol] = _SwapCarry(days, long_points * pip_value, short_points * pip_value)
+            digest.update(f"swap:{symbol}".encode())
+            for values in (days, long_points, short_points):
+                digest.update(values.tobytes())
+
+        self.fingerprint = digest.hexdigest()
+
+    @classmethod
+    def from_files(cls, spread_path=None, swap_path=None, default_spread=0.0002):
+        """Model z plików w układzie długim (SPREAD_COLUMNS / SWAP_COLUMNS)"""
+        spreads, swaps = {}, {}
+        if spread_path:
+            for symbol, df in _read_table(spread_path, SPREAD_COLUMNS).groupby('Symbol', sort=False):
+                spreads[symbol] = df
+        if swap_path:
+            for symbol, df in _read_table(swap_path, SWAP_COLUMNS).groupby('Symbol', sort=False):
+                swaps[symbol] = df
+        return cls(spreads, swaps, default_spread)
+
+    def spread_series(self, symbol, dates):
+        """Spread dla tablicy dat (datetime64) - jedno searchsorted dla całej serii"""
+        dates = np.asarray(dates, dtype='datetime64[ns]').view(np.int64)
+        if symbol not in self._spreads:
+            return np.full(len(dates), float(self.default_spread))
+        series_dates, values = self._spreads[symbol]
+        row = np.searchsorted(series_dates, dates, side='right') - 1
+        return np.where(row >= 0, values[np.maximum(row, 0)], self.default_spread)
+
+    def spread_at(self, symbol, date):
+        """Spread obowiązujący w chwili date (datetime64 / int ns)"""
+        series = self._spread_lists.get(symbol)
+        if series is None:
+            return self.default_spread
+        row = bisect.bisect_right(series[0], _to_ns(date)) - 1
+        return series[1][row] if row >= 0 else self.default_spread
+
+    def swap_price(self, symbol, is_long, entry_date, exit_date):
+        """Swap za noce [entry_date, exit_date) w jednostkach ceny na jednostkę wolumenu"""
+        carry = self._swaps.get(symbol)
+        if carry is None:
+            return 0.0
+        entry_day = _to_ns(entry_date) // DAY_NS
+        exit_day = _to_ns(exit_date) // DAY_NS
+        return carry.cumulative(exit_day, is_long) - carry.cumulative(entry_day, is_long)
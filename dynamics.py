@@ -4,8 +4,17 @@ import numpy as np
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, wait
 import yfinance as yf
 import warnings
+
+from bar_store import BarStore
+from fair_value_engine import (
+    MIN_MERGED_OBS, REVERSION_THRESHOLDS, apply_fair_value, pair_frame, reversion_events, reversion_summary,
+    rolling_fair_value, scan_pairs, yield_curve_frame
+)
+from fred_store import FRED_MAX_AGE, FredStore, default_source
+
 warnings.filterwarnings('ignore')
 
 # Page config
@@ -167,100 +176,173 @@ FX_SYMBOLS = {
 }
 
 
-@st.cache_data(ttl=3600)
-def fetch_fred_data(series_id, start_date="2010-01-01"):
-    """Fetch data from FRED API"""
-    try:
-        url = f"https://fred.stlouisfed.org/graph/fredgraph.csv?id={series_id}&cosd={start_date}"
-        df = pd.read_csv(url)
-        df.columns = ['Date', 'Value']
-        df['Date'] = pd.to_datetime(df['Date'])
-        df['Value'] = pd.to_numeric(df['Value'], errors='coerce')
-        df = df.dropna()
-        return df
-    except Exception as e:
-        st.error(f"Error fetching FRED data ({series_id}): {e}")
-        return None
+# Treasury yields: 10Y, 30Y
+FRED_SERIES = ['DGS10', 'DGS30']
+FRED_START = "2010-01-01"
 
 
-@st.cache_data(ttl=3600)
-def fetch_fx_data(symbol, days=3650):
-    """Fetch FX data from Yahoo Finance - metoda z działającego kodu"""
-    try:
-        yf_symbol = FX_SYMBOLS.get(symbol, f"{symbol}=X")
-        ticker = yf.Ticker(yf_symbol)
-        
-        # Metoda 1: period
-        data = ticker.history(period=f"{days}d", interval="1d")
-        
-        # Metoda 2: start/end jeśli pierwsza nie zadziała
-        if data.empty:
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=days + 5)
-            data = ticker.history(start=start_date, end=end_date, interval="1d")
-        
-        if data.empty:
-            return None
-        
-        data = data.dropna()
-        
-        # Obsługa timezone
-        if hasattr(data.index, 'tz_localize'):
-            try:
-                if data.index.tz is not None:
-                    data.index = data.index.tz_convert(None)
-            except:
-                pass
-        
-        df = pd.DataFrame({
-            'Date': pd.to_datetime(data.index),
-            'Value': data['Close'].astype(float)
-        }).reset_index(drop=True)
-        
-        df = df.dropna()
-        
-        return df
-        
-    except Exception as e:
-        st.error(f"Error fetching FX data ({symbol}): {e}")
-        return None
+# Etap pobierania: limit czasu (s) pojedynczego zapytania i całego etapu, ważność cache FX (s)
+FETCH_TIMEOUT = 20
+FX_MAX_AGE = 3600
+
+
+@st.cache_resource
+def get_fred_store():
+    """Magazyn serii FRED na dysku - wspólny dla sesji i procesów (SQLite)"""
+    return FredStore()
 
 
-def calculate_regression(x, y):
-    """Calculate linear regression and statistics"""
-    mask = ~(np.isnan(x) | np.isnan(y))
-    x_clean, y_clean = x[mask], y[mask]
+@st.cache_resource
+def get_bar_store():
+    """Magazyn barów dziennych FX - ten sam co w premiumhedge / pivot_backtester"""
+    return BarStore()
+
+
+def fx_store_symbol(symbol):
+    """Para z FX_SYMBOLS -> symbol w magazynie barów (EUR/USD -> EURUSD)"""
+    return FX_SYMBOLS.get(symbol, f"{symbol}=X").replace('=X', '')
+
+
+def download_fx_data(symbol, days=3650, timeout=FETCH_TIMEOUT, start=None, end=None):
+    """
+    Bary dzienne z Yahoo Finance (Date/Open/High/Low/Close) - bez Streamlit, wywoływane z wątków.
+    Ostatnie days dni albo zakres [start, end).
+    """
+    yf_symbol = FX_SYMBOLS.get(symbol, f"{symbol}=X")
+    ticker = yf.Ticker(yf_symbol)
     
-    if len(x_clean) < 10:
+    if start is not None:
+        data = ticker.history(start=start, end=end, interval="1d", timeout=timeout)
+    else:
+        # Metoda 1: period
+        data = ticker.history(period=f"{days}d", interval="1d", timeout=timeout)
+    
+    # Metoda 2: start/end jeśli pierwsza nie zadziała
+    if data.empty and start is None:
+        end_date = datetime.now()
+        start_date = end_date - timedelta(days=days + 5)
+        data = ticker.history(start=start_date, end=end_date, interval="1d", timeout=timeout)
+    
+    if data.empty:
+        raise ValueError(f"no data for {yf_symbol}")
+    
+    data = data.dropna()
+    
+    # Obsługa timezone
+    if hasattr(data.index, 'tz_localize'):
+        try:
+            if data.index.tz is not None:
+                data.index = data.index.tz_convert(None)
+        except:
+            pass
+    
+    df = pd.DataFrame({
+        'Date': pd.to_datetime(data.index),
+        'Open': data['Open'].astype(float),
+        'High': data['High'].astype(float),
+        'Low': data['Low'].astype(float),
+        'Close': data['Close'].astype(float)
+    }).reset_index(drop=True)
+    
+    return df.dropna()
+
+
+def refresh_fx_data(bar_store, symbol, days=3650, max_age=FX_MAX_AGE, timeout=FETCH_TIMEOUT):
+    """
+    Dociągnij do magazynu barów tylko brakujące bary pary: historię przed zapisanym zakresem
+    i ogon od ostatniego zapisanego baru (jak PivotBacktester.get_forex_data). Ogon pobierany,
+    gdy minął dzień albo ostatnie pobranie jest starsze niż max_age. Zwraca liczbę barów.
+    """
+    store_symbol = fx_store_symbol(symbol)
+    end = pd.Timestamp.now().normalize() + pd.Timedelta(days=1)
+    start = end - pd.Timedelta(days=days + 1)
+    
+    written = 0
+    for range_start, range_end in bar_store.missing_ranges(store_symbol, '1d', start, end, max_age):
+        df = download_fx_data(symbol, days, timeout, range_start, range_end)
+        bar_store.write(store_symbol, '1d', df)
+        bar_store.mark_fetched(store_symbol, '1d', range_start, range_end)
+        written += len(df)
+    return written
+
+
+def read_fx_data(bar_store, symbol, days=3650):
+    """Para z magazynu barów jako Date/Value (Close) albo None"""
+    start = pd.Timestamp.now().normalize() - pd.Timedelta(days=days)
+    df = bar_store.read(fx_store_symbol(symbol), '1d', start)
+    if len(df) == 0:
         return None
-    
-    # Linear regression
-    z = np.polyfit(x_clean, y_clean, 1)
-    slope, intercept = z[0], z[1]
-    
-    # Predictions and residuals
-    y_pred = slope * x_clean + intercept
-    residuals = y_clean - y_pred
-    
-    # R-squared
-    ss_res = np.sum(residuals**2)
-    ss_tot = np.sum((y_clean - np.mean(y_clean))**2)
-    r_squared = 1 - (ss_res / ss_tot) if ss_tot != 0 else 0
-    
-    # Correlation
-    correlation = np.corrcoef(x_clean, y_clean)[0, 1]
-    
-    # Standard error
-    std_error = np.std(residuals)
-    
-    return {
-        'slope': slope,
-        'intercept': intercept,
-        'r_squared': r_squared,
-        'correlation': correlation,
-        'std_error': std_error,
-        'n_obs': len(x_clean)
+    return pd.DataFrame({'Date': df['Date'], 'Value': df['Close']})
+
+
+def fetch_market_data(fx_pairs, days=3650, timeout=FETCH_TIMEOUT, force=()):
+    """
+    Etap pobierania: DGS10, DGS30 (FRED) i pary FX (Yahoo) równolegle - rentowności raz dla wszystkich par.
+    
+    Każde źródło we własnym wątku (wszystkie startują od razu), timeout na każde zapytanie
+    i na cały etap - czas etapu = najwolniejsze pojedyncze źródło. Źródło z błędem
+    albo bez odpowiedzi w czasie -> ostatnie dane z lokalnego cache (magazyn FRED /
+    magazyn barów). force: źródła (seria FRED albo para) odświeżane mimo świeżego cache.
+    Zwraca (y10_df, y30_df, {para: fx_df}, fallbacks: {źródło: (powód, czy są dane w cache)});
+    brak danych = None.
+    """
+    fred_store, bar_store = get_fred_store(), get_bar_store()
+    source = default_source(timeout)
+    started = set()
+    
+    def run_source(name, refresh, *args):
+        started.add(name)
+        return refresh(*args)
+    
+    pool = ThreadPoolExecutor(max_workers=len(FRED_SERIES) + len(fx_pairs))
+    futures = {
+        pool.submit(run_source, series_id, fred_store.refresh, series_id, source, FRED_START,
+                    0 if series_id in force else FRED_MAX_AGE): series_id
+        for series_id in FRED_SERIES
     }
+    for fx_pair in fx_pairs:
+        futures[pool.submit(run_source, fx_pair, refresh_fx_data, bar_store, fx_pair, days,
+                            0 if fx_pair in force else FX_MAX_AGE, timeout)] = fx_pair
+    _, pending = wait(futures, timeout=timeout)
+    # Nie czekamy na zawieszone źródło - wątek skończy się po timeout własnego zapytania
+    pool.shutdown(wait=False, cancel_futures=True)
+    
+    reasons = {}
+    for future, name in futures.items():
+        if future in pending:
+            reasons[name] = f"no response within {timeout}s" if name in started else "not started"
+        elif future.exception() is not None:
+            reasons[name] = str(future.exception())
+    
+    y10_df, y30_df = [fred_store.read(series_id, FRED_START) for series_id in FRED_SERIES]
+    fx_data = {fx_pair: read_fx_data(bar_store, fx_pair, days) for fx_pair in fx_pairs}
+    cached = {series_id: len(df) > 0 for series_id, df in zip(FRED_SERIES, (y10_df, y30_df))}
+    cached.update({fx_pair: fx_df is not None for fx_pair, fx_df in fx_data.items()})
+    fallbacks = {name: (reason, cached[name]) for name, reason in reasons.items()}
+    return (
+        y10_df if len(y10_df) > 0 else None,
+        y30_df if len(y30_df) > 0 else None,
+        fx_data,
+        fallbacks
+    )
+
+
+def show_fallbacks(fallbacks):
+    """Źródła nieodświeżone: ostrzeżenie, gdy są dane z cache, błąd, gdy cache jest pusty"""
+    for source_name, (reason, cached) in fallbacks.items():
+        if cached:
+            st.warning(f"⚠️ {source_name}: refresh failed ({reason}) — using locally cached data")
+        else:
+            st.error(f"❌ {source_name}: refresh failed ({reason}) — no data available (local cache is empty)")
+
+
+# Okna regresji w obserwacjach (dni sesyjne); None = wszystkie dane
+REGRESSION_WINDOWS = {
+    "All data": None,
+    "Last 52 weeks": 252,
+    "Last 104 weeks": 504,
+    "Last 3 years": 756
+}
 
 
 # =====================================================
@@ -290,24 +372,29 @@ with st.sidebar:
     
     regression_window = st.selectbox(
         "Regression Window",
-        ["All data", "Last 52 weeks", "Last 104 weeks", "Last 3 years"],
+        list(REGRESSION_WINDOWS.keys()),
         index=0
     )
     
     st.markdown("---")
     
+    refresh_target = st.selectbox(
+        "Refresh Series",
+        ["All"] + FRED_SERIES + [fx_pair],
+        index=0,
+        help="FRED: only new observations are downloaded; other cached data is kept"
+    )
+    
+    force_refresh = ()
     if st.button("🔄 Refresh Data", use_container_width=True):
-        st.cache_data.clear()
-        st.rerun()
+        force_refresh = FRED_SERIES + [fx_pair] if refresh_target == "All" else [refresh_target]
 
-# Fetch data
+# Fetch data: FRED (10Y, 30Y Treasury yields) + Yahoo (FX pair) concurrently
 with st.spinner("📡 Fetching data from FRED and Yahoo Finance..."):
-    # FRED: 10Y and 30Y Treasury yields
-    y10_df = fetch_fred_data("DGS10", "2010-01-01")
-    y30_df = fetch_fred_data("DGS30", "2010-01-01")
-    
-    # Yahoo: FX pair
-    fx_df = fetch_fx_data(fx_pair, period_days[data_period])
+    y10_df, y30_df, fx_data, fallbacks = fetch_market_data([fx_pair], period_days[data_period], force=force_refresh)
+    fx_df = fx_data[fx_pair]
+
+show_fallbacks(fallbacks)
 
 # Check data
 if y10_df is None or y30_df is None:
@@ -318,44 +405,21 @@ if fx_df is None:
     st.error(f"❌ Failed to load FX data for {fx_pair} from Yahoo Finance")
     st.stop()
 
-# Process data
-# Merge yield data
-yields_df = y10_df.merge(y30_df, on='Date', suffixes=('_10Y', '_30Y'))
-yields_df['Spread'] = yields_df['Value_30Y'] - yields_df['Value_10Y']
-yields_df = yields_df[['Date', 'Value_10Y', 'Value_30Y', 'Spread']]
-yields_df.columns = ['Date', 'Y10', 'Y30', 'Spread']
-
-# Merge with FX
-df = yields_df.merge(fx_df, on='Date', how='inner')
-df.columns = ['Date', 'Y10', 'Y30', 'Spread', 'FX']
-df = df.sort_values('Date').reset_index(drop=True)
+# Process data: yield curve (30Y-10Y spread) + FX
+yields_df = yield_curve_frame(y10_df, y30_df)
+df = pair_frame(yields_df, fx_df)
 
-if len(df) < 50:
+if len(df) < MIN_MERGED_OBS:
     st.error(f"❌ Not enough data points after merge: {len(df)}")
     st.stop()
 
-# Apply regression window
-if regression_window == "Last 52 weeks":
-    reg_df = df.tail(252)
-elif regression_window == "Last 104 weeks":
-    reg_df = df.tail(504)
-elif regression_window == "Last 3 years":
-    reg_df = df.tail(756)
-else:
-    reg_df = df
-
-# Calculate regression
-stats = calculate_regression(reg_df['Spread'].values, reg_df['FX'].values)
+# Regression over the selected window, fair value for full dataset
+stats = apply_fair_value(df, REGRESSION_WINDOWS[regression_window])
 
 if stats is None:
     st.error("❌ Could not calculate regression - not enough data")
     st.stop()
 
-# Fair value for full dataset
-df['Fair_Value'] = stats['slope'] * df['Spread'] + stats['intercept']
-df['Deviation'] = df['FX'] - df['Fair_Value']
-df['Deviation_Pct'] = (df['Deviation'] / df['Fair_Value']) * 100
-
 # Current values
 current = df.iloc[-1]
 
@@ -840,6 +904,84 @@ fig2.update_yaxes(title_text="Deviation (%)", row=3, col=1)
 
 st.plotly_chart(fig2, use_container_width=True)
 
+# =====================================================
+# ROLLING REGRESSION
+# =====================================================
+st.markdown('<div class="section-header">🔁 Time-Varying Beta</div>', unsafe_allow_html=True)
+
+rolling_windows = st.multiselect(
+    "Rolling Windows",
+    [name for name, rows in REGRESSION_WINDOWS.items() if rows is not None],
+    default=["Last 52 weeks", "Last 3 years"],
+    help="Regression re-estimated on every day over the trailing window"
+)
+
+if rolling_windows:
+    rolling = rolling_fair_value(
+        df['Spread'].to_numpy(), df['FX'].to_numpy(),
+        [REGRESSION_WINDOWS[name] for name in rolling_windows]
+    )
+    window_colors = ['#ffd700', '#00b4d8', '#e94560']
+    
+    fig3 = make_subplots(
+        rows=3, cols=1,
+        subplot_titles=(f'{fx_pair}: Actual vs Rolling Fair Value', 'Rolling Slope (β)', 'Rolling R²'),
+        vertical_spacing=0.08,
+        row_heights=[0.4, 0.3, 0.3],
+        shared_xaxes=True
+    )
+    
+    fig3.add_trace(go.Scatter(
+        x=df['Date'], y=df['FX'],
+        name='Actual', line=dict(color='#00d26a', width=2)
+    ), row=1, col=1)
+    
+    for name, color in zip(rolling_windows, window_colors):
+        result = rolling[REGRESSION_WINDOWS[name]]
+        fig3.add_trace(go.Scatter(
+            x=df['Date'], y=result['Fair_Value'],
+            name=f'FV {name}', line=dict(color=color, width=1.5, dash='dash'), legendgroup=name
+        ), row=1, col=1)
+        fig3.add_trace(go.Scatter(
+            x=df['Date'], y=result['slope'],
+            name=f'β {name}', line=dict(color=color, width=2), legendgroup=name, showlegend=False
+        ), row=2, col=1)
+        fig3.add_trace(go.Scatter(
+            x=df['Date'], y=result['r_squared'],
+            name=f'R² {name}', line=dict(color=color, width=2), legendgroup=name, showlegend=False
+        ), row=3, col=1)
+    
+    fig3.add_hline(y=0, line_dash="solid", line_color="white", opacity=0.3, row=2, col=1)
+    
+    fig3.update_layout(
+        template='plotly_dark',
+        height=800,
+        showlegend=True,
+        hovermode='x unified'
+    )
+    
+    fig3.update_yaxes(title_text=fx_pair, row=1, col=1)
+    fig3.update_yaxes(title_text="β", row=2, col=1)
+    fig3.update_yaxes(title_text="R²", range=[0, 1], row=3, col=1)
+    
+    st.plotly_chart(fig3, use_container_width=True)
+    
+    latest = pd.DataFrame([
+        {
+            'Window': name,
+            'Slope (β)': rolling[REGRESSION_WINDOWS[name]]['slope'].iloc[-1],
+            'R²': rolling[REGRESSION_WINDOWS[name]]['r_squared'].iloc[-1],
+            'Fair Value': rolling[REGRESSION_WINDOWS[name]]['Fair_Value'].iloc[-1],
+            'Deviation (%)': rolling[REGRESSION_WINDOWS[name]]['Deviation_Pct'].iloc[-1]
+        }
+        for name in rolling_windows
+    ])
+    st.dataframe(
+        latest.style.format({'Slope (β)': '{:.4f}', 'R²': '{:.1%}', 'Fair Value': '{:.4f}', 'Deviation (%)': '{:+.2f}'}),
+        hide_index=True,
+        use_container_width=True
+    )
+
 # =====================================================
 # MEAN REVERSION ANALYSIS
 # =====================================================
@@ -847,51 +989,19 @@ st.markdown('<div class="section-header">⏱️ Mean Reversion Analysis</div>',
 
 threshold = st.select_slider(
     "Deviation Threshold (%)",
-    options=[0.5, 1.0, 1.5, 2.0, 2.5, 3.0],
+    options=list(REVERSION_THRESHOLDS),
     value=1.0
 )
 
-# Find reversion events
-events = []
-i = 0
-while i < len(df):
-    if abs(df.iloc[i]['Deviation_Pct']) >= threshold:
-        start_idx = i
-        start_date = df.iloc[i]['Date']
-        start_dev = df.iloc[i]['Deviation_Pct']
-        direction = 'overvalued' if start_dev > 0 else 'undervalued'
-        
-        # Find return to threshold/2
-        for j in range(i + 1, len(df)):
-            if (start_dev > 0 and df.iloc[j]['Deviation_Pct'] <= threshold/2) or \
-               (start_dev < 0 and df.iloc[j]['Deviation_Pct'] >= -threshold/2):
-                days = j - i
-                events.append({
-                    'Start': start_date,
-                    'End': df.iloc[j]['Date'],
-                    'Days': days,
-                    'Direction': direction,
-                    'Start_Dev': start_dev
-                })
-                i = j
-                break
-        else:
-            events.append({
-                'Start': start_date,
-                'End': None,
-                'Days': None,
-                'Direction': direction,
-                'Start_Dev': start_dev,
-                'Ongoing': True
-            })
-            i = len(df)
-    else:
-        i += 1
+# Find reversion events: wszystkie progi naraz (fair_value_engine)
+all_events = reversion_events(df['Deviation_Pct'].to_numpy(), df['Date'].to_numpy(), REVERSION_THRESHOLDS)
+reversion_table = reversion_summary(all_events, REVERSION_THRESHOLDS, as_of=current['Date'])
 
-completed = [e for e in events if e.get('Days') is not None]
+events = all_events[all_events['Threshold'] == threshold]
+completed = events.dropna(subset=['Days'])
 
-if completed:
-    days_list = [e['Days'] for e in completed]
+if len(completed) > 0:
+    days_list = completed['Days'].to_numpy()
     
     col1, col2, col3, col4 = st.columns(4)
     with col1:
@@ -901,13 +1011,13 @@ if completed:
     with col3:
         st.metric("Median Days", f"{np.median(days_list):.0f}")
     with col4:
-        st.metric("Range", f"{min(days_list)} - {max(days_list)}")
+        st.metric("Range", f"{min(days_list):.0f} - {max(days_list):.0f}")
     
     # Current status
     if abs(current['Deviation_Pct']) >= threshold:
-        ongoing = [e for e in events if e.get('Ongoing')]
-        if ongoing:
-            days_ongoing = (current['Date'] - ongoing[-1]['Start']).days
+        ongoing = events[events['Ongoing']]
+        if len(ongoing) > 0:
+            days_ongoing = (current['Date'] - ongoing['Start'].iloc[-1]).days
             st.warning(f"""
                 ⚠️ **Current deviation exceeds {threshold}%!**  
                 {fx_pair} has been {abs(current['Deviation_Pct']):.2f}% from fair value for **{days_ongoing} days**.  
@@ -918,6 +1028,70 @@ if completed:
 else:
     st.info(f"No completed reversion events found at ±{threshold}% threshold")
 
+st.markdown("**All thresholds** — reversion to half the threshold, days in trading sessions")
+st.dataframe(
+    reversion_table.rename(columns={
+        'Threshold': 'Threshold (%)', 'Avg_Days': 'Avg Days', 'Median_Days': 'Median Days',
+        'Min_Days': 'Min Days', 'Max_Days': 'Max Days', 'Ongoing_Days': 'Ongoing (cal. days)'
+    }).style.format({
+        'Threshold (%)': '±{:.1f}', 'Avg Days': '{:.0f}', 'Median Days': '{:.0f}', 'Min Days': '{:.0f}',
+        'Max Days': '{:.0f}', 'Ongoing (cal. days)': '{:.0f}'
+    }, na_rep='—'),
+    hide_index=True,
+    use_container_width=True
+)
+
+# =====================================================
+# CROSS-PAIR SCAN
+# =====================================================
+st.markdown('<div class="section-header">🌐 Cross-Pair Scan</div>', unsafe_allow_html=True)
+
+st.caption(
+    f"All {len(FX_SYMBOLS)} pairs against the same Treasury curve: {regression_window.lower()} regression, "
+    f"reversion at ±{threshold}%. Ranked by absolute deviation from fair value."
+)
+
+if st.button("🔍 Scan All Pairs", use_container_width=True):
+    with st.spinner(f"📡 Fetching {len(FX_SYMBOLS)} FX pairs..."):
+        scan_y10, scan_y30, scan_fx, scan_fallbacks = fetch_market_data(list(FX_SYMBOLS), period_days[data_period])
+    if scan_y10 is None or scan_y30 is None:
+        st.error("❌ Failed to load Treasury yield data from FRED")
+    else:
+        st.session_state.pair_scan = {
+            'table': scan_pairs(yield_curve_frame(scan_y10, scan_y30), scan_fx,
+                                REGRESSION_WINDOWS[regression_window], threshold),
+            'settings': (regression_window, threshold, data_period),
+            'fallbacks': scan_fallbacks
+        }
+
+if 'pair_scan' in st.session_state:
+    pair_scan = st.session_state.pair_scan
+    scan_window, scan_threshold, scan_period = pair_scan['settings']
+    if (scan_window, scan_threshold, scan_period) != (regression_window, threshold, data_period):
+        st.info(f"Scan settings: {scan_window}, ±{scan_threshold}%, {scan_period} — rerun the scan to apply current settings")
+    show_fallbacks(pair_scan['fallbacks'])
+    
+    scan_table = pair_scan['table'].rename(columns={
+        'Fair_Value': 'Fair Value', 'Deviation_Pct': 'Deviation (%)', 'R_Squared': 'R²',
+        'Slope': 'Slope (β)', 'Median_Reversion_Days': 'Median Reversion (days)',
+        'Reversion_Events': 'Events', 'Ongoing_Days': 'Ongoing (cal. days)'
+    })
+    st.dataframe(
+        scan_table.style.format({
+            'Spot': '{:.4f}', 'Fair Value': '{:.4f}', 'Deviation (%)': '{:+.2f}', 'R²': '{:.1%}',
+            'Slope (β)': '{:.4f}', 'Median Reversion (days)': '{:.0f}', 'Events': '{:.0f}',
+            'Ongoing (cal. days)': '{:.0f}', 'Observations': '{:.0f}'
+        }, na_rep='—'),
+        hide_index=True,
+        use_container_width=True
+    )
+    st.download_button(
+        "📥 Download Scan (CSV)",
+        data=pair_scan['table'].to_csv(index=False),
+        file_name=f"fx_yield_scan_{datetime.now().strftime('%Y%m%d')}.csv",
+        mime="text/csv"
+    )
+
 # =====================================================
 # EXPORT
 # =====================================================
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Silnik modelu fair value FX ~ spread rentowności (dla dynamics.py) - bez Streamlit.
+
+Regresja OLS y = slope * x + intercept z sum (n, Σx, Σy, Σx², Σy², Σxy):
+dla okna kroczącego sumy to różnice sum narastających, więc statystyki dla
+każdego końca okna i kilku długości okien naraz kosztują O(n) na okno.
+Dane centrowane średnią całej serii przed sumowaniem (stabilność dla par
+typu USD/JPY); NaN w x lub y pomijane (okno liczy tylko pełne pary).
+"""
+
+import numpy as np
+import pandas as pd
+
+MIN_OBS = 10
+
+REGRESSION_COLUMNS = ['slope', 'intercept', 'r_squared', 'correlation', 'std_error', 'n_obs']
+
+
+def _moment_sums(x, y):
+    """Sumy narastające (z zerem na początku) momentów par bez NaN, po centrowaniu"""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    valid = ~(np.isnan(x) | np.isnan(y))
+
+    x_mean = x[valid].mean() if valid.any() else 0.0
+    y_mean = y[valid].mean() if valid.any() else 0.0
+    xc = np.where(valid, x - x_mean, 0.0)
+    yc = np.where(valid, y - y_mean, 0.0)
+
+    sums = np.zeros((6, len(x) + 1))
+    for row, values in enumerate([valid.astype(np.float64), xc, yc, xc * xc, yc * yc, xc * yc]):
+        np.cumsum(values, out=sums[row, 1:])
+    return sums, x_mean, y_mean
+
+
+def _stats_from_sums(n, sx, sy, sxx, syy, sxy, x_mean, y_mean, min_obs):
+    """Statystyki regresji z sum (tablice dowolnego kształtu); n < min_obs -> NaN"""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        var_x = sxx - sx * sx / n
+        var_y = syy - sy * sy / n
+        cov_xy = sxy - sx * sy / n
+
+        slope = cov_xy / var_x
+        intercept = (sy - slope * sx) / n + y_mean - slope * x_mean
+        ss_res = np.maximum(var_y - slope * cov_xy, 0.0)
+        r_squared = np.where(var_y > 0, 1 - ss_res / var_y, 0.0)
+        correlation = cov_xy / np.sqrt(var_x * var_y)
+        std_error = np.sqrt(ss_res / n)
+
+    enough = (n >= min_obs) & (var_x > 0)
+    return {
+        'slope': np.where(enough, slope, np.nan),
+        'intercept': np.where(enough, intercept, np.nan),
+        'r_squared': np.where(enough, r_squared, np.nan),
+        'correlation': np.where(enough, correlation, np.nan),
+        'std_error': np.where(enough, std_error, np.nan),
+        'n_obs': n
+    }
+
+
+def ols_stats(x, y, min_obs=MIN_OBS):
+    """
+    Jedna regresja na całych tablicach: dict slope/intercept/r_squared/correlation/
+    std_error (odchylenie std reszt, ddof=0)/n_obs albo None przy < min_obs parach.
+    """
+    sums, x_mean, y_mean = _moment_sums(x, y)
+    totals = sums[:, -1]
+    if totals[0] < min_obs:
+        return None
+    stats = _stats_from_sums(*totals, x_mean, y_mean, min_obs)
+    if np.isnan(stats['slope']):
+        return None
+    result = {key: float(value) for key, value in stats.items()}
+    result['n_obs'] = int(result['n_obs'])
+    return result
+
+
+def rolling_regression(x, y, windows=(252, 504, 756), min_obs=MIN_OBS, index=None):
+    """
+    Regresja krocząca dla każdego końca okna i każdej długości okna naraz.
+
+    windows: długości okien w obserwacjach (wierszach); None = okno rosnące (od początku).
+    Zwraca {okno: DataFrame REGRESSION_COLUMNS} wyrównany do x (index: opcjonalny indeks wyniku).
+    Wiersz i = regresja na wierszach (i - okno, i]; mniej niż min_obs pełnych par -> NaN.
+    """
+    sums, x_mean, y_mean = _moment_sums(x, y)
+    length = sums.shape[1] - 1
+    ends = np.arange(1, length + 1)
+
+    # Wszystkie okna jako jedna tablica (okna x obserwacje): różnice sum narastających
+    starts = np.stack([np.zeros(length, dtype=np.int64) if window is None else np.maximum(ends - window, 0)
+                       for window in windows]) if len(windows) else np.zeros((0, length), dtype=np.int64)
+    window_sums = sums[:, ends][:, None, :] - sums[:, starts]
+    stats = _stats_from_sums(*window_sums, x_mean, y_mean, min_obs)
+
+    results = {}
+    for k, window in enumerate(windows):
+        df = pd.DataFrame({column: stats[column][k] for column in REGRESSION_COLUMNS}, index=index)
+        df['n_obs'] = df['n_obs'].astype(np.int64)
+        results[window] = df
+    return results
+
+
+def rolling_fair_value(x, y, windows=(252, 504, 756), min_obs=MIN_OBS, index=None):
+    """
+    Fair value i odchylenie (%) z regresji kroczącej: dla każdego dnia model z okna
+    kończącego się tego dnia. Zwraca {okno: DataFrame Fair_Value/Deviation_Pct + REGRESSION_COLUMNS}.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    results = rolling_regression(x, y, windows, min_obs, index)
+    for df in results.values():
+        fair_value = df['slope'].to_numpy() * x + df['intercept'].to_numpy()
+        df['Fair_Value'] = fair_value
+        df['Deviation_Pct'] = (y - fair_value) / fair_value * 100
+    return results
+
+
+# =====================================================
+# MEAN REVERSION
+# =====================================================
+
+REVERSION_THRESHOLDS = (0.5, 1.0, 1.5, 2.0, 2.5, 3.0)
+
+EVENT_COLUMNS = ['Threshold', 'Start', 'End', 'Days', 'Direction', 'Start_Dev', 'Ongoing']
+
+
+def _next_after(positions, targets):
+    """Dla każdego target: pierwsza pozycja z posortowanego positions > target albo -1"""
+    k = np.searchsorted(positions, targets, side='right')
+    found = k < len(positions)
+    return np.where(found, positions[np.minimum(k, len(positions) - 1)] if len(positions) else 0, -1)
+
+
+def reversion_events(deviation_pct, dates=None, thresholds=REVERSION_THRESHOLDS):
+    """
+    Epizody odchylenia od fair value dla wielu progów naraz.
+
+    Epizod zaczyna się, gdy |odchylenie| >= próg, kończy przy pierwszym powrocie
+    do połowy progu (przewartościowanie: <= próg/2, niedowartościowanie: >= -próg/2);
+    następny epizod szukany od dnia powrotu. Dla każdego dnia-kandydata koniec
+    to jedno searchsorted po indeksach dni powrotu, a pętla idzie tylko po epizodach.
+    Days = liczba obserwacji od startu do powrotu. Epizod bez powrotu: Ongoing, End/Days puste.
+    Zwraca DataFrame EVENT_COLUMNS (Start/End: daty z dates albo indeksy wierszy).
+    """
+    deviation = np.asarray(deviation_pct, dtype=np.float64)
+    length = len(deviation)
+    labels = np.arange(length) if dates is None else np.asarray(dates)
+
+    frames = []
+    for threshold in thresholds:
+        half = threshold / 2
+        with np.errstate(invalid='ignore'):
+            candidates = np.flatnonzero(np.abs(deviation) >= threshold)
+            back_down = np.flatnonzero(deviation <= half)
+            back_up = np.flatnonzero(deviation >= -half)
+        if len(candidates) == 0:
+            continue
+
+        overvalued = deviation[candidates] > 0
+        ends = np.where(overvalued, _next_after(back_down, candidates), _next_after(back_up, candidates))
+        # Następny epizod: pierwszy kandydat od dnia powrotu (dzień powrotu może sam przekraczać próg)
+        next_candidate = np.searchsorted(candidates, ends, side='left')
+
+        chain = []
+        k = 0
+        while k < len(candidates):
+            chain.append(k)
+            if ends[k] < 0:
+                break
+            k = next_candidate[k]
+        chain = np.asarray(chain)
+
+        starts, event_ends = candidates[chain], ends[chain]
+        ongoing = event_ends < 0
+        frames.append(pd.DataFrame({
+            'Threshold': threshold,
+            'Start': labels[starts],
+            'End': pd.Series(labels[np.where(ongoing, 0, event_ends)]).where(~ongoing, None),
+            'Days': pd.Series(event_ends - starts, dtype='float64').where(~ongoing),
+            'Direction': np.where(overvalued[chain], 'overvalued', 'undervalued'),
+            'Start_Dev': deviation[starts],
+            'Ongoing': ongoing
+        }))
+
+    if not frames:
+        return pd.DataFrame(columns=EVENT_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+
+def reversion_summary(events, thresholds=REVERSION_THRESHOLDS, as_of=None):
+    """
+    Statystyki powrotów per próg: Events (z trwającym), Completed, Avg/Median/Min/Max Days
+    i Ongoing_Days (dni kalendarzowe od startu trwającego epizodu do as_of; tylko gdy Start to daty).
+    """
+    rows = []
+    for threshold in thresholds:
+        subset = events[events['Threshold'] == threshold]
+        days = subset['Days'].dropna().to_numpy()
+        ongoing = subset[subset['Ongoing'].astype(bool)]
+        ongoing_days = np.nan
+        if len(ongoing) > 0 and as_of is not None:
+            ongoing_days = (pd.Timestamp(as_of) - pd.Timestamp(ongoing['Start'].iloc[-1])).days
+        rows.append({
+            'Threshold': threshold,
+            'Events': len(subset),
+            'Completed': len(days),
+            'Avg_Days': days.mean() if len(days) else np.nan,
+            'Median_Days': np.median(days) if len(days) else np.nan,
+            'Min_Days': days.min() if len(days) else np.nan,
+            'Max_Days': days.max() if len(days) else np.nan,
+            'Ongoing': len(ongoing) > 0,
+            'Ongoing_Days': ongoing_days
+        })
+    return pd.DataFrame(rows)
+
+
+# =====================================================
+# DANE I SKAN PAR
+# =====================================================
+
+MIN_MERGED_OBS = 50
+
+SCAN_COLUMNS = ['Pair', 'Spot', 'Fair_Value', 'Deviation_Pct', 'R_Squared', 'Slope', 'Median_Reversion_Days',
+                'Reversion_Events', 'Ongoing_Days', 'Observations', 'Status']
+
+
+def yield_curve_frame(y10_df, y30_df):
+    """DGS10 + DGS30 (Date/Value) -> Date/Y10/Y30/Spread (30Y - 10Y)"""
+    yields_df = y10_df.merge(y30_df, on='Date', suffixes=('_10Y', '_30Y'))
+    yields_df['Spread'] = yields_df['Value_30Y'] - yields_df['Value_10Y']
+    yields_df = yields_df[['Date', 'Value_10Y', 'Value_30Y', 'Spread']]
+    yields_df.columns = ['Date', 'Y10', 'Y30', 'Spread']
+    return yields_df
+
+
+def pair_frame(yields_df, fx_df):
+    """Rentowności + para (Date/Value) -> Date/Y10/Y30/Spread/FX posortowane po Date"""
+    df = yields_df.merge(fx_df[['Date', 'Value']], on='Date', how='inner')
+    df.columns = ['Date', 'Y10', 'Y30', 'Spread', 'FX']
+    return df.sort_values('Date').reset_index(drop=True)
+
+
+def apply_fair_value(df, window=None, min_obs=MIN_OBS):
+    """
+    Regresja FX ~ Spread na ostatnich window wierszach (None = wszystkie) i fair value
+    dla całej serii: dodaje Fair_Value/Deviation/Deviation_Pct; zwraca statystyki albo None.
+    """
+    reg_df = df if window is None else df.tail(window)
+    stats = ols_stats(reg_df['Spread'].to_numpy(), reg_df['FX'].to_numpy(), min_obs)
+    if stats is None:
+        return None
+
+    df['Fair_Value'] = stats['slope'] * df['Spread'] + stats['intercept']
+    df['Deviation'] = df['FX'] - df['Fair_Value']
+    df['Deviation_Pct'] = (df['Deviation'] / df['Fair_Value']) * 100
+    return stats
+
+
+def analyze_pair(yields_df, fx_df, window=None, threshold=1.0):
+    """Model fair value + powroty przy progu threshold dla jednej pary -> wiersz SCAN_COLUMNS (bez Pair)"""
+    row = {column: np.nan for column in SCAN_COLUMNS if column != 'Pair'}
+    if fx_df is None or len(fx_df) == 0:
+        return {**row, 'Observations': 0, 'Status': 'no FX data'}
+
+    df = pair_frame(yields_df, fx_df)
+    row['Observations'] = len(df)
+    if len(df) < MIN_MERGED_OBS:
+        return {**row, 'Status': f'only {len(df)} observations after merge'}
+
+    stats = apply_fair_value(df, window)
+    if stats is None:
+        return {**row, 'Status': 'regression failed'}
+
+    current = df.iloc[-1]
+    events = reversion_events(df['Deviation_Pct'].to_numpy(), df['Date'].to_numpy(), (threshold,))
+    summary = reversion_summary(events, (threshold,), as_of=current['Date']).iloc[0]
+    row.update({
+        'Spot': current['FX'],
+        'Fair_Value': current['Fair_Value'],
+        'Deviation_Pct': current['Deviation_Pct'],
+        'R_Squared': stats['r_squared'],
+        'Slope': stats['slope'],
+        'Median_Reversion_Days': summary['Median_Days'],
+        'Reversion_Events': summary['Events'],
+        'Ongoing_Days': summary['Ongoing_Days'],
+        'Status': 'OK'
+    })
+    return row
+
+
+def scan_pairs(yields_df, fx_data, window=None, threshold=1.0):
+    """
+    Skan wielu par na jednej krzywej rentowności: {para: fx_df Date/Value albo None}.
+    Zwraca DataFrame SCAN_COLUMNS posortowany malejąco po |Deviation_Pct| (pary z błędem na końcu).
+    """
+    rows = [{'Pair': pair, **analyze_pair(yields_df, fx_df, window, threshold)} for pair, fx_df in fx_data.items()]
+    scan = pd.DataFrame(rows, columns=SCAN_COLUMNS)
+    order = scan['Deviation_Pct'].abs().sort_values(ascending=False, na_position='last', kind='stable').index
+    return scan.loc[order].reset_index(drop=True)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Lokalny magazyn serii FRED (SQLite) dla dynamics.py.
+
+- tabela observations: (series_id, ts) -> value
+- tabela series: od jakiej daty seria jest pobrana i kiedy była odświeżana
+- odświeżenie dociąga tylko obserwacje od ostatniej zapisanej daty
+  (ostatnia pobierana ponownie - FRED potrafi ją poprawić tego samego dnia)
+- WAL: sesje Streamlit i cron czytają/piszą równolegle
+
+Źródło: FredSource (fredgraph.csv) albo LocalFredSource - katalog plików
+w formacie fredgraph.csv zamiast endpointu (testy offline, środowiska bez sieci).
+Zmienna FRED_LOCAL_DIR przełącza default_source() na pliki lokalne.
+
+    python fred_store.py refresh DGS10 DGS30
+    python fred_store.py snapshot DGS10 DGS30 --dir tests/fred
+"""
+
+import argparse
+import io
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import requests
+
+os.makedirs("data", exist_ok=True)
+
+FRED_DB = os.environ.get("FRED_DB", "data/fred.db")
+FRED_URL = "https://fred.stlouisfed.org/graph/fredgraph.csv"
+FRED_LOCAL_DIR = os.environ.get("FRED_LOCAL_DIR")
+FRED_TIMEOUT = 30
+FRED_MAX_AGE = 3600
+
+SERIES_COLUMNS = ['Date', 'Value']
+
+
+def _to_ns(value):
+    return int(pd.Timestamp(value).value)
+
+
+def parse_fred_csv(source):
+    """fredgraph.csv (DATE/observation_date + kolumna serii, braki jako '.') -> Date/Value"""
+    df = pd.read_csv(source)
+    df = df.iloc[:, :2]
+    df.columns = SERIES_COLUMNS
+    df['Date'] = pd.to_datetime(df['Date'])
+    df['Value'] = pd.to_numeric(df['Value'], errors='coerce')
+    return df.dropna().reset_index(drop=True)
+
+
+class FredSource:
+    """Endpoint fredgraph.csv (bez klucza API)"""
+
+    def __init__(self, base_url=FRED_URL, timeout=FRED_TIMEOUT):
+        self.base_url = base_url
+        self.timeout = timeout
+
+    def fetch(self, series_id, start=None, end=None):
+        """Obserwacje z [start, end] jako Date/Value"""
+        params = {'id': series_id}
+        if start is not None:
+            params['cosd'] = pd.Timestamp(start).strftime('%Y-%m-%d')
+        if end is not None:
+            params['coed'] = pd.Timestamp(end).strftime('%Y-%m-%d')
+        response = requests.get(self.base_url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        return parse_fred_csv(io.StringIO(response.text))
+
+
+class LocalFredSource:
+    """Zastępnik endpointu FRED: pliki <katalog>/<SERIES_ID>.csv w formacie fredgraph.csv"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, series_id):
+        return os.path.join(self.directory, f"{series_id}.csv")
+
+    def fetch(self, series_id, start=None, end=None):
+        """Jak FredSource.fetch; brak pliku = ValueError"""
+        path = self._path(series_id)
+        if not os.path.exists(path):
+            raise ValueError(f"Brak pliku serii {series_id}: {path}")
+        df = parse_fred_csv(path)
+        if start is not None:
+            df = df[df['Date'] >= pd.Timestamp(start)]
+        if end is not None:
+            df = df[df['Date'] <= pd.Timestamp(end)]
+        return df.reset_index(drop=True)
+
+    def write(self, series_id, df):
+        """Zapisz serię Date/Value jako plik fredgraph.csv (np. zrzut z magazynu do testów)"""
+        os.makedirs(self.directory, exist_ok=True)
+        out = pd.DataFrame({
+            'observation_date': pd.to_datetime(df['Date']).dt.strftime('%Y-%m-%d'),
+            series_id: df['Value']
+        })
+        out.to_csv(self._path(series_id), index=False)
+
+
+def default_source(timeout=FRED_TIMEOUT):
+    """LocalFredSource gdy ustawiono FRED_LOCAL_DIR, inaczej FredSource (timeout na zapytanie)"""
+    if FRED_LOCAL_DIR:
+        return LocalFredSource(FRED_LOCAL_DIR)
+    return FredSource(timeout=timeout)
+
+
+class FredStore:
+    """Magazyn obserwacji serii FRED z przyrostowym odświeżaniem"""
+
+    def __init__(self, path=FRED_DB):
+        self.path = path
+        conn = self.get_connection()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS observations (
+            series_id TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            value REAL,
+            PRIMARY KEY (series_id, ts)
+        ) WITHOUT ROWID
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS series (
+            series_id TEXT PRIMARY KEY,
+            start_ts INTEGER,
+            refreshed_at REAL
+        )
+        """)
+        conn.commit()
+        conn.close()
+
+    def get_connection(self):
+        return sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+
+    def write(self, series_id, df):
+        """Zapisz/nadpisz obserwacje (kolumny Date/Value)"""
+        if df is None or len(df) == 0:
+            return 0
+
+        ts = pd.to_datetime(df['Date']).to_numpy(dtype='datetime64[ns]').view(np.int64)
+        rows = zip([series_id] * len(df), ts.tolist(), df['Value'].astype(float).tolist())
+
+        conn = self.get_connection()
+        with conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO observations (series_id, ts, value) VALUES (?, ?, ?)", rows
+            )
+        conn.close()
+        return len(df)
+
+    def read(self, series_id, start=None, end=None):
+        """Obserwacje z zakresu [start, end] posortowane po Date"""
+        query = "SELECT ts, value FROM observations WHERE series_id = ?"
+        params = [series_id]
+        if start is not None:
+            query += " AND ts >= ?"
+            params.append(_to_ns(start))
+        if end is not None:
+            query += " AND ts <= ?"
+            params.append(_to_ns(end))
+
+        conn = self.get_connection()
+        raw = pd.read_sql_query(query + " ORDER BY ts", conn, params=params)
+        conn.close()
+        return pd.DataFrame({
+            'Date': pd.to_datetime(raw['ts'].to_numpy(dtype=np.int64), unit='ns'),
+            'Value': raw['value'].astype(float)
+        })
+
+    def status(self, series_id):
+        """(start pobrania, ostatnia obserwacja, refreshed_at) albo None"""
+        conn = self.get_connection()
+        row = conn.execute(
+            "SELECT start_ts, refreshed_at FROM series WHERE series_id = ?", (series_id,)
+        ).fetchone()
+        last = conn.execute(
+            "SELECT MAX(ts) FROM observations WHERE series_id = ?", (series_id,)
+        ).fetchone()[0]
+        conn.close()
+        if row is None:
+            return None
+        return pd.Timestamp(row[0]), pd.Timestamp(last) if last is not None else None, row[1]
+
+    def _mark_refreshed(self, series_id, start):
+        conn = self.get_connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO series (series_id, start_ts, refreshed_at) VALUES (?, ?, ?)",
+                (series_id, _to_ns(start), time.time())
+            )
+        conn.close()
+
+    def is_fresh(self, series_id, start, max_age=FRED_MAX_AGE):
+        """Czy zapisany zakres obejmuje start i był odświeżany w ciągu max_age sekund"""
+        current = self.status(series_id)
+        if current is None:
+            return False
+        covered_start, _, refreshed_at = current
+        return pd.Timestamp(start) >= covered_start and time.time() - refreshed_at <= max_age
+
+    def refresh(self, series_id, source=None, start="2010-01-01", max_age=FRED_MAX_AGE):
+        """
+        Dociągnij brakujące obserwacje: historię przed zapisanym zakresem i ogon
+        od ostatniej zapisanej daty. Seria odświeżona w ciągu max_age sekund
+        nie jest pobierana (max_age=0 wymusza). Zwraca liczbę zapisanych obserwacji.
+        """
+        if self.is_fresh(series_id, start, max_age):
+            return 0
+
+        source = source or default_source()
+        start = pd.Timestamp(start)
+        current = self.status(series_id)
+
+        written = 0
+        if current is None or current[1] is None:
+            written += self.write(series_id, source.fetch(series_id, start))
+            covered_start = start
+        else:
+            covered_start, last, _ = current
+            if start < covered_start:
+                written += self.write(series_id, source.fetch(series_id, start, covered_start))
+                covered_start = start
+            written += self.write(series_id, source.fetch(series_id, last))
+
+        self._mark_refreshed(series_id, covered_start)
+        return written
+
+    def get(self, series_id, source=None, start="2010-01-01", max_age=FRED_MAX_AGE):
+        """Seria od start: odświeżenie przyrostowe (jeśli nieświeża), potem odczyt z dysku"""
+        self.refresh(series_id, source, start, max_age)
+        return self.read(series_id, start)
+
+    def series_ids(self):
+        """Lista serii w magazynie"""
+        conn = self.get_connection()
+        rows = conn.execute("SELECT series_id FROM series ORDER BY series_id").fetchall()
+        conn.close()
+        return [row[0] for row in rows]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Magazyn serii FRED")
+    parser.add_argument('command', choices=['refresh', 'snapshot'],
+                        help="refresh: dociągnij nowe obserwacje; snapshot: zapisz serie jako pliki dla LocalFredSource")
+    parser.add_argument('series', nargs='*', help="np. DGS10 DGS30 (domyślnie wszystkie w magazynie)")
+    parser.add_argument('--db', default=FRED_DB, help="magazyn SQLite")
+    parser.add_argument('--start', default="2010-01-01")
+    parser.add_argument('--dir', help="katalog plików (snapshot)")
+    args = parser.parse_args(argv)
+
+    store = FredStore(args.db)
+    series = args.series or store.series_ids()
+
+    if args.command == 'snapshot':
+        if not args.dir:
+            parser.error("snapshot wymaga --dir")
+        local = LocalFredSource(args.dir)
+        for series_id in series:
+            df = store.read(series_id, args.start)
+            local.write(series_id, df)
+            print(f"{series_id}: {len(df)} obserwacji -> {local._path(series_id)}")
+        return 0
+
+    failed = 0
+    for series_id in series:
+        try:
+            written = store.refresh(series_id, start=args.start, max_age=0)
+        except (OSError, ValueError, requests.RequestException) as e:
+            print(f"{series_id}: błąd {e}", file=sys.stderr)
+            failed += 1
+            continue
+        _, last, _ = store.status(series_id)
+        print(f"{series_id}: zapisano {written} obserwacji, ostatnia {last.date() if last is not None else '-'}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Wczytywanie plików OHLC (CSV z brokera, MT5, investing.com itp.).
+
+Format (kodowanie, separator, konwencja dziesiętna/tysięcy, kolumny, format daty)
+jest wykrywany raz z próbki bajtów, potem plik jest parsowany jeden raz
+z typami — duże pliki w paczkach, tylko potrzebne kolumny.
+"""
+
+import csv
+import io
+import os
+
+import pandas as pd
+
+SNIFF_BYTES = 256 * 1024
+CHUNK_ROWS = 1_000_000
+
+SEPARATORS = [',', ';', '\t']
+
+DATE_COLUMNS = ['date', 'datetime', 'time', 'timestamp', 'data', 'datum']
+
+OHLC_NAMES = {
+    'Open': ['open', 'o', 'opening'],
+    'High': ['high', 'h', 'max', 'hi'],
+    'Low': ['low', 'l', 'min', 'lo'],
+    'Close': ['close', 'c', 'last', 'price', 'closing']
+}
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close']
+
+DATE_FORMATS = [
+    f"{date_format}{time_format}"
+    for date_format in ['%Y-%m-%d', '%Y.%m.%d', '%Y/%m/%d', '%m/%d/%Y', '%d/%m/%Y',
+                        '%d.%m.%Y', '%d-%m-%Y', '%Y%m%d']
+    for time_format in ['', ' %H:%M', ' %H:%M:%S', 'T%H:%M:%S']
+] + ['%b %d, %Y', '%B %d, %Y']
+
+
+def _normalize_name(name):
+    return name.strip().lower().replace('"', '')
+
+
+def _read_sample(source):
+    """Pierwsze SNIFF_BYTES bajtów pliku (ścieżka albo obiekt plikowy) + czy to cały plik"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, 'rb') as handle:
+            sample = handle.read(SNIFF_BYTES + 1)
+    else:
+        source.seek(0)
+        sample = source.read(SNIFF_BYTES + 1)
+        source.seek(0)
+        if isinstance(sample, str):
+            sample = sample.encode('utf-8')
+
+    return sample[:SNIFF_BYTES], len(sample) <= SNIFF_BYTES
+
+
+def _detect_encoding(sample):
+    if sample.startswith(b'\xef\xbb\xbf'):
+        return 'utf-8-sig'
+    if sample.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return 'utf-16'
+
+    # Ucięty znak wielobajtowy na końcu próbki nie przesądza o kodowaniu
+    try:
+        sample[:sample.rfind(b'\n') + 1 or len(sample)].decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin-1'
+
+
+def _detect_number_format(values):
+    """(decimal, thousands) z próbki wartości cen"""
+    values = [value.strip().replace('"', '').replace("'", '').replace(' ', '') for value in values]
+
+    for value in values:
+        if ',' in value and '.' in value:
+            if value.rfind(',') > value.rfind('.'):
+                return ',', '.'
+            return '.', ','
+
+    if any(',' in value for value in values):
+        return ',', None
+    return '.', None
+
+
+def _detect_date_format(values, formats=DATE_FORMATS):
+    """Pierwszy format z formats pasujący do całej próbki albo None (pandas zgaduje)"""
+    sample = pd.Series(values, dtype='object').str.strip()
+    for date_format in formats:
+        if pd.to_datetime(sample, format=date_format, errors='coerce').notna().all():
+            return date_format
+    return None
+
+
+def sniff_csv_format(source):
+    """
+    Wykryj format pliku OHLC z próbki.
+
+    Zwraca dict: encoding, sep, decimal, thousands, columns (Date/Open/High/Low/Close ->
+    nazwa w pliku), time_column (osobna kolumna czasu, np. MT5 <DATE> + <TIME>), date_format.
+    ValueError z opisem, jeśli pliku nie da się odczytać.
+    """
+    sample, complete = _read_sample(source)
+    encoding = _detect_encoding(sample)
+    text = sample.decode(encoding, errors='ignore')
+
+    lines = text.splitlines()
+    if not complete:
+        lines = lines[:-1]
+    lines = [line for line in lines if line.strip()]
+    if not lines:
+        raise ValueError("Nie można odczytać pliku")
+
+    sep = None
+    for candidate in SEPARATORS:
+        header = next(csv.reader([lines[0]], delimiter=candidate))
+        if len(header) >= 5:
+            sep = candidate
+            break
+
+    if sep is None:
+        raise ValueError("Nie można odczytać pliku")
+
+    names = {_normalize_name(name): name for name in header}
+
+    columns = {}
+    for name in names:
+        if name in DATE_COLUMNS or any(d in name for d in DATE_COLUMNS):
+            columns['Date'] = name
+            break
+
+    for target, possible_names in OHLC_NAMES.items():
+        for name in names:
+            if name in possible_names or any(possible in name for possible in possible_names):
+                columns[target] = name
+                break
+
+    missing = [col for col in ['Date'] + PRICE_COLUMNS if col not in columns]
+    if missing:
+        raise ValueError(f"Brakujące kolumny: {', '.join(missing)}")
+
+    rows = [row for row in csv.reader(lines[1:], delimiter=sep) if len(row) == len(header)]
+    positions = {_normalize_name(name): i for i, name in enumerate(header)}
+
+    def sample_values(name):
+        return [row[positions[name]] for row in rows if row[positions[name]].strip()]
+
+    price_values = [value for col in PRICE_COLUMNS for value in sample_values(columns[col])]
+    decimal, thousands = _detect_number_format(price_values)
+    if sep == ',' and thousands == ',':
+        thousands = None
+
+    date_values = sample_values(columns['Date'])
+    time_column = None
+    if date_values and not any(':' in value for value in date_values):
+        for name in names:
+            if name != columns['Date'] and 'time' in name:
+                time_column = name
+                break
+
+    if time_column is not None:
+        date_values = [
+            f"{row[positions[columns['Date']]].strip()} {row[positions[time_column]].strip()}"
+            for row in rows if row[positions[columns['Date']]].strip()
+        ]
+
+    return {
+        'encoding': encoding,
+        'sep': sep,
+        'decimal': decimal,
+        'thousands': thousands,
+        'columns': {target: names[name] for target, name in columns.items()},
+        'time_column': names[time_column] if time_column is not None else None,
+        'date_format': _detect_date_format(date_values) if date_values else None
+    }
+
+
+def _clean_numeric(series, decimal):
+    """Ręczna konwersja kolumny, której parser nie rozpoznał jako liczbowej"""
+    text = series.astype(str).str.strip().str.replace(r"[\"'% ]", '', regex=True)
+    if decimal == ',':
+        text = text.str.replace('.', '', regex=False).str.replace(',', '.', regex=False)
+    else:
+        text = text.str.replace(',', '', regex=False)
+    return pd.to_numeric(text, errors='coerce')
+
+
+def _normalize_chunk(raw, fmt):
+    columns = fmt['columns']
+
+    dates = raw[columns['Date']].astype(str).str.strip()
+    if fmt['time_column'] is not None:
+        dates = dates + ' ' + raw[fmt['time_column']].astype(str).str.strip()
+
+    df = pd.DataFrame({'Date': pd.to_datetime(dates, format=fmt['date_format'], errors='coerce')})
+    for col in PRICE_COLUMNS:
+        values = raw[columns[col]]
+        if not pd.api.types.is_numeric_dtype(values):
+            values = _clean_numeric(values, fmt['decimal'])
+        df[col] = values.astype(float)
+
+    return df.dropna(subset=['Date']).dropna(subset=PRICE_COLUMNS)
+
+
+def iter_raw_chunks(source, fmt, usecols, text_columns, chunksize=CHUNK_ROWS):
+    """Surowe paczki pliku (tylko usecols) w wykrytym formacie - wspólne dla OHLC i ticków"""
+    opened = isinstance(source, (str, os.PathLike))
+    handle = open(source, 'rb') if opened else source
+    if not opened:
+        handle.seek(0)
+        if isinstance(handle, io.TextIOBase):
+            handle = io.BytesIO(handle.read().encode(fmt['encoding']))
+
+    # Przecinek dziesiętny w pliku rozdzielanym przecinkami (wartości w cudzysłowach)
+    # parser zostawia jako tekst — konwertuje go _clean_numeric
+    decimal = fmt['decimal'] if fmt['decimal'] != fmt['sep'] else '.'
+
+    try:
+        reader = pd.read_csv(
+            handle, sep=fmt['sep'], encoding=fmt['encoding'], decimal=decimal,
+            thousands=fmt['thousands'], usecols=lambda name: name in usecols,
+            dtype={name: str for name in text_columns}, chunksize=chunksize
+        )
+        with reader:
+            yield from reader
+    finally:
+        if opened:
+            handle.close()
+
+
+def iter_ohlc_csv(source, fmt=None, chunksize=CHUNK_ROWS):
+    """
+    Paczki Date/Open/High/Low/Close (po chunksize wierszy, w kolejności pliku).
+
+    Pamięć: jedna paczka tylko z potrzebnymi kolumnami, niezależnie od rozmiaru pliku.
+    """
+    if fmt is None:
+        fmt = sniff_csv_format(source)
+
+    usecols = list(fmt['columns'].values())
+    text_columns = [fmt['columns']['Date']]
+    if fmt['time_column'] is not None:
+        usecols.append(fmt['time_column'])
+        text_columns.append(fmt['time_column'])
+
+    for raw in iter_raw_chunks(source, fmt, usecols, text_columns, chunksize):
+        yield _normalize_chunk(raw, fmt)
+
+
+def read_ohlc_csv(source, fmt=None, chunksize=CHUNK_ROWS):
+    """Cały plik jako DataFrame Date/Open/High/Low/Close posortowany po Date"""
+    chunks = list(iter_ohlc_csv(source, fmt, chunksize))
+    if not chunks:
+        return pd.DataFrame(columns=['Date'] + PRICE_COLUMNS)
+
+    df = pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0]
+    if not df['Date'].is_monotonic_increasing:
+        df = df.sort_values('Date', kind='stable')
+    return df.reset_index(drop=True)
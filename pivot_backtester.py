@@ -0,0 +1,767 @@
+#!/usr/bin/env python3
+"""
+Pivot Strategy Backtester - silnik bez Streamlit + batch z linii poleceń.
+
+PivotBacktester, statystyki z fees i przetwarzanie par (używane przez premiumhedge.py)
+oraz runner do nocnych przebiegów (cron):
+
+    python pivot_backtester.py --params params.json --symbols EURUSD USDJPY \
+        --output-dir results/ --format parquet
+
+Parametry (JSON) jak w panelu: lookback_days, holding_days, stop_loss_pct, support_level,
+resistance_level, trade_direction, leverage, capital_usage_pct, initial_capital, spread_value,
+days, shared_margin, intraday_stream, management_fee_pct, success_fee_pct, fee_period,
+spread_file, swap_file (cost_model: spread zmienny w czasie i swap; spread_value = domyślny spread),
+bar_interval (bary z magazynu zamiast Yahoo, np. '5min:mid' zbudowane z ticków przez tick_bars.py).
+Wynik: trades, yearly_before, yearly_after, equity, equity_mtm (Parquet albo CSV) + summary.json.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from bar_store import BAR_DB, BarStore
+from cost_model import CostModel
+from ohlc_csv import CHUNK_ROWS, iter_ohlc_csv, read_ohlc_csv
+from pivot_engine import (
+    TradeLedger, add_pivot_columns, calculate_period_stats_with_fees, equity_curve_stats,
+    mark_to_market_equity, period_returns, portfolio_capital_curve, process_pool, run_backtest_arrays,
+    run_backtest_chunked, run_portfolio_backtest
+)
+
+# Forex symbols mapping
+FOREX_SYMBOLS = {
+    'EURUSD': 'EURUSD=X',
+    'GBPUSD': 'GBPUSD=X',
+    'AUDUSD': 'AUDUSD=X',
+    'NZDUSD': 'NZDUSD=X',
+    'USDCAD': 'USDCAD=X',
+    'USDCHF': 'USDCHF=X',
+    'USDJPY': 'USDJPY=X',
+    'EURJPY': 'EURJPY=X',
+    'GBPJPY': 'GBPJPY=X',
+    'EURGBP': 'EURGBP=X',
+    'CHFPLN': 'CHFPLN=X',
+    'EURPLN': 'EURPLN=X',
+    'USDPLN': 'USDPLN=X',
+    'GBPPLN': 'GBPPLN=X'
+}
+
+# Równoległe przetwarzanie par w trybie pojedynczego backtestu: wątki na I/O (Yahoo, CSV, magazyn),
+# pivoty + backtest w puli procesów (w wątkach obliczenia i tak szłyby po kolei przez GIL)
+SYMBOL_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+SYMBOL_CPU_WORKERS = os.cpu_count() or 1
+
+
+class PivotBacktester:
+    def __init__(self, lookback_days=7, bar_store=None, offline=False, costs=None):
+        self.lookback_days = lookback_days
+        self.bar_store = bar_store
+        self.offline = offline
+        self.costs = costs  # CostModel: spread w czasie + swap (silnik tablicowy)
+
+    @property
+    def costs_key(self):
+        """Składnik kluczy cache zależny od modelu kosztów"""
+        return None if self.costs is None else self.costs.fingerprint
+
+    def load_csv_data(self, uploaded_file):
+        """Załaduj dane z pliku CSV (format wykrywany raz z próbki, jeden parse w paczkach)"""
+        try:
+            new_df = read_ohlc_csv(uploaded_file)
+
+            if len(new_df) == 0:
+                return None, "Brak prawidłowych danych"
+
+            return new_df, f"OK: {len(new_df)} wierszy"
+
+        except ValueError as e:
+            return None, str(e)
+        except Exception as e:
+            return None, f"Błąd: {str(e)}"
+
+    def _download_forex_data(self, yf_symbol, **history_kwargs):
+        """Pobierz bary dzienne z Yahoo Finance (Date/Open/High/Low/Close) albo None"""
+        import yfinance as yf  # dopiero przy pobieraniu: szybki start CLI i tryb offline
+
+        data = yf.Ticker(yf_symbol).history(interval="1d", **history_kwargs)
+
+        if data.empty:
+            return None
+
+        data = data.dropna()
+
+        if hasattr(data.index, 'tz_localize'):
+            try:
+                if data.index.tz is not None:
+                    data.index = data.index.tz_convert(None)
+            except:
+                pass
+
+        df = pd.DataFrame({
+            'Date': pd.to_datetime(data.index),
+            'Open': data['Open'].astype(float),
+            'High': data['High'].astype(float),
+            'Low': data['Low'].astype(float),
+            'Close': data['Close'].astype(float)
+        }).reset_index(drop=True)
+
+        return df.dropna(subset=['Open', 'High', 'Low', 'Close'])
+
+    def get_forex_data(self, symbol, days=365):
+        """
+        Pobierz dane forex.
+
+        Z bar_store: z Yahoo dociągany jest tylko brakujący zakres (historia przed
+        zapisanym początkiem, ogon od ostatniego baru), reszta czytana z dysku.
+        W trybie offline dane pochodzą wyłącznie z magazynu.
+        """
+        try:
+            yf_symbol = FOREX_SYMBOLS.get(symbol, f"{symbol}=X")
+
+            if self.bar_store is None:
+                df = self._download_forex_data(yf_symbol, period=f"{days}d")
+
+                if df is None:
+                    end_date = datetime.now()
+                    start_date = end_date - timedelta(days=days + 5)
+                    df = self._download_forex_data(yf_symbol, start=start_date, end=end_date)
+
+                return df
+
+            end_date = pd.Timestamp.now().normalize() + pd.Timedelta(days=1)
+            start_date = end_date - pd.Timedelta(days=days + 1)
+
+            if not self.offline:
+                for range_start, range_end in self.bar_store.missing_ranges(symbol, '1d', start_date, end_date):
+                    fetched = self._download_forex_data(yf_symbol, start=range_start, end=range_end)
+                    if fetched is not None:
+                        self.bar_store.write(symbol, '1d', fetched)
+                        self.bar_store.mark_fetched(symbol, '1d', range_start, range_end)
+
+            df = self.bar_store.read(symbol, '1d', start_date, end_date)
+            return df if len(df) > 0 else None
+
+        except Exception as e:
+            return None
+
+    def run_backtest_streaming(self, source, symbol, initial_capital=10000,
+                               spread_value=0.0002, holding_days=5, stop_loss_pct=None,
+                               support_level='S3', resistance_level='R3',
+                               trade_direction='Both', leverage=1, capital_usage_pct=100,
+                               chunksize=CHUNK_ROWS):
+        """Backtest pliku CSV czytanego paczkami (intraday, out-of-core) - wynik jak run_backtest"""
+        return run_backtest_chunked(
+            iter_ohlc_csv(source, chunksize=chunksize), symbol, self.lookback_days, initial_capital,
+            spread_value, holding_days, stop_loss_pct, support_level, resistance_level,
+            trade_direction, leverage, capital_usage_pct, costs=self.costs
+        )
+
+    def run_backtest_store(self, symbol, interval, initial_capital=10000,
+                           spread_value=0.0002, holding_days=5, stop_loss_pct=None,
+                           support_level='S3', resistance_level='R3',
+                           trade_direction='Both', leverage=1, capital_usage_pct=100,
+                           chunksize=CHUNK_ROWS):
+        """Backtest barów z magazynu czytanych paczkami (np. bary z ticków) - wynik jak run_backtest"""
+        return run_backtest_chunked(
+            self.bar_store.iter_chunks(symbol, interval, chunksize=chunksize), symbol, self.lookback_days,
+            initial_capital, spread_value, holding_days, stop_loss_pct, support_level, resistance_level,
+            trade_direction, leverage, capital_usage_pct, costs=self.costs
+        )
+
+    def calculate_pivot_points(self, df):
+        """Oblicz punkty pivot (silnik tablicowy z pivot_engine)"""
+        if len(df) <= self.lookback_days:
+            return df
+
+        return add_pivot_columns(df, self.lookback_days, suffixed=False)
+
+    def run_backtest(self, df, symbol, initial_capital=10000,
+                     spread_value=0.0002, holding_days=5, stop_loss_pct=None,
+                     support_level='S3', resistance_level='R3',
+                     trade_direction='Both', leverage=1, capital_usage_pct=100):
+        """
+        Backtest z dynamicznym wolumenem z kapitału + margin check + margin call.
+
+        Logika:
+        - Wolumen = (dostępny_kapitał × capital_usage_pct% × leverage)
+          np. 1M EUR × 100% × x10 = 10M EUR efektywna pozycja
+        - Margin (depozyt) = wolumen / leverage = kapitał × usage%
+        - Margin check: nie otwieraj jeśli margin > wolny kapitał
+        - Margin call: zamknij pozycję jeśli unrealized loss >= margin (depozyt)
+        - P&L w walucie bazowej: profit_quoted / exit_price
+        - Compound: wolumen rośnie/maleje z equity
+
+        Silnik tablicowy pivot_engine.run_backtest_arrays; zgodność z dawną pętlą
+        bar po barze sprawdza tests/test_backtest_engines.py.
+        """
+        return run_backtest_arrays(
+            df, symbol, initial_capital, spread_value, holding_days, stop_loss_pct,
+            support_level, resistance_level, trade_direction, leverage, capital_usage_pct,
+            costs=self.costs
+        )
+
+
+def calculate_yearly_stats_with_fees(trades_df, initial_capital, management_fee_pct=1.5, success_fee_pct=12.0,
+                                     fee_period='Y', equity_curve=None):
+    """
+    Oblicz statystyki roczne Z FEES (fee_period: 'Y' rok, 'Q' kwartał, 'M' miesiąc).
+    equity_curve (portfolio_equity_curve): Max DD z equity per bar.
+    """
+    return calculate_period_stats_with_fees(
+        trades_df, initial_capital, management_fee_pct, success_fee_pct, fee_period, equity_curve
+    )
+
+
+def calculate_projection(trades_df, initial_capital, years_ahead=5):
+    """Prognoza na kolejne lata"""
+    if len(trades_df) == 0:
+        return None, 0, 0
+
+    yearly_returns = period_returns(trades_df, initial_capital, 'Y')
+    if len(yearly_returns) == 0:
+        return None, 0, 0
+
+    avg_annual_return = np.mean(yearly_returns)
+    std_annual_return = np.std(yearly_returns) if len(yearly_returns) > 1 else 0
+
+    current_capital = trades_df.sort_values('Exit Date')['Portfolio Capital'].iloc[-1]
+    projections = []
+
+    for year in range(1, years_ahead + 1):
+        pessimistic_return = avg_annual_return - std_annual_return
+        pessimistic_capital = current_capital * ((1 + pessimistic_return) ** year)
+
+        base_capital = current_capital * ((1 + avg_annual_return) ** year)
+
+        optimistic_return = avg_annual_return + std_annual_return
+        optimistic_capital = current_capital * ((1 + optimistic_return) ** year)
+
+        projections.append({
+            'Year': datetime.now().year + year,
+            'Pessimistic': pessimistic_capital,
+            'Base': base_capital,
+            'Optimistic': optimistic_capital
+        })
+
+    return pd.DataFrame(projections), avg_annual_return, std_annual_return
+
+
+def load_symbol_data(backtester, symbol, uploaded_file=None, days=None, bar_interval=None):
+    """Dane OHLC dla symbolu z pliku CSV, z magazynu barów (bar_interval) albo z Yahoo Finance: (df, status)"""
+    if uploaded_file is not None:
+        return backtester.load_csv_data(uploaded_file)
+
+    if bar_interval:
+        if backtester.bar_store is None:
+            return None, "Brak magazynu barów"
+        df = backtester.bar_store.read(symbol, bar_interval)
+        if len(df) == 0:
+            return None, f"Brak barów {bar_interval} w magazynie"
+        return df, f"OK: {len(df)} barów {bar_interval}"
+
+    df = backtester.get_forex_data(symbol, days)
+    if df is None:
+        return None, "Nie udało się pobrać danych"
+    return df, f"OK: {len(df)} wierszy"
+
+
+# ============================================
+# CACHE WYNIKÓW (fingerprint danych + parametrów)
+# ============================================
+
+def data_fingerprint(df):
+    """Skrót Date/OHLC - zmiana dowolnego baru (także dociągnięty ogon) daje inny fingerprint"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.int64(len(df)).tobytes())
+    digest.update(np.ascontiguousarray(df['Date'].to_numpy(dtype='datetime64[ns]')).tobytes())
+    for col in ['Open', 'High', 'Low', 'Close']:
+        digest.update(np.ascontiguousarray(df[col].to_numpy(dtype=np.float64)).tobytes())
+    return digest.hexdigest()
+
+
+def source_fingerprint(source, block_size=1 << 20):
+    """Skrót zawartości pliku (ścieżka albo obiekt plikowy) czytanego blokami"""
+    digest = hashlib.blake2b(digest_size=16)
+    opened = isinstance(source, (str, os.PathLike))
+    handle = open(source, 'rb') if opened else source
+    try:
+        handle.seek(0)
+        while True:
+            block = handle.read(block_size)
+            if not block:
+                break
+            digest.update(block.encode('utf-8') if isinstance(block, str) else block)
+    finally:
+        if opened:
+            handle.close()
+        else:
+            handle.seek(0)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Wyniki backtestu w pamięci (LRU), bezpieczne dla wątków puli par.
+
+    Klucz: symbol + fingerprint danych + okno pivotów (lookback) + parametry strategii
+    (portfel: te same składniki każdej pary). Fees, prognoza
+    i opcje wyświetlania nie wchodzą do klucza - ich zmiana liczy tylko
+    post-processing na zapamiętanych transakcjach.
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def symbol_cpu_pool(n_symbols, max_workers=SYMBOL_CPU_WORKERS):
+    """Pula procesów etapu CPU (compute_symbol) dla n_symbols par; None = liczenie w wątku pary"""
+    workers = min(max_workers, n_symbols)
+    return process_pool(workers) if workers > 1 else None
+
+
+def compute_symbol(df, symbol, lookback_days, costs, backtest_params, shared_margin=False):
+    """
+    Etap CPU pary: pivoty i backtest (funkcja modułu - wykonywana także w procesie roboczym).
+    Zwraca (pivot_df, None) przy wspólnym marginie, inaczej (None, wynik run_backtest).
+    """
+    backtester = PivotBacktester(lookback_days=lookback_days, costs=costs)
+    pivot_df = backtester.calculate_pivot_points(df)
+    if shared_margin:
+        return pivot_df, None
+    return None, backtester.run_backtest(pivot_df, symbol, *backtest_params)
+
+
+def process_symbol(backtester, symbol, uploaded_file, days, backtest_params, shared_margin=False,
+                   intraday_stream=False, result_cache=None, bar_interval=None, cpu_pool=None):
+    """
+    Dane + pivoty + backtest jednej pary (zadanie dla puli wątków).
+
+    backtest_params: argumenty run_backtest od initial_capital do capital_usage_pct.
+    result_cache (ResultCache): pivoty/backtest pomijane, jeśli dane i parametry
+    strategii są takie same jak w zapamiętanym przebiegu.
+    bar_interval: bary z magazynu (cały zapisany zakres) zamiast Yahoo; z intraday_stream
+    czytane paczkami jak plik CSV.
+    cpu_pool (symbol_cpu_pool): pivoty i backtest barów w puli procesów - wątek pary tylko
+    pobiera dane i czeka na wynik. Tryby strumieniowe (czytanie paczkami) zostają w wątku.
+    Zwraca dict: ok, status, pivot_df (tryb wspólnego marginu), result (krotka z run_backtest),
+    closes (Date/Close do wyceny mark-to-market; None w trybie strumieniowym), fingerprint (danych),
+    lookback_days (okno pivotów, część klucza portfela), cached.
+    """
+    outcome = {'ok': False, 'status': '', 'pivot_df': None, 'result': None, 'closes': None,
+               'fingerprint': None, 'lookback_days': backtester.lookback_days, 'cached': False}
+
+    if uploaded_file is not None and intraday_stream and not shared_margin:
+        key = None
+        if result_cache is not None:
+            outcome['fingerprint'] = source_fingerprint(uploaded_file)
+            key = ('stream', symbol, outcome['fingerprint'], backtester.lookback_days, tuple(backtest_params),
+                   backtester.costs_key)
+            cached = result_cache.get(key)
+            if cached is not None:
+                return {**outcome, **cached, 'cached': True}
+
+        try:
+            outcome['result'] = backtester.run_backtest_streaming(uploaded_file, symbol, *backtest_params)
+        except Exception as e:
+            outcome['status'] = f"Błąd: {str(e)}"
+            return outcome
+        outcome['ok'] = True
+        outcome['status'] = f"intraday strumieniowo, {len(outcome['result'][0])} transakcji"
+        if key is not None:
+            result_cache.put(key, {'ok': True, 'status': outcome['status'], 'result': outcome['result']})
+        return outcome
+
+    if uploaded_file is None and bar_interval and intraday_stream and not shared_margin:
+        if backtester.bar_store is None:
+            outcome['status'] = "Brak magazynu barów"
+            return outcome
+        try:
+            outcome['result'] = backtester.run_backtest_store(symbol, bar_interval, *backtest_params)
+        except Exception as e:
+            outcome['status'] = f"Błąd: {str(e)}"
+            return outcome
+        outcome['ok'] = True
+        outcome['status'] = f"{bar_interval} z magazynu strumieniowo, {len(outcome['result'][0])} transakcji"
+        return outcome
+
+    df, outcome['status'] = load_symbol_data(backtester, symbol, uploaded_file, days, bar_interval)
+    if df is None or len(df) == 0:
+        return outcome
+
+    outcome['ok'] = True
+    key = None
+    if result_cache is not None:
+        outcome['fingerprint'] = data_fingerprint(df)
+        key = ('bars', symbol, outcome['fingerprint'], backtester.lookback_days,
+               None if shared_margin else (tuple(backtest_params), backtester.costs_key))
+        cached = result_cache.get(key)
+        if cached is not None:
+            return {**outcome, **cached, 'cached': True}
+
+    outcome['closes'] = df[['Date', 'Close']].reset_index(drop=True)
+    compute_args = (df, symbol, backtester.lookback_days, backtester.costs, tuple(backtest_params), shared_margin)
+    if cpu_pool is None:
+        outcome['pivot_df'], outcome['result'] = compute_symbol(*compute_args)
+    else:
+        outcome['pivot_df'], outcome['result'] = cpu_pool.submit(compute_symbol, *compute_args).result()
+
+    if not shared_margin:
+        trades_df, final_cap = outcome['result'][:2]
+        initial_cap = backtest_params[0]
+        return_pct = (final_cap - initial_cap) / initial_cap * 100
+        outcome['status'] += f" — {len(trades_df)} transakcji, zwrot {return_pct:+.2f}%"
+
+    if key is not None:
+        result_cache.put(key, {'status': outcome['status'], 'pivot_df': outcome['pivot_df'],
+                               'result': outcome['result'], 'closes': outcome['closes']})
+    return outcome
+
+
+def assemble_portfolio(symbols, outcomes, initial_capital, backtest_params, shared_margin=False,
+                       result_cache=None, costs=None):
+    """
+    Złóż wyniki par (w kolejności symbols) w portfel.
+
+    outcomes: {symbol: wynik process_symbol}. Przy wspólnym marginie jeden
+    run_portfolio_backtest na ramkach pivot wszystkich par - z result_cache
+    pomijany, gdy fingerprinty danych, okna pivotów i parametry się nie zmieniły.
+    costs: CostModel wspólnego backtestu.
+    Zwraca (combined_trades z kolumną 'Portfolio Capital', results_per_symbol).
+    """
+    key = None
+    fingerprints = [outcomes[symbol].get('fingerprint') for symbol in symbols]
+    if result_cache is not None and all(fingerprints):
+        # Ramki pivot zależą od lookback - ten sam fingerprint danych z innym oknem to inny portfel
+        lookbacks = [outcomes[symbol].get('lookback_days') for symbol in symbols]
+        key = ('portfolio', tuple(zip(symbols, fingerprints, lookbacks)), initial_capital, tuple(backtest_params),
+               shared_margin, None if costs is None else costs.fingerprint)
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached
+
+    capital_per_pair = backtest_params[0]
+    all_trades = []
+    results_per_symbol = {}
+    pivot_frames = {}
+
+    for symbol in symbols:
+        outcome = outcomes[symbol]
+        if outcome['pivot_df'] is not None:
+            pivot_frames[symbol] = outcome['pivot_df']
+        if outcome['result'] is not None:
+            trades_df, final_cap, mc_count, skip_count = outcome['result']
+            all_trades.append(trades_df)
+            results_per_symbol[symbol] = {
+                'trades': trades_df,
+                'final_capital': final_cap,
+                'initial_capital': capital_per_pair,
+                'margin_calls': mc_count,
+                'skipped_no_margin': skip_count
+            }
+
+    if shared_margin and len(pivot_frames) > 0:
+        # Jeden kapitał i jedna pula marginu dla wszystkich par
+        portfolio_trades, _, portfolio_stats = run_portfolio_backtest(
+            pivot_frames, initial_capital, *backtest_params[1:], costs=costs
+        )
+
+        all_trades.append(portfolio_trades)
+        for symbol in pivot_frames:
+            if len(portfolio_trades) > 0:
+                trades_df = portfolio_trades[portfolio_trades['Symbol'] == symbol]
+            else:
+                trades_df = portfolio_trades
+            symbol_profit = trades_df['Profit (base)'].sum() if len(trades_df) > 0 else 0
+            results_per_symbol[symbol] = {
+                'trades': trades_df,
+                'final_capital': capital_per_pair + symbol_profit,
+                'initial_capital': capital_per_pair,
+                **portfolio_stats[symbol]
+            }
+
+    if len(all_trades) == 0:
+        combined_trades = pd.DataFrame()
+    else:
+        combined_trades = pd.concat(all_trades, ignore_index=True)
+        combined_trades = combined_trades.sort_values('Exit Date', kind='stable').reset_index(drop=True)
+
+    if len(combined_trades) > 0:
+        if shared_margin:
+            # Kapitał wspólnej puli po każdej transakcji
+            combined_trades['Portfolio Capital'] = combined_trades['Capital']
+        else:
+            combined_trades['Portfolio Capital'] = portfolio_capital_curve(
+                combined_trades['Profit (base)'], initial_capital
+            )
+
+    if key is not None:
+        result_cache.put(key, (combined_trades, results_per_symbol))
+    return combined_trades, results_per_symbol
+
+
+def portfolio_equity_curve(combined_trades, outcomes, initial_capital, spread_value, costs=None):
+    """
+    Equity portfela per bar (mark-to-market otwartych pozycji) z barów Close par.
+    Pary bez barów (tryb strumieniowy) wchodzą tylko kapitałem zrealizowanym.
+    """
+    closes = {symbol: outcome['closes'] for symbol, outcome in outcomes.items()
+              if outcome.get('closes') is not None}
+    return mark_to_market_equity(combined_trades, closes, initial_capital, spread_value, costs=costs)
+
+
+# ============================================
+# BATCH (CLI)
+# ============================================
+
+DEFAULT_PARAMS = {
+    'initial_capital': 10000,
+    'spread_value': 0.0002,
+    'lookback_days': 7,
+    'holding_days': 5,
+    'stop_loss_pct': None,
+    'support_level': 'S3',
+    'resistance_level': 'R3',
+    'trade_direction': 'Both',
+    'leverage': 1,
+    'capital_usage_pct': 100,
+    'days': 1825,
+    'shared_margin': False,
+    'intraday_stream': False,
+    'management_fee_pct': 1.5,
+    'success_fee_pct': 12.0,
+    'fee_period': 'Y',
+    'spread_file': None,
+    'swap_file': None,
+    'bar_interval': None
+}
+
+OUTPUT_FORMATS = ['parquet', 'csv']
+
+
+def load_params(path=None):
+    """Parametry z pliku JSON na tle DEFAULT_PARAMS (nieznane klucze = błąd)"""
+    params = dict(DEFAULT_PARAMS)
+    if path is None:
+        return params
+
+    with open(path, encoding='utf-8') as handle:
+        overrides = json.load(handle)
+
+    unknown = sorted(set(overrides) - set(DEFAULT_PARAMS))
+    if unknown:
+        raise ValueError(f"Nieznane parametry: {', '.join(unknown)}")
+
+    params.update(overrides)
+    return params
+
+
+def run_batch(symbols, params, csv_files=None, bar_store=None, offline=False,
+              max_workers=SYMBOL_WORKERS, progress_callback=None, cpu_workers=SYMBOL_CPU_WORKERS):
+    """
+    Backtest listy par bez UI: te same kroki co przycisk URUCHOM BACKTEST.
+
+    csv_files: {symbol: ścieżka} - pary z pliku zamiast z Yahoo.
+    max_workers: wątki pobierania danych; cpu_workers: procesy pivotów + backtestu (1 = w wątkach).
+    progress_callback(symbol, outcome, done, total) po każdej ukończonej parze.
+    Zwraca dict: trades, yearly_before, yearly_after, equity, equity_mtm (per bar), results_per_symbol, summary.
+    """
+    csv_files = csv_files or {}
+    capital_per_pair = params['initial_capital'] / len(symbols)
+    backtest_params = (
+        capital_per_pair, params['spread_value'], params['holding_days'], params['stop_loss_pct'],
+        params['support_level'], params['resistance_level'], params['trade_direction'],
+        params['leverage'], params['capital_usage_pct']
+    )
+    costs = None
+    if params['spread_file'] or params['swap_file']:
+        costs = CostModel.from_files(params['spread_file'], params['swap_file'], params['spread_value'])
+    backtester = PivotBacktester(lookback_days=params['lookback_days'], bar_store=bar_store, offline=offline,
+                                 costs=costs)
+
+    outcomes = {}
+    with symbol_cpu_pool(len(symbols), cpu_workers) or nullcontext() as cpu_pool, \
+            ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(symbols)))) as pool:
+        futures = {
+            pool.submit(process_symbol, backtester, symbol, csv_files.get(symbol), params['days'],
+                        backtest_params, params['shared_margin'], params['intraday_stream'],
+                        bar_interval=params['bar_interval'], cpu_pool=cpu_pool): symbol
+            for symbol in symbols
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            symbol = futures[future]
+            outcomes[symbol] = future.result()
+            if progress_callback is not None:
+                progress_callback(symbol, outcomes[symbol], done, len(symbols))
+
+    combined_trades, results_per_symbol = assemble_portfolio(
+        symbols, outcomes, params['initial_capital'], backtest_params, params['shared_margin'], costs=costs
+    )
+
+    equity_mtm = portfolio_equity_curve(combined_trades, outcomes, params['initial_capital'], params['spread_value'],
+                                        costs)
+
+    if len(combined_trades) > 0:
+        yearly_before, yearly_after = calculate_yearly_stats_with_fees(
+            combined_trades, params['initial_capital'], params['management_fee_pct'],
+            params['success_fee_pct'], params['fee_period'], equity_mtm
+        )
+        equity = combined_trades[['Exit Date', 'Symbol', 'Profit (base)', 'Portfolio Capital']]
+        final_capital = float(combined_trades['Portfolio Capital'].iloc[-1])
+    else:
+        yearly_before, yearly_after = pd.DataFrame(), pd.DataFrame()
+        equity = pd.DataFrame(columns=['Exit Date', 'Symbol', 'Profit (base)', 'Portfolio Capital'])
+        final_capital = float(params['initial_capital'])
+
+    final_after_fees = float(yearly_after['End Capital'].iloc[-1]) if len(yearly_after) > 0 else final_capital
+    summary = {
+        'symbols': {symbol: outcomes[symbol]['status'] for symbol in symbols},
+        'failed': [symbol for symbol in symbols if not outcomes[symbol]['ok']],
+        'trades': int(len(combined_trades)),
+        'initial_capital': float(params['initial_capital']),
+        'final_capital': final_capital,
+        'return_pct': (final_capital / params['initial_capital'] - 1) * 100,
+        'final_capital_after_fees': final_after_fees,
+        'margin_calls': int(sum(r.get('margin_calls', 0) for r in results_per_symbol.values())),
+        'skipped_no_margin': int(sum(r.get('skipped_no_margin', 0) for r in results_per_symbol.values())),
+        'equity_mtm': equity_curve_stats(equity_mtm),
+        'params': params
+    }
+
+    return {
+        'trades': combined_trades,
+        'yearly_before': yearly_before,
+        'yearly_after': yearly_after,
+        'equity': equity,
+        'equity_mtm': equity_mtm,
+        'results_per_symbol': results_per_symbol,
+        'summary': summary
+    }
+
+
+def write_outputs(results, output_dir, fmt='parquet'):
+    """Zapisz tabele wyników (Parquet/CSV) i summary.json; zwraca listę ścieżek"""
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Nieznany format: {fmt}")
+
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+
+    for name in ['trades', 'yearly_before', 'yearly_after', 'equity', 'equity_mtm']:
+        path = os.path.join(output_dir, f"{name}.{fmt}")
+        if fmt == 'parquet' and name == 'trades' and len(results[name]) > 0:
+            # Symbol / Type / Entry Level / Exit Reason jako dictionary (kategorie)
+            TradeLedger.from_dataframe(results[name]).to_parquet(path)
+        elif fmt == 'parquet':
+            results[name].to_parquet(path, index=False)
+        else:
+            results[name].to_csv(path, index=False)
+        paths.append(path)
+
+    path = os.path.join(output_dir, 'summary.json')
+    with open(path, 'w', encoding='utf-8') as handle:
+        json.dump(results['summary'], handle, indent=2, ensure_ascii=False, default=str)
+    paths.append(path)
+    return paths
+
+
+def _parse_symbols(values):
+    symbols = []
+    for value in values:
+        for symbol in value.replace(';', ',').split(','):
+            symbol = symbol.strip().upper()
+            if symbol and symbol not in symbols:
+                symbols.append(symbol)
+    return symbols
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pivot Strategy Backtester - batch bez UI")
+    parser.add_argument('--params', help="plik JSON z parametrami (domyślne: DEFAULT_PARAMS)")
+    parser.add_argument('--symbols', nargs='+', required=True, help="pary, np. EURUSD USDJPY albo EURUSD,USDJPY")
+    parser.add_argument('--csv-dir', help="katalog z plikami <SYMBOL>.csv (zamiast Yahoo dla znalezionych par)")
+    parser.add_argument('--output-dir', default='results', help="katalog wyników")
+    parser.add_argument('--format', choices=OUTPUT_FORMATS, default='parquet')
+    parser.add_argument('--bar-db', default=BAR_DB, help="magazyn barów SQLite")
+    parser.add_argument('--no-store', action='store_true', help="pobieraj z Yahoo bez magazynu barów")
+    parser.add_argument('--offline', action='store_true', help="tylko dane z magazynu barów (bez sieci)")
+    parser.add_argument('--workers', type=int, default=SYMBOL_WORKERS, help="wątki pobierania danych")
+    parser.add_argument('--cpu-workers', type=int, default=SYMBOL_CPU_WORKERS,
+                        help="procesy pivotów + backtestu (1 = bez puli procesów)")
+    args = parser.parse_args(argv)
+
+    try:
+        params = load_params(args.params)
+    except (OSError, ValueError) as e:
+        print(f"Błąd parametrów: {e}", file=sys.stderr)
+        return 2
+
+    symbols = _parse_symbols(args.symbols)
+    csv_files = {}
+    if args.csv_dir:
+        for symbol in symbols:
+            path = os.path.join(args.csv_dir, f"{symbol}.csv")
+            if os.path.exists(path):
+                csv_files[symbol] = path
+
+    bar_store = None if args.no_store else BarStore(args.bar_db)
+
+    def report(symbol, outcome, done, total):
+        mark = 'OK ' if outcome['ok'] else 'ERR'
+        print(f"[{done}/{total}] {mark} {symbol}: {outcome['status']}", file=sys.stderr)
+
+    started = time.perf_counter()
+    results = run_batch(symbols, params, csv_files, bar_store, args.offline, args.workers, report, args.cpu_workers)
+    paths = write_outputs(results, args.output_dir, args.format)
+
+    summary = results['summary']
+    print(f"{summary['trades']} transakcji | kapitał {summary['final_capital']:,.2f} "
+          f"({summary['return_pct']:+.2f}%) | po fees {summary['final_capital_after_fees']:,.2f} | "
+          f"{time.perf_counter() - started:.1f}s", file=sys.stderr)
+    for path in paths:
+        print(path)
+
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
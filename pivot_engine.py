@@ -0,0 +1,1809 @@
+#!/usr/bin/env python3
+"""
+Pivot Strategy Engine - obliczenia bez Streamlit
+Silnik tablicowy (NumPy) dla PivotBacktester z premiumhedge.py.
+
+Moduł nie importuje Streamlit, więc można go używać w skryptach,
+benchmarkach i w procesach roboczych (multiprocessing).
+"""
+
+import heapq
+import itertools
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    HAS_PYARROW = True
+except ImportError:  # eksport ledgera do Arrow/Parquet niedostępny
+    pa = pq = None
+    HAS_PYARROW = False
+
+PIVOT_LEVELS = ['Pivot', 'R1', 'R2', 'R3', 'S1', 'S2', 'S3']
+
+
+def pivot_column(level, lookback=None):
+    """Nazwa kolumny poziomu pivot (z sufiksem lookback dla bloków)"""
+    return level if lookback is None else f"{level}_{lookback}"
+
+
+def shifted_window_mean(values, lookback):
+    """
+    Średnia z poprzednich `lookback` wartości dla każdego wiersza.
+
+    Odpowiednik rolling(lookback).mean().shift(1), ale liczony oknem
+    przesuwnym (sliding_window_view) - daje te same bity co
+    df.iloc[i - lookback:i].mean(). rolling().mean() sumuje przyrostowo
+    i różni się na ostatnich miejscach po przecinku.
+    Pierwsze `lookback` wierszy = NaN.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    result = np.full(len(values), np.nan)
+
+    if lookback <= 0 or len(values) <= lookback:
+        return result
+
+    windows = sliding_window_view(values, lookback)[:-1]
+    result[lookback:] = windows.mean(axis=1)
+    return result
+
+
+def calculate_pivot_levels(high, low, close, lookback):
+    """
+    Pivot/R1-R3/S1-S3 dla całej serii w jednym przebiegu.
+
+    Zwraca dict {poziom: tablica} o długości serii; wiersz i korzysta
+    z okna [i - lookback, i), tak jak pętla w calculate_pivot_points.
+    """
+    avg_high = shifted_window_mean(high, lookback)
+    avg_low = shifted_window_mean(low, lookback)
+    avg_close = shifted_window_mean(close, lookback)
+
+    pivot = (avg_high + avg_low + avg_close) / 3
+    range_val = avg_high - avg_low
+
+    r1 = 2 * pivot - avg_low
+    r2 = pivot + range_val
+    s1 = 2 * pivot - avg_high
+    s2 = pivot - range_val
+
+    r3 = r2 + range_val
+    s3 = s2 - range_val
+
+    return {
+        'Pivot': pivot,
+        'R1': r1, 'R2': r2, 'R3': r3,
+        'S1': s1, 'S2': s2, 'S3': s3
+    }
+
+
+def add_pivot_columns(df, lookbacks, suffixed=True):
+    """
+    Dodaj bloki kolumn pivot dla jednego lub kilku okresów lookback.
+
+    suffixed=True: blok na każdy lookback ('Pivot_7', 'R1_7', ..., 'S3_7').
+    suffixed=False: jeden lookback, nazwy jak w PivotBacktester ('Pivot', 'R1', ...).
+    """
+    if np.isscalar(lookbacks):
+        lookbacks = [lookbacks]
+
+    if not suffixed and len(lookbacks) != 1:
+        raise ValueError("suffixed=False wymaga dokładnie jednego lookback")
+
+    df = df.reset_index(drop=True)
+
+    high = df['High'].to_numpy(dtype=np.float64)
+    low = df['Low'].to_numpy(dtype=np.float64)
+    close = df['Close'].to_numpy(dtype=np.float64)
+
+    blocks = {}
+    for lookback in lookbacks:
+        levels = calculate_pivot_levels(high, low, close, lookback)
+        for level in PIVOT_LEVELS:
+            blocks[pivot_column(level, lookback if suffixed else None)] = levels[level]
+
+    columns = [col for col in df.columns if col not in blocks]
+    return pd.concat([df[columns], pd.DataFrame(blocks, index=df.index)], axis=1)
+
+
+def select_pivot_block(df, lookback):
+    """Widok df z blokiem pivot danego lookback pod standardowymi nazwami"""
+    renamed = {pivot_column(level, lookback): level for level in PIVOT_LEVELS}
+    base = [col for col in df.columns if col not in PIVOT_LEVELS and not _is_pivot_block(col)]
+    return df[base + list(renamed)].rename(columns=renamed)
+
+
+def _is_pivot_block(col):
+    level, _, suffix = str(col).rpartition('_')
+    return level in PIVOT_LEVELS and suffix.isdigit()
+
+
+# ============================================
+# SILNIK BACKTESTU (TABLICE NUMPY)
+# ============================================
+
+TRADE_COLUMNS = [
+    'Symbol', 'Entry Date', 'Exit Date', 'Type', 'Entry Price', 'Exit Price',
+    'Entry Level', 'Entry Level Value', 'Price Diff', 'Pips',
+    'Profit (quoted)', 'Profit (base)', 'P&L %', 'ROI Margin %',
+    'Margin Used', 'Eff. Volume', 'Capital', 'Leverage', 'Duration', 'Exit Reason'
+]
+
+EXIT_REASONS = ['Time exit', 'Stop Loss', 'Margin Call', 'End of data']
+EXIT_TIME, EXIT_STOP_LOSS, EXIT_MARGIN_CALL, EXIT_END_OF_DATA = range(len(EXIT_REASONS))
+TRADE_TYPES = ['SHORT', 'LONG']  # kod = is_long
+
+DAY_NS = 86_400 * 10 ** 9
+
+
+def pip_value_for(symbol):
+    """Wartość pipsa: 0.01 dla par z JPY, 0.0001 dla pozostałych"""
+    return 0.01 if 'JPY' in symbol else 0.0001
+
+
+class _Position:
+    """Otwarta pozycja - rekord ze __slots__ zamiast dict"""
+    __slots__ = ('seq', 'symbol_idx', 'is_long', 'entry_idx', 'entry_date', 'entry_price',
+                 'level_value', 'margin', 'eff_volume',
+                 'exit_idx', 'exit_reason', 'exit_price_raw', 'exit_date')
+
+
+class _SymbolArrays:
+    """Tablice NumPy jednego symbolu (tylko bary z policzonymi pivotami)"""
+    __slots__ = ('symbol', 'dates', 'high', 'low', 'close', 'support', 'resistance',
+                 'long_signal', 'short_signal', 'pip_value', 'last_date', 'last_close')
+
+
+def _prepare_symbol(df, symbol, support_level, resistance_level, trade_direction):
+    """Załaduj Date/OHLC/pivot symbolu do tablic + maski sygnałów poniedziałkowych"""
+    df = df.reset_index(drop=True)
+
+    if 'S3' in df.columns and 'R3' in df.columns:
+        valid = (df['S3'].notna() & df['R3'].notna()).to_numpy()
+    else:
+        valid = np.zeros(len(df), dtype=bool)
+
+    arrays = _SymbolArrays()
+    arrays.symbol = symbol
+    all_dates = df['Date'].to_numpy(dtype='datetime64[ns]')
+    arrays.dates = all_dates[valid]
+    arrays.high = df['High'].to_numpy(dtype=np.float64)[valid]
+    arrays.low = df['Low'].to_numpy(dtype=np.float64)[valid]
+    arrays.close = df['Close'].to_numpy(dtype=np.float64)[valid]
+    arrays.pip_value = pip_value_for(symbol)
+    arrays.last_date = all_dates[-1] if len(df) > 0 else None
+    arrays.last_close = float(df['Close'].iloc[-1]) if len(df) > 0 else None
+
+    n = len(arrays.dates)
+    if n > 0:
+        arrays.support = df[support_level].to_numpy(dtype=np.float64)[valid]
+        arrays.resistance = df[resistance_level].to_numpy(dtype=np.float64)[valid]
+        is_monday = pd.DatetimeIndex(arrays.dates).weekday.to_numpy() == 0
+    else:
+        arrays.support = arrays.resistance = arrays.close
+        is_monday = np.zeros(0, dtype=bool)
+
+    no_signal = np.zeros(n, dtype=bool)
+    arrays.long_signal = is_monday & (arrays.close < arrays.support) \
+        if trade_direction in ['Both', 'Long Only'] else no_signal
+    arrays.short_signal = is_monday & (arrays.close > arrays.resistance) \
+        if trade_direction in ['Both', 'Short Only'] else no_signal
+    return arrays
+
+
+class _TradeBuffer:
+    """Prealokowane kolumny transakcji (zamiast listy dictów)"""
+
+    def __init__(self, capacity):
+        self.size = 0
+        self.symbol_idx = np.empty(capacity, dtype=np.int32)
+        self.entry_date = np.empty(capacity, dtype='datetime64[ns]')
+        self.exit_date = np.empty(capacity, dtype='datetime64[ns]')
+        self.is_long = np.empty(capacity, dtype=bool)
+        self.exit_reason = np.empty(capacity, dtype=np.int8)
+        self.floats = {
+            name: np.empty(capacity, dtype=np.float64)
+            for name in ['Entry Price', 'Exit Price', 'Entry Level Value', 'Price Diff', 'Pips',
+                         'Profit (quoted)', 'Profit (base)', 'P&L %', 'ROI Margin %',
+                         'Margin Used', 'Eff. Volume', 'Capital']
+        }
+
+    def reserve(self, extra):
+        """Powiększ bufor (x2), jeśli nie zmieści `extra` kolejnych transakcji"""
+        needed = self.size + extra
+        capacity = len(self.exit_reason)
+        if needed <= capacity:
+            return
+
+        capacity = max(needed, 2 * capacity)
+        for name in ['symbol_idx', 'entry_date', 'exit_date', 'is_long', 'exit_reason']:
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+        for name, old in self.floats.items():
+            new = np.empty(capacity, dtype=np.float64)
+            new[:self.size] = old[:self.size]
+            self.floats[name] = new
+
+    def append(self, pos, exit_date, exit_reason, exit_price, price_diff, pips,
+               profit_quoted, profit_base, pnl_pct, roi_on_margin, capital):
+        i = self.size
+        self.symbol_idx[i] = pos.symbol_idx
+        self.entry_date[i] = pos.entry_date
+        self.exit_date[i] = exit_date
+        self.is_long[i] = pos.is_long
+        self.exit_reason[i] = exit_reason
+
+        f = self.floats
+        f['Entry Price'][i] = pos.entry_price
+        f['Exit Price'][i] = exit_price
+        f['Entry Level Value'][i] = pos.level_value
+        f['Price Diff'][i] = price_diff
+        f['Pips'][i] = pips
+        f['Profit (quoted)'][i] = profit_quoted
+        f['Profit (base)'][i] = profit_base
+        f['P&L %'][i] = pnl_pct
+        f['ROI Margin %'][i] = roi_on_margin
+        f['Margin Used'][i] = pos.margin
+        f['Eff. Volume'][i] = pos.eff_volume
+        f['Capital'][i] = capital
+        self.size += 1
+
+    def to_ledger(self, symbols, support_level, resistance_level, leverage, date_dtype):
+        """TradeLedger z wypełnionej części bufora (kolumny bez kopiowania, gdzie się da)"""
+        n = self.size
+        is_long = self.is_long[:n]
+        entry_date = self.entry_date[:n]
+        exit_date = self.exit_date[:n]
+
+        levels = list(dict.fromkeys([support_level, resistance_level]))
+        level_codes = np.where(is_long, levels.index(support_level),
+                               levels.index(resistance_level)).astype(np.int8)
+
+        columns = {
+            'Symbol': (self.symbol_idx[:n], list(symbols)),
+            'Entry Date': entry_date.astype(date_dtype, copy=False),
+            'Exit Date': exit_date.astype(date_dtype, copy=False),
+            'Type': (is_long.view(np.int8), TRADE_TYPES),
+            'Entry Level': (level_codes, levels),
+        }
+        for name, values in self.floats.items():
+            columns[name] = values[:n]
+        columns['Leverage'] = np.full(n, leverage)
+        columns['Duration'] = (exit_date - entry_date) // np.timedelta64(1, 'D')
+        columns['Exit Reason'] = (self.exit_reason[:n], EXIT_REASONS)
+
+        return TradeLedger({name: columns[name] for name in TRADE_COLUMNS})
+
+    def to_dataframe(self, symbols, support_level, resistance_level, leverage, date_dtype):
+        """DataFrame w układzie kolumn z PivotBacktester.run_backtest"""
+        if self.size == 0:
+            return pd.DataFrame()
+        return self.to_ledger(symbols, support_level, resistance_level, leverage, date_dtype).to_dataframe()
+
+
+class TradeLedger:
+    """
+    Kolumnowy rejestr transakcji: tablice NumPy zamiast obiektów w DataFrame.
+
+    columns: {nazwa: tablica} albo {nazwa: (kody, kategorie)} dla kolumn
+    kategorycznych (Symbol, Type, Entry Level, Exit Reason) - kod int8/int32
+    na transakcję zamiast stringa. Eksport do Arrow/Parquet bez kopiowania
+    tablic liczbowych i dat; kolumny kategoryczne jako dictionary.
+    """
+
+    def __init__(self, columns):
+        self.columns = dict(columns)
+        lengths = {len(self._values(name)) for name in self.columns}
+        if len(lengths) > 1:
+            raise ValueError("Kolumny ledgera muszą mieć tę samą długość")
+        self.size = lengths.pop() if lengths else 0
+
+    def __len__(self):
+        return self.size
+
+    def _values(self, name):
+        column = self.columns[name]
+        return column[0] if isinstance(column, tuple) else column
+
+    def is_categorical(self, name):
+        return isinstance(self.columns[name], tuple)
+
+    @property
+    def nbytes(self):
+        """Pamięć tablic ledgera (bez słowników kategorii)"""
+        return sum(self._values(name).nbytes for name in self.columns)
+
+    def column(self, name, categorical=False):
+        """Kolumna jako tablica; kategoryczna jako pd.Categorical albo tablica object"""
+        column = self.columns[name]
+        if not isinstance(column, tuple):
+            return column
+        codes, categories = column
+        if categorical:
+            return pd.Categorical.from_codes(codes, categories=categories)
+        values = np.asarray(categories, dtype=object)[codes]
+        if (codes < 0).any():
+            values[codes < 0] = None
+        return values
+
+    def to_dataframe(self, categorical=False):
+        """DataFrame; categorical=True zostawia kody (dtype category) zamiast stringów"""
+        return pd.DataFrame({name: self.column(name, categorical) for name in self.columns},
+                            columns=list(self.columns))
+
+    def to_arrow(self):
+        """pyarrow.Table - tablice liczbowe i daty bez kopiowania, kategorie jako dictionary"""
+        if not HAS_PYARROW:
+            raise ImportError("Eksport do Arrow/Parquet wymaga pakietu pyarrow")
+
+        arrays = []
+        for name, column in self.columns.items():
+            if isinstance(column, tuple):
+                codes, categories = column
+                missing = codes < 0
+                indices = pa.array(codes, mask=missing) if missing.any() else pa.array(codes)
+                arrays.append(pa.DictionaryArray.from_arrays(
+                    indices, pa.array([str(c) for c in categories], type=pa.string())))
+            else:
+                arrays.append(pa.array(column))
+        return pa.Table.from_arrays(arrays, names=list(self.columns))
+
+    def to_parquet(self, path, compression='zstd'):
+        """Zapis do Parquet (ścieżka albo obiekt plikowy)"""
+        pq.write_table(self.to_arrow(), path, compression=compression)
+
+    @classmethod
+    def from_dataframe(cls, df):
+        """Ledger z DataFrame transakcji (kolumny tekstowe jako kategorie, reszta bez zmian)"""
+        columns = {}
+        for name in df.columns:
+            series = df[name]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                columns[name] = (series.cat.codes.to_numpy(), list(series.cat.categories))
+            elif series.dtype == object or pd.api.types.is_string_dtype(series.dtype):
+                codes, categories = pd.factorize(series)
+                columns[name] = (codes.astype(np.int32), list(categories))
+            else:
+                columns[name] = series.to_numpy()
+        return cls(columns)
+
+    @classmethod
+    def concat(cls, ledgers, run_column=None):
+        """
+        Sklej ledgery (np. wszystkich kombinacji sweepu) - kategorie łączone,
+        kody przemapowane. run_column: nazwa kolumny z numerem ledgera (int32).
+        """
+        ledgers = [ledger for ledger in ledgers if len(ledger) > 0]
+        if not ledgers:
+            return cls({})
+
+        names = list(ledgers[0].columns)
+        if any(list(ledger.columns) != names for ledger in ledgers):
+            raise ValueError("Ledgery mają różne kolumny")
+
+        columns = {}
+        if run_column is not None:
+            columns[run_column] = np.repeat(np.arange(len(ledgers), dtype=np.int32),
+                                            [len(ledger) for ledger in ledgers])
+        for name in names:
+            if not ledgers[0].is_categorical(name):
+                columns[name] = np.concatenate([ledger.columns[name] for ledger in ledgers])
+                continue
+
+            categories = list(dict.fromkeys(
+                itertools.chain.from_iterable(ledger.columns[name][1] for ledger in ledgers)))
+            position = {category: i for i, category in enumerate(categories)}
+            code_dtype = np.int8 if len(categories) <= np.iinfo(np.int8).max else np.int32
+            parts = []
+            for ledger in ledgers:
+                codes, ledger_categories = ledger.columns[name]
+                # -1 (brak) mapowane na ostatni element = -1
+                mapping = np.array([position[c] for c in ledger_categories] + [-1], dtype=code_dtype)
+                parts.append(mapping[codes])
+            columns[name] = (np.concatenate(parts), categories)
+        return cls(columns)
+
+
+def _find_exit(pos, arrays, hold_delta, stop_loss_pct, start=None):
+    """
+    Pierwszy bar zamknięcia pozycji (margin call > time exit > stop loss).
+
+    Warunki wyjścia zależą tylko od cen i parametrów pozycji, więc cały
+    okres holdingu sprawdzamy jednym wektorowym przebiegiem zaraz po otwarciu.
+    start: pierwszy sprawdzany bar (domyślnie bar po wejściu; 0 dla pozycji
+    przeniesionej z poprzedniej paczki danych).
+    Zwraca (indeks, powód, cena) albo None, gdy pozycja dotrwa do końca danych.
+    """
+    dates, high, low, close = arrays.dates, arrays.high, arrays.low, arrays.close
+    n = len(dates)
+    if start is None:
+        start = pos.entry_idx + 1
+    if start >= n:
+        return None
+
+    # Time exit: pierwszy bar z datą >= entry_date + holding_days
+    time_idx = start + int(np.searchsorted(dates[start:], pos.entry_date + hold_delta, side='left'))
+    stop = min(time_idx, n - 1)
+    seg = slice(start, stop + 1)
+
+    if pos.is_long:
+        check_price = low[seg]
+        unrealized_price_diff = check_price - pos.entry_price
+    else:
+        check_price = high[seg]
+        unrealized_price_diff = pos.entry_price - check_price
+
+    unrealized_quoted = unrealized_price_diff * pos.eff_volume
+    with np.errstate(divide='ignore', invalid='ignore'):
+        unrealized_base = np.where(check_price != 0, unrealized_quoted / check_price, 0.0)
+    margin_call = unrealized_base <= -pos.margin
+
+    hit = margin_call.copy()
+    stop_loss_price = None
+    if stop_loss_pct is not None and stop_loss_pct > 0:
+        if pos.is_long:
+            stop_loss_price = pos.entry_price * (1 - stop_loss_pct / 100)
+            hit |= low[seg] <= stop_loss_price
+        else:
+            stop_loss_price = pos.entry_price * (1 + stop_loss_pct / 100)
+            hit |= high[seg] >= stop_loss_price
+
+    if time_idx < n:
+        hit[-1] = True
+
+    if not hit.any():
+        return None
+
+    k = int(np.argmax(hit))
+    idx = start + k
+    if margin_call[k]:
+        return idx, EXIT_MARGIN_CALL, float(check_price[k])
+    if idx == time_idx:
+        return idx, EXIT_TIME, float(close[idx])
+    return idx, EXIT_STOP_LOSS, stop_loss_price
+
+
+class _PortfolioState:
+    """
+    Kapitał, pula marginu, otwarte pozycje i kolejka zamknięć.
+
+    Wspólne dla backtestu w pamięci (run_portfolio_backtest) i w paczkach
+    (run_backtest_chunked), więc oba liczą transakcje tymi samymi wyrażeniami.
+    """
+
+    def __init__(self, symbols, initial_capital, spread_value, holding_days, stop_loss_pct,
+                 leverage, capital_usage_pct, capacity=0, costs=None):
+        self.symbols = symbols
+        self.pip_values = [pip_value_for(symbol) for symbol in symbols]
+        self.capital = initial_capital
+        self.spread_value = spread_value
+        self.hold_delta = np.timedelta64(pd.Timedelta(days=holding_days))
+        self.stop_loss_pct = stop_loss_pct
+        self.leverage = leverage
+        self.usage = capital_usage_pct / 100
+        self.costs = costs  # CostModel (spread w czasie + swap) albo None = stały spread_value
+
+        self.buffer = _TradeBuffer(capacity)
+        self.stats = {symbol: {'margin_calls': 0, 'skipped_no_margin': 0} for symbol in symbols}
+        self.open_positions = {}  # seq -> _Position, kolejność otwarcia
+        self.exit_queue = []  # (czas zamknięcia, -seq)
+        self.next_seq = 0
+
+    def close_position(self, pos, exit_date, exit_reason, exit_price_raw):
+        costs = self.costs
+        symbol = self.symbols[pos.symbol_idx]
+        spread_value = self.spread_value if costs is None else costs.spread_at(symbol, exit_date)
+
+        if pos.is_long:
+            exit_price = exit_price_raw - spread_value
+            price_diff = exit_price - pos.entry_price
+        else:
+            exit_price = exit_price_raw + spread_value
+            price_diff = pos.entry_price - exit_price
+
+        profit_quoted = price_diff * pos.eff_volume
+        if costs is not None:
+            # Carry za noce trzymania pozycji (Price Diff / Pips bez swapu)
+            profit_quoted += costs.swap_price(symbol, pos.is_long, pos.entry_date, exit_date) * pos.eff_volume
+        profit_base = profit_quoted / exit_price if exit_price != 0 else 0
+
+        if exit_reason == EXIT_MARGIN_CALL:
+            profit_base = max(profit_base, -pos.margin)
+            self.stats[symbol]['margin_calls'] += 1
+
+        capital = self.capital
+        pnl_pct = (profit_base / capital) * 100 if capital != 0 else 0
+        roi_on_margin = (profit_base / pos.margin) * 100 if pos.margin != 0 else 0
+        pips_gained = price_diff / self.pip_values[pos.symbol_idx]
+
+        capital += profit_base
+        if capital < 0:
+            capital = 0
+        self.capital = capital
+
+        self.buffer.append(pos, exit_date, exit_reason, exit_price, price_diff, pips_gained,
+                           profit_quoted, profit_base, pnl_pct, roi_on_margin, capital)
+
+    def close_due(self, until_time):
+        """Zamknij pozycje z czasem zamknięcia <= until_time (ns)"""
+        exit_queue = self.exit_queue
+        while exit_queue and exit_queue[0][0] <= until_time:
+            _, neg_seq = heapq.heappop(exit_queue)
+            pos = self.open_positions.pop(-neg_seq)
+            self.close_position(pos, pos.exit_date, pos.exit_reason, pos.exit_price_raw)
+
+    def schedule_exit(self, pos, arrays, start=None):
+        """Znajdź bar zamknięcia w arrays; False, gdy pozycja przechodzi dalej"""
+        exit_info = _find_exit(pos, arrays, self.hold_delta, self.stop_loss_pct, start)
+        if exit_info is None:
+            return False
+
+        pos.exit_idx, pos.exit_reason, pos.exit_price_raw = exit_info
+        pos.exit_date = arrays.dates[pos.exit_idx]
+        heapq.heappush(self.exit_queue, (int(pos.exit_date.view(np.int64)), -pos.seq))
+        return True
+
+    def _open_position(self, symbol_idx, arrays, idx, is_long, entry_price, level_value,
+                       margin, eff_volume):
+        pos = _Position()
+        pos.seq = self.next_seq
+        pos.symbol_idx = symbol_idx
+        pos.is_long = is_long
+        pos.entry_idx = idx
+        pos.entry_date = arrays.dates[idx]
+        pos.entry_price = entry_price
+        pos.level_value = level_value
+        pos.margin = margin
+        pos.eff_volume = eff_volume
+        self.next_seq += 1
+
+        self.open_positions[pos.seq] = pos
+        return pos
+
+    def free_margin_now(self):
+        return self.capital - sum(pos.margin for pos in self.open_positions.values())
+
+    def enter(self, symbol_idx, arrays, idx):
+        """
+        Sygnał poniedziałkowy na barze idx: otwórz LONG i/lub SHORT wg wolnego marginu.
+        Zwraca listę nowych pozycji (bez wyznaczonego zamknięcia).
+        """
+        if self.capital <= 0:
+            return []
+
+        symbol_stats = self.stats[self.symbols[symbol_idx]]
+        usage = self.usage
+
+        current_price = float(arrays.close[idx])
+        free_margin = self.free_margin_now()
+        if free_margin <= 0:
+            return []
+
+        position_margin = free_margin * usage
+        if position_margin <= 0:
+            return []
+
+        if self.costs is None:
+            spread_value = self.spread_value
+        else:
+            spread_value = self.costs.spread_at(self.symbols[symbol_idx], arrays.dates[idx])
+
+        eff_volume = position_margin * self.leverage
+        opened = []
+
+        if arrays.long_signal[idx]:
+            if position_margin > free_margin:
+                symbol_stats['skipped_no_margin'] += 1
+            else:
+                opened.append(self._open_position(
+                    symbol_idx, arrays, idx, True, current_price + spread_value,
+                    float(arrays.support[idx]), position_margin, eff_volume
+                ))
+                free_margin = self.free_margin_now()
+
+        if arrays.short_signal[idx]:
+            if free_margin <= 0:
+                symbol_stats['skipped_no_margin'] += 1
+            else:
+                position_margin_short = min(position_margin, free_margin * usage)
+                if position_margin_short <= 0:
+                    symbol_stats['skipped_no_margin'] += 1
+                else:
+                    opened.append(self._open_position(
+                        symbol_idx, arrays, idx, False, current_price - spread_value,
+                        float(arrays.resistance[idx]),
+                        position_margin_short, position_margin_short * self.leverage
+                    ))
+
+        return opened
+
+    def finish(self, last_bars):
+        """
+        Koniec danych: zaległe zamknięcia, potem otwarte pozycje po ostatnim Close
+        symbolu (symbole wg daty ostatniego baru). last_bars: [(last_date, last_close)].
+        """
+        self.close_due(np.iinfo(np.int64).max)
+
+        remaining = sorted(self.open_positions.values(),
+                           key=lambda pos: (last_bars[pos.symbol_idx][0], pos.seq))
+        for pos in remaining:
+            last_date, last_close = last_bars[pos.symbol_idx]
+            self.close_position(pos, last_date, EXIT_END_OF_DATA, last_close)
+        self.open_positions = {}
+
+
+def _trades_date_dtype(date_dtype):
+    return date_dtype if str(date_dtype).startswith('datetime64') else 'datetime64[ns]'
+
+
+def run_portfolio_backtest(frames, initial_capital=10000,
+                           spread_value=0.0002, holding_days=5, stop_loss_pct=None,
+                           support_level='S3', resistance_level='R3',
+                           trade_direction='Both', leverage=1, capital_usage_pct=100, as_ledger=False,
+                           costs=None):
+    """
+    Backtest portfela: bary wszystkich symboli w jednym strumieniu zdarzeń,
+    jeden kapitał i jedna pula marginu.
+
+    frames: dict {symbol: df z kolumnami pivot}. Reguły jak w run_backtest:
+    - margin nowej pozycji = (kapitał - margin wszystkich otwartych pozycji) × usage%
+    - zdarzenia w kolejności czasu; w tej samej chwili najpierw zamknięcia
+      (odwrotna kolejność otwarcia), potem otwarcia w kolejności symboli z frames
+    - na końcu danych symbolu jego otwarte pozycje zamykane po ostatnim Close
+
+    Dla jednego symbolu wynik = PivotBacktester.run_backtest.
+    Zwraca (trades_df, capital, stats) - stats: {symbol: {'margin_calls', 'skipped_no_margin'}},
+    kolumna 'Capital' w trades_df = kapitał całego portfela po transakcji.
+    as_ledger=True: transakcje jako TradeLedger zamiast DataFrame (np. do sweepów).
+    costs (cost_model.CostModel): spread zmienny w czasie i swap zamiast stałego spread_value.
+    """
+    symbols = list(frames)
+    prepared = [
+        _prepare_symbol(frames[symbol], symbol, support_level, resistance_level, trade_direction)
+        for symbol in symbols
+    ]
+    date_dtype = _trades_date_dtype(frames[symbols[0]]['Date'].dtype if symbols else None)
+
+    # Sygnały wszystkich symboli posortowane po (czas, kolejność symbolu)
+    signal_times, signal_symbols, signal_bars = [], [], []
+    for symbol_idx, arrays in enumerate(prepared):
+        bars = np.flatnonzero(arrays.long_signal | arrays.short_signal)
+        signal_times.append(arrays.dates[bars].view(np.int64))
+        signal_symbols.append(np.full(len(bars), symbol_idx))
+        signal_bars.append(bars)
+    signal_times = np.concatenate(signal_times) if symbols else np.array([], dtype=np.int64)
+    signal_symbols = np.concatenate(signal_symbols) if symbols else np.array([], dtype=int)
+    signal_bars = np.concatenate(signal_bars) if symbols else np.array([], dtype=int)
+    order = np.lexsort((signal_symbols, signal_times))
+
+    capacity = sum(int(a.long_signal.sum() + a.short_signal.sum()) for a in prepared)
+    state = _PortfolioState(symbols, initial_capital, spread_value, holding_days, stop_loss_pct,
+                            leverage, capital_usage_pct, capacity, costs)
+
+    for k in order:
+        # Zamknięcia z tej chwili są przed otwarciami (jak w pętli bar po barze)
+        state.close_due(signal_times[k])
+
+        arrays = prepared[int(signal_symbols[k])]
+        for pos in state.enter(int(signal_symbols[k]), arrays, int(signal_bars[k])):
+            state.schedule_exit(pos, arrays)
+
+    state.finish([(arrays.last_date, arrays.last_close) for arrays in prepared])
+
+    if as_ledger:
+        trades = state.buffer.to_ledger(symbols, support_level, resistance_level, leverage, date_dtype)
+    else:
+        trades = state.buffer.to_dataframe(symbols, support_level, resistance_level, leverage, date_dtype)
+    return trades, state.capital, state.stats
+
+
+def run_backtest_arrays(df, symbol, initial_capital=10000,
+                        spread_value=0.0002, holding_days=5, stop_loss_pct=None,
+                        support_level='S3', resistance_level='R3',
+                        trade_direction='Both', leverage=1, capital_usage_pct=100, as_ledger=False,
+                        costs=None):
+    """
+    Tablicowy odpowiednik PivotBacktester.run_backtest (te same transakcje,
+    margin calle i kapitał końcowy).
+
+    - Date/OHLC/pivot ładowane raz do tablic NumPy (bez df.iloc[i])
+    - pętla tylko po zdarzeniach: poniedziałki z sygnałem + zamknięcia pozycji
+    - bar zamknięcia liczony wektorowo przy otwarciu pozycji (_find_exit)
+    - zamknięcia w kolejce (bar, odwrotna kolejność otwarcia) jak w oryginale
+    - transakcje zapisywane do prealokowanych kolumn (_TradeBuffer)
+
+    Zakłada dane posortowane po Date (jak z load_csv_data / get_forex_data).
+    Zwraca (trades_df, capital, margin_calls, skipped_no_margin);
+    as_ledger=True: TradeLedger zamiast trades_df; costs: jak w run_portfolio_backtest.
+    """
+    trades_df, capital, stats = run_portfolio_backtest(
+        {symbol: df}, initial_capital, spread_value, holding_days, stop_loss_pct,
+        support_level, resistance_level, trade_direction, leverage, capital_usage_pct, as_ledger, costs
+    )
+    return trades_df, capital, stats[symbol]['margin_calls'], stats[symbol]['skipped_no_margin']
+
+
+def run_backtest_chunked(chunks, symbol, lookback_days=7, initial_capital=10000,
+                         spread_value=0.0002, holding_days=5, stop_loss_pct=None,
+                         support_level='S3', resistance_level='R3',
+                         trade_direction='Both', leverage=1, capital_usage_pct=100, costs=None):
+    """
+    Backtest out-of-core (np. 10+ lat barów M1/M5/H1): bary czytane paczkami.
+
+    chunks: iterator DataFrame Date/Open/High/Low/Close posortowanych po Date
+    (ohlc_csv.iter_ohlc_csv, BarStore.iter_chunks). Między paczkami przechodzą:
+    - ostatnie `lookback_days` barów (okno pivot - lookback liczony w barach),
+    - otwarte pozycje, których zamknięcie nie wypadło w bieżącej paczce,
+    - kapitał, pula marginu i kolejka zamknięć (_PortfolioState).
+
+    Pamięć: jedna paczka + okno + transakcje. Wynik = run_backtest_arrays
+    na całości z add_pivot_columns (te same bity).
+    Zwraca (trades_df, capital, margin_calls, skipped_no_margin).
+    """
+    state = _PortfolioState([symbol], initial_capital, spread_value, holding_days, stop_loss_pct,
+                            leverage, capital_usage_pct, costs=costs)
+    tail = None
+    pending = []  # pozycje bez zamknięcia w dotychczasowych paczkach
+    date_dtype = None
+    last_bar = (None, None)
+
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+
+        chunk = chunk[['Date', 'Open', 'High', 'Low', 'Close']].reset_index(drop=True)
+        if date_dtype is None:
+            date_dtype = _trades_date_dtype(chunk['Date'].dtype)
+
+        window = chunk if tail is None else pd.concat([tail, chunk], ignore_index=True)
+        if tail is not None and len(tail) > 0 and window['Date'].iloc[len(tail)] <= tail['Date'].iloc[-1]:
+            raise ValueError("Paczki danych muszą być posortowane rosnąco po Date")
+
+        levels = calculate_pivot_levels(
+            window['High'].to_numpy(dtype=np.float64), window['Low'].to_numpy(dtype=np.float64),
+            window['Close'].to_numpy(dtype=np.float64), lookback_days
+        )
+        offset = len(window) - len(chunk)
+        for level in PIVOT_LEVELS:
+            chunk[level] = levels[level][offset:]
+        tail = window.iloc[len(window) - min(lookback_days, len(window)):].copy()
+
+        arrays = _prepare_symbol(chunk, symbol, support_level, resistance_level, trade_direction)
+        last_bar = (arrays.last_date, arrays.last_close)
+
+        # Pozycje z poprzednich paczek: szukaj zamknięcia od pierwszego baru tej paczki
+        pending = [pos for pos in pending if not state.schedule_exit(pos, arrays, start=0)]
+
+        signal_bars = np.flatnonzero(arrays.long_signal | arrays.short_signal)
+        state.buffer.reserve(len(state.open_positions) + 2 * len(signal_bars))
+        signal_times = arrays.dates[signal_bars].view(np.int64)
+
+        for idx, signal_time in zip(signal_bars, signal_times):
+            state.close_due(signal_time)
+            for pos in state.enter(0, arrays, int(idx)):
+                if not state.schedule_exit(pos, arrays):
+                    pending.append(pos)
+
+        # Wszystkie zamknięcia do końca paczki są już znane
+        if len(arrays.dates) > 0:
+            state.close_due(int(arrays.dates[-1].view(np.int64)))
+
+    state.finish([last_bar])
+
+    trades_df = state.buffer.to_dataframe([symbol], support_level, resistance_level, leverage,
+                                          date_dtype or 'datetime64[ns]')
+    stats = state.stats[symbol]
+    return trades_df, state.capital, stats['margin_calls'], stats['skipped_no_margin']
+
+
+class IncrementalPivotStrategy:
+    """
+    Strategia pivot bar po barze (live): okno pivot, otwarte pozycje i kapitał.
+
+    update() przyjmuje jeden nowy bar i zwraca zlecenia (fills) wg tych samych reguł
+    co run_backtest_arrays: ta sama _PortfolioState, te same wyrażenia na cenach.
+    Okno pivot to bufor pierścieniowy z indeksem głowy: nowy bar to dwa zapisy kolumn
+    (O(1), bez przesuwania okna). Średnie poziomów sumują lookback wartości w kolejności
+    barów (O(lookback) arytmetyki na widoku bez kopii) - suma przyrostowa nie dałaby
+    tych samych bitów co shifted_window_mean. Koszt baru nie zależy od długości historii.
+
+    Po update() dla całej historii i finish() trades() = run_backtest_arrays
+    na add_pivot_columns(historia) (te same bity).
+    """
+
+    def __init__(self, symbol, lookback_days=7, initial_capital=10000,
+                 spread_value=0.0002, holding_days=5, stop_loss_pct=None,
+                 support_level='S3', resistance_level='R3',
+                 trade_direction='Both', leverage=1, capital_usage_pct=100, costs=None):
+        self.symbol = symbol
+        self.lookback_days = lookback_days
+        self.support_level = support_level
+        self.resistance_level = resistance_level
+        self.allow_long = trade_direction in ['Both', 'Long Only']
+        self.allow_short = trade_direction in ['Both', 'Short Only']
+        self.leverage = leverage
+
+        self.state = _PortfolioState([symbol], initial_capital, spread_value, holding_days, stop_loss_pct,
+                                     leverage, capital_usage_pct, costs=costs)
+        self.levels = None  # poziomy pivot ostatniego baru (None w rozgrzewce okna)
+        self.last_bar = (None, None)
+        self.date_dtype = 'datetime64[ns]'  # typ dat w trades(); update_frame przejmuje typ z df
+
+        # Bufor pierścieniowy High/Low/Close: bar zapisany w kolumnach head i head + lookback,
+        # więc [:, head + 1:head + 1 + lookback] to okno w kolejności barów bez kopiowania
+        self._ring = np.empty((3, 2 * max(lookback_days, 0)), dtype=np.float64)
+        self._head = -1
+        self._window_size = 0
+
+        # Jednoelementowe tablice baru w układzie _SymbolArrays (dla _PortfolioState.enter)
+        bar = _SymbolArrays()
+        bar.symbol = symbol
+        bar.dates = np.empty(1, dtype='datetime64[ns]')
+        for name in ['high', 'low', 'close', 'support', 'resistance']:
+            setattr(bar, name, np.empty(1, dtype=np.float64))
+        bar.long_signal = np.zeros(1, dtype=bool)
+        bar.short_signal = np.zeros(1, dtype=bool)
+        bar.pip_value = pip_value_for(symbol)
+        self._bar = bar
+
+    @property
+    def capital(self):
+        return self.state.capital
+
+    @property
+    def stats(self):
+        """{'margin_calls', 'skipped_no_margin'}"""
+        return self.state.stats[self.symbol]
+
+    def _window(self):
+        """Okno High/Low/Close (3 x lookback) w kolejności barów - widok bufora"""
+        start = self._head + 1
+        return self._ring[:, start:start + self.lookback_days]
+
+    def _push(self, high, low, close):
+        """Nowy bar w oknie w miejsce najstarszego (O(1))"""
+        lookback = self.lookback_days
+        self._head = (self._head + 1) % lookback
+        self._ring[:, self._head] = self._ring[:, self._head + lookback] = (high, low, close)
+        self._window_size = min(self._window_size + 1, lookback)
+
+    def _pivot_levels(self):
+        # Średnia wierszy okna w kolejności barów - te same bity co shifted_window_mean
+        avg_high, avg_low, avg_close = (np.add.reduce(self._window(), axis=1) / self.lookback_days).tolist()
+        pivot = (avg_high + avg_low + avg_close) / 3
+        range_val = avg_high - avg_low
+        r2 = pivot + range_val
+        s2 = pivot - range_val
+        return {
+            'Pivot': pivot,
+            'R1': 2 * pivot - avg_low, 'R2': r2, 'R3': r2 + range_val,
+            'S1': 2 * pivot - avg_high, 'S2': s2, 'S3': s2 - range_val
+        }
+
+    def _exit_on_bar(self, pos, date, high, low, close):
+        """Powód i cena zamknięcia pozycji na tym barze albo None (kolejność jak _find_exit)"""
+        check_price = low if pos.is_long else high
+        unrealized_price_diff = check_price - pos.entry_price if pos.is_long else pos.entry_price - check_price
+        unrealized_quoted = unrealized_price_diff * pos.eff_volume
+        unrealized_base = unrealized_quoted / check_price if check_price != 0 else 0.0
+        if unrealized_base <= -pos.margin:
+            return EXIT_MARGIN_CALL, check_price
+
+        if date >= pos.entry_date + self.state.hold_delta:
+            return EXIT_TIME, close
+
+        stop_loss_pct = self.state.stop_loss_pct
+        if stop_loss_pct is not None and stop_loss_pct > 0:
+            if pos.is_long:
+                stop_loss_price = pos.entry_price * (1 - stop_loss_pct / 100)
+                if low <= stop_loss_price:
+                    return EXIT_STOP_LOSS, stop_loss_price
+            else:
+                stop_loss_price = pos.entry_price * (1 + stop_loss_pct / 100)
+                if high >= stop_loss_price:
+                    return EXIT_STOP_LOSS, stop_loss_price
+        return None
+
+    def _close_fills(self, start):
+        """Fills zamknięć z wierszy bufora transakcji od start"""
+        buffer = self.state.buffer
+        f = buffer.floats
+        return [
+            {
+                'Event': 'CLOSE', 'Symbol': self.symbol, 'Date': pd.Timestamp(buffer.exit_date[i]),
+                'Type': 'LONG' if buffer.is_long[i] else 'SHORT',
+                'Price': f['Exit Price'][i], 'Entry Date': pd.Timestamp(buffer.entry_date[i]),
+                'Entry Price': f['Entry Price'][i], 'Exit Reason': EXIT_REASONS[buffer.exit_reason[i]],
+                'Pips': f['Pips'][i], 'Profit (base)': f['Profit (base)'][i], 'Capital': f['Capital'][i]
+            }
+            for i in range(start, buffer.size)
+        ]
+
+    def update(self, date, open_price, high, low, close):
+        """
+        Nowy bar (rosnąco po Date). Najpierw zamknięcia pozycji na tym barze
+        (odwrotna kolejność otwarcia), potem sygnał poniedziałkowy i otwarcia.
+        Zwraca listę fills (dict, 'Event': 'OPEN' / 'CLOSE').
+        """
+        date = pd.Timestamp(date).as_unit('ns').to_datetime64()
+        if self.last_bar[0] is not None and date <= self.last_bar[0]:
+            raise ValueError("Bary muszą przychodzić rosnąco po Date")
+        high, low, close = float(high), float(low), float(close)
+
+        state = self.state
+        fills = []
+
+        if self.lookback_days > 0 and self._window_size == self.lookback_days:
+            self.levels = self._pivot_levels()
+
+            exits = []
+            for pos in state.open_positions.values():
+                exit_info = self._exit_on_bar(pos, date, high, low, close)
+                if exit_info is not None:
+                    exits.append((pos, exit_info))
+
+            start = state.buffer.size
+            state.buffer.reserve(len(exits))
+            for pos, (exit_reason, exit_price_raw) in reversed(exits):
+                del state.open_positions[pos.seq]
+                state.close_position(pos, date, exit_reason, exit_price_raw)
+            fills.extend(self._close_fills(start))
+
+            bar = self._bar
+            bar.dates[0] = date
+            bar.high[0], bar.low[0], bar.close[0] = high, low, close
+            bar.support[0] = self.levels[self.support_level]
+            bar.resistance[0] = self.levels[self.resistance_level]
+            is_monday = (int(date.view(np.int64)) // DAY_NS + 3) % 7 == 0  # 1970-01-01 = czwartek
+            bar.long_signal[0] = self.allow_long and is_monday and close < bar.support[0]
+            bar.short_signal[0] = self.allow_short and is_monday and close > bar.resistance[0]
+
+            if bar.long_signal[0] or bar.short_signal[0]:
+                for pos in state.enter(0, bar, 0):
+                    fills.append({
+                        'Event': 'OPEN', 'Symbol': self.symbol, 'Date': pd.Timestamp(date),
+                        'Type': 'LONG' if pos.is_long else 'SHORT', 'Price': pos.entry_price,
+                        'Entry Level': self.support_level if pos.is_long else self.resistance_level,
+                        'Entry Level Value': pos.level_value, 'Margin Used': pos.margin,
+                        'Eff. Volume': pos.eff_volume, 'Capital': state.capital
+                    })
+
+        if self.lookback_days > 0:
+            self._push(high, low, close)
+        self.last_bar = (date, close)
+        return fills
+
+    def update_frame(self, df):
+        """Kolejne bary z DataFrame Date/Open/High/Low/Close (np. rozgrzewka historią)"""
+        if self.last_bar[0] is None:
+            self.date_dtype = _trades_date_dtype(df['Date'].dtype)
+        fills = []
+        for date, open_price, high, low, close in zip(
+            df['Date'], df['Open'].to_numpy(dtype=np.float64), df['High'].to_numpy(dtype=np.float64),
+            df['Low'].to_numpy(dtype=np.float64), df['Close'].to_numpy(dtype=np.float64)
+        ):
+            fills.extend(self.update(date, open_price, high, low, close))
+        return fills
+
+    def open_positions(self):
+        """Otwarte pozycje (do dashboardu) z planowaną datą time exit"""
+        hold_delta = self.state.hold_delta
+        return [
+            {
+                'Symbol': self.symbol, 'Type': 'LONG' if pos.is_long else 'SHORT',
+                'Entry Date': pd.Timestamp(pos.entry_date), 'Entry Price': pos.entry_price,
+                'Entry Level Value': pos.level_value, 'Margin Used': pos.margin,
+                'Eff. Volume': pos.eff_volume, 'Time Exit': pd.Timestamp(pos.entry_date + hold_delta)
+            }
+            for pos in self.state.open_positions.values()
+        ]
+
+    def finish(self):
+        """Koniec danych: otwarte pozycje zamknięte po ostatnim Close ('End of data')"""
+        start = self.state.buffer.size
+        self.state.buffer.reserve(len(self.state.open_positions))
+        self.state.finish([self.last_bar])
+        return self._close_fills(start)
+
+    def trades(self):
+        """Zamknięte transakcje w układzie kolumn run_backtest"""
+        return self.state.buffer.to_dataframe([self.symbol], self.support_level, self.resistance_level,
+                                              self.leverage, self.date_dtype)
+
+
+def portfolio_capital_curve(profits, initial_capital):
+    """
+    Kapitał portfela po każdej transakcji: initial + skumulowany zysk.
+
+    cumsum po [initial, p0, p1, ...] dodaje w tej samej kolejności co pętla
+    (initial + p0) + p1 + ..., więc wynik jest identyczny bit w bit.
+    """
+    profits = np.asarray(profits, dtype=np.float64)
+    return np.cumsum(np.concatenate([[initial_capital], profits]))[1:]
+
+
+# ============================================
+# EQUITY MARK-TO-MARKET (PER BAR)
+# ============================================
+
+EQUITY_COLUMNS = ['Date', 'Realized', 'Unrealized', 'Equity', 'Drawdown (%)', 'Open Positions',
+                  'Gross Exposure', 'Net Exposure']
+
+
+def _open_interval_sums(starts, ends, weights, n):
+    """Suma wag pozycji otwartych na barach [start, end) - tablica różnicowa + cumsum"""
+    delta = np.bincount(starts, weights=weights, minlength=n + 1) \
+        - np.bincount(ends, weights=weights, minlength=n + 1)
+    return np.cumsum(delta[:n])
+
+
+def mark_to_market_equity(trades_df, closes, initial_capital, spread_value=0.0002,
+                          capital_column='Portfolio Capital', costs=None):
+    """
+    Equity portfela na każdym barze: kapitał zrealizowany + wynik otwartych pozycji
+    wyceniony po Close (z zamknięciem po spreadzie, jak close_position).
+
+    closes: {symbol: df Date/Close}; oś czasu = suma dat barów wszystkich symboli,
+    symbol bez baru w danej chwili wyceniany po ostatnim Close.
+    Pozycja jest otwarta od baru wejścia do baru przed zamknięciem; na barze
+    zamknięcia jej wynik jest już w kapitale zrealizowanym (capital_column).
+
+    Wynik pozycji po cenie p jest liniowy w V i E×V (V - E×V/p dla LONG),
+    więc sumy po otwartych pozycjach to cumsum tablic różnicowych - O(pozycje + bary)
+    bez pętli po barach.
+    costs (CostModel): spread wyceny z serii spreadu symbolu (swap naliczany dopiero przy zamknięciu).
+    Zwraca DataFrame EQUITY_COLUMNS (Gross/Net Exposure = suma Eff. Volume otwartych pozycji).
+    """
+    frames = [closes[symbol] for symbol in closes if len(closes[symbol]) > 0]
+    if len(frames) == 0:
+        return pd.DataFrame(columns=EQUITY_COLUMNS)
+
+    dates = np.unique(np.concatenate([frame['Date'].to_numpy(dtype='datetime64[ns]') for frame in frames]))
+    n = len(dates)
+
+    # Kapitał zrealizowany: kapitał po ostatniej transakcji zamkniętej <= bar
+    if len(trades_df) > 0:
+        exit_dates = trades_df['Exit Date'].to_numpy(dtype='datetime64[ns]')
+        order = np.argsort(exit_dates, kind='stable')
+        capital = trades_df[capital_column].to_numpy(dtype=np.float64)[order]
+        closed = np.searchsorted(exit_dates[order], dates, side='right')
+        realized = np.r_[initial_capital, capital][closed]
+    else:
+        realized = np.full(n, float(initial_capital))
+
+    unrealized = np.zeros(n)
+    open_count = np.zeros(n, dtype=np.int64)
+    gross = np.zeros(n)
+    net = np.zeros(n)
+
+    for symbol, frame in closes.items():
+        if len(frame) == 0 or len(trades_df) == 0:
+            continue
+        trades = trades_df[trades_df['Symbol'] == symbol]
+        if len(trades) == 0:
+            continue
+
+        symbol_dates = frame['Date'].to_numpy(dtype='datetime64[ns]')
+        bar = np.searchsorted(symbol_dates, dates, side='right') - 1
+        close = frame['Close'].to_numpy(dtype=np.float64)[np.maximum(bar, 0)]
+        spread = spread_value if costs is None else costs.spread_series(symbol, dates)
+
+        starts = np.searchsorted(dates, trades['Entry Date'].to_numpy(dtype='datetime64[ns]'), side='left')
+        ends = np.searchsorted(dates, trades['Exit Date'].to_numpy(dtype='datetime64[ns]'), side='left')
+        volume = trades['Eff. Volume'].to_numpy(dtype=np.float64)
+        entry_volume = trades['Entry Price'].to_numpy(dtype=np.float64) * volume
+        is_long = (trades['Type'] == 'LONG').to_numpy()
+
+        for side_mask, sign, exit_close in [(is_long, 1, close - spread), (~is_long, -1, close + spread)]:
+            if not side_mask.any():
+                continue
+            side_starts, side_ends = starts[side_mask], ends[side_mask]
+            count = _open_interval_sums(side_starts, side_ends, None, n).astype(np.int64)
+            side_volume = _open_interval_sums(side_starts, side_ends, volume[side_mask], n)
+            side_entry_volume = _open_interval_sums(side_starts, side_ends, entry_volume[side_mask], n)
+
+            # LONG: V - E×V/p, SHORT: E×V/p - V; brak otwartych pozycji = dokładnie 0
+            with np.errstate(divide='ignore', invalid='ignore'):
+                side_pnl = sign * (side_volume - side_entry_volume / exit_close)
+            side_pnl = np.where((count > 0) & (exit_close != 0), side_pnl, 0.0)
+            side_volume = np.where(count > 0, side_volume, 0.0)
+
+            unrealized += side_pnl
+            open_count += count
+            gross += side_volume
+            net += sign * side_volume
+
+    equity = realized + unrealized
+    running_max = np.maximum.accumulate(equity)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdown = np.where(running_max > 0, (equity - running_max) / running_max * 100, 0.0)
+
+    return pd.DataFrame({
+        'Date': dates, 'Realized': realized, 'Unrealized': unrealized, 'Equity': equity,
+        'Drawdown (%)': drawdown, 'Open Positions': open_count,
+        'Gross Exposure': gross, 'Net Exposure': net
+    }, columns=EQUITY_COLUMNS)
+
+
+def equity_curve_stats(equity_df):
+    """Metryki z equity per bar: max DD, Sharpe (zwroty barowe, annualizowane), ekspozycja"""
+    if len(equity_df) < 2:
+        return {'Max DD (%)': 0.0, 'Sharpe Ratio': 0.0, 'Avg Exposure (x)': 0.0, 'Time in Market (%)': 0.0}
+
+    equity = equity_df['Equity'].to_numpy(dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.where(equity[:-1] != 0, np.diff(equity) / equity[:-1], 0.0)
+        leverage_used = np.where(equity > 0, equity_df['Gross Exposure'].to_numpy(dtype=np.float64) / equity, 0.0)
+
+    span_years = (equity_df['Date'].iloc[-1] - equity_df['Date'].iloc[0]).days / 365.25
+    bars_per_year = len(returns) / span_years if span_years > 0 else len(returns)
+    sharpe = returns.mean() / returns.std() * np.sqrt(bars_per_year) if returns.std() != 0 else 0.0
+
+    return {
+        'Max DD (%)': float(equity_df['Drawdown (%)'].min()),
+        'Sharpe Ratio': float(sharpe),
+        'Avg Exposure (x)': float(leverage_used.mean()),
+        'Time in Market (%)': float((equity_df['Open Positions'].to_numpy() > 0).mean() * 100)
+    }
+
+
+# ============================================
+# SWEEP PARAMETRÓW (PULA PROCESÓW)
+# ============================================
+
+SWEEP_PARAMS = ['lookback_days', 'holding_days', 'support_level', 'resistance_level',
+                'stop_loss_pct', 'leverage', 'capital_usage_pct']
+
+SWEEP_METRICS = ['Final Capital', 'Return (%)', 'Max DD (%)', 'Sharpe Ratio',
+                 'Trades', 'Win Rate (%)', 'Margin Calls']
+
+
+def build_parameter_grid(lookback_days, holding_days, levels, stop_loss_pct,
+                         leverage, capital_usage_pct):
+    """
+    Pełna siatka kombinacji parametrów.
+
+    levels: lista par (support, resistance), np. [('S3', 'R3'), ('S2', 'R2')]
+    stop_loss_pct: 0 lub None = bez stop lossa
+    """
+    grid = []
+    for lb, hold, (sup, res), sl, lev, usage in itertools.product(
+            lookback_days, holding_days, levels, stop_loss_pct, leverage, capital_usage_pct):
+        grid.append({
+            'lookback_days': lb,
+            'holding_days': hold,
+            'support_level': sup,
+            'resistance_level': res,
+            'stop_loss_pct': sl or 0.0,
+            'leverage': lev,
+            'capital_usage_pct': usage
+        })
+    return grid
+
+
+def summarize_trades(trades_df, initial_capital, final_capital, margin_calls=0):
+    """Metryki jednego backtestu: zwrot, max DD, Sharpe, win rate"""
+    total_return = (final_capital - initial_capital) / initial_capital * 100 if initial_capital != 0 else 0
+
+    if len(trades_df) == 0:
+        return {
+            'Final Capital': final_capital, 'Return (%)': total_return, 'Max DD (%)': 0.0,
+            'Sharpe Ratio': 0.0, 'Trades': 0, 'Win Rate (%)': 0.0, 'Margin Calls': margin_calls
+        }
+
+    equity = np.concatenate([[initial_capital], trades_df['Capital'].to_numpy(dtype=np.float64)])
+    running_max = np.maximum.accumulate(equity)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        drawdown = np.where(running_max != 0, (equity - running_max) / running_max * 100, 0.0)
+
+    returns = trades_df['P&L %'].to_numpy(dtype=np.float64) / 100
+    sharpe = 0.0
+    if len(returns) > 1 and returns.std() != 0:
+        span_years = (trades_df['Exit Date'].max() - trades_df['Entry Date'].min()).days / 365.25
+        trades_per_year = len(returns) / span_years if span_years > 0 else len(returns)
+        sharpe = returns.mean() / returns.std() * np.sqrt(trades_per_year)
+
+    return {
+        'Final Capital': final_capital,
+        'Return (%)': total_return,
+        'Max DD (%)': drawdown.min(),
+        'Sharpe Ratio': sharpe,
+        'Trades': len(trades_df),
+        'Win Rate (%)': (trades_df['Profit (base)'] > 0).mean() * 100,
+        'Margin Calls': margin_calls
+    }
+
+
+# Stan procesu roboczego: df z blokami pivot przekazywany raz (initializer),
+# widoki per lookback liczone raz na proces
+_SWEEP_STATE = {}
+
+
+def _init_sweep_worker(pivot_df, symbol, initial_capital, spread_value, trade_direction, costs=None):
+    _SWEEP_STATE.clear()
+    _SWEEP_STATE.update({
+        'pivot_df': pivot_df,
+        'symbol': symbol,
+        'initial_capital': initial_capital,
+        'spread_value': spread_value,
+        'trade_direction': trade_direction,
+        'costs': costs,
+        'blocks': {},
+        'window': None,
+        'window_blocks': {}
+    })
+
+
+def _sweep_block(lookback, window=None):
+    blocks = _SWEEP_STATE['blocks']
+    if lookback not in blocks:
+        blocks[lookback] = select_pivot_block(_SWEEP_STATE['pivot_df'], lookback)
+    if window is None:
+        return blocks[lookback]
+
+    # Okno = wycinek gotowych pivotów (bez przeliczania, bez utraty rozgrzewki);
+    # trzymamy wycinki tylko bieżącego okna
+    window_blocks = _SWEEP_STATE['window_blocks']
+    if _SWEEP_STATE['window'] != window:
+        window_blocks.clear()
+        _SWEEP_STATE['window'] = window
+    if lookback not in window_blocks:
+        dates = blocks[lookback]['Date']
+        window_blocks[lookback] = blocks[lookback][(dates >= window[0]) & (dates < window[1])]
+    return window_blocks[lookback]
+
+
+def _backtest_combo(df, combo):
+    """run_backtest_arrays dla jednej kombinacji (stałe parametry z _SWEEP_STATE)"""
+    state = _SWEEP_STATE
+    trades_df, final_cap, mc_count, _ = run_backtest_arrays(
+        df, state['symbol'], state['initial_capital'], state['spread_value'],
+        combo['holding_days'], combo['stop_loss_pct'],
+        combo['support_level'], combo['resistance_level'], state['trade_direction'],
+        combo['leverage'], combo['capital_usage_pct'], costs=state['costs']
+    )
+    return trades_df, final_cap, mc_count
+
+
+def _evaluate_combos(combos, window=None):
+    """Metryki dla listy kombinacji; window=(start, end) zawęża dane do [start, end)"""
+    rows = []
+    for combo in combos:
+        df = _sweep_block(combo['lookback_days'], window)
+        trades_df, final_cap, mc_count = _backtest_combo(df, combo)
+        row = dict(combo)
+        row.update(summarize_trades(trades_df, _SWEEP_STATE['initial_capital'], final_cap, mc_count))
+        rows.append(row)
+    return rows
+
+
+def _run_sweep_chunk(combos):
+    """Backtest paczki kombinacji (wszystkie z tym samym lookback)"""
+    return _evaluate_combos(combos)
+
+
+def process_pool(max_workers, initializer=None, initargs=()):
+    """Pula procesów spawn: bezpieczna także z wątkowego serwera Streamlit"""
+    context = multiprocessing.get_context('spawn')
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=context,
+                               initializer=initializer, initargs=initargs)
+
+
+def _run_in_pool(task, payloads, weights, init_args, max_workers, progress_callback, total):
+    """
+    Wykonaj task(payload) dla każdego payloadu - w puli procesów albo lokalnie
+    (max_workers <= 1). Wyniki w kolejności ukończenia: lista (indeks, wynik).
+    """
+    results = []
+    done = 0
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    if max_workers <= 1:
+        _init_sweep_worker(*init_args)
+        for i, payload in enumerate(payloads):
+            results.append((i, task(*payload)))
+            done += weights[i]
+            if progress_callback is not None:
+                progress_callback(done, total)
+        return results
+
+    with process_pool(max_workers, _init_sweep_worker, init_args) as pool:
+        futures = {pool.submit(task, *payload): i for i, payload in enumerate(payloads)}
+        for future in as_completed(futures):
+            i = futures[future]
+            results.append((i, future.result()))
+            done += weights[i]
+            if progress_callback is not None:
+                progress_callback(done, total)
+    return results
+
+
+def run_parameter_sweep(df, symbol, grid, initial_capital=10000, spread_value=0.0002,
+                        trade_direction='Both', max_workers=None, chunk_size=32,
+                        rank_by='Return (%)', progress_callback=None, costs=None):
+    """
+    Sweep siatki parametrów w puli procesów.
+
+    - pivoty liczone raz dla każdego lookback (add_pivot_columns) i wysyłane
+      do procesów roboczych raz, przez initializer
+    - zadania = paczki kombinacji o tym samym lookback
+    - progress_callback(done, total) po każdej ukończonej paczce
+    - max_workers=1: bez puli, w bieżącym procesie
+    - costs (CostModel): wysyłany do procesów raz, razem z pivotami
+
+    Zwraca DataFrame: parametry + metryki, posortowany wg rank_by, kolumna 'Rank'.
+    """
+    if len(grid) == 0:
+        return pd.DataFrame(columns=['Rank'] + SWEEP_PARAMS + SWEEP_METRICS)
+
+    lookbacks = sorted({combo['lookback_days'] for combo in grid})
+    pivot_df = add_pivot_columns(df, lookbacks)
+    init_args = (pivot_df, symbol, initial_capital, spread_value, trade_direction, costs)
+
+    chunks = []
+    for lookback in lookbacks:
+        same_lookback = [combo for combo in grid if combo['lookback_days'] == lookback]
+        for start in range(0, len(same_lookback), chunk_size):
+            chunks.append(same_lookback[start:start + chunk_size])
+
+    done_chunks = _run_in_pool(
+        _run_sweep_chunk, [(chunk,) for chunk in chunks], [len(chunk) for chunk in chunks],
+        init_args, max_workers, progress_callback, len(grid)
+    )
+
+    rows = [row for _, chunk_rows in done_chunks for row in chunk_rows]
+    results = pd.DataFrame(rows, columns=SWEEP_PARAMS + SWEEP_METRICS)
+    results = results.sort_values(rank_by, ascending=False, kind='stable').reset_index(drop=True)
+    results.insert(0, 'Rank', np.arange(1, len(results) + 1))
+    return results
+
+
+def sweep_heatmap(results, metric, x='lookback_days', y='holding_days', agg='max'):
+    """Tabela metric dla pary parametrów (pozostałe parametry zagregowane przez agg)"""
+    return results.pivot_table(index=y, columns=x, values=metric, aggfunc=agg).sort_index()
+
+
+# ============================================
+# WALK-FORWARD
+# ============================================
+
+# Kolumny transakcji skalowane liniowo z kapitałem startowym
+CAPITAL_SCALED_COLUMNS = ['Profit (quoted)', 'Profit (base)', 'Margin Used', 'Eff. Volume', 'Capital']
+
+
+def walk_forward_windows(dates, in_sample_days=730, out_sample_days=182):
+    """
+    Okna walk-forward [is_start, is_end) + [is_end, oos_end), przesuwane
+    o długość okna out-of-sample. Ostatnie okno OOS przycięte do końca danych.
+    """
+    dates = pd.to_datetime(pd.Series(dates))
+    if len(dates) == 0:
+        return []
+
+    first, last = dates.min(), dates.max()
+    in_sample = pd.Timedelta(days=in_sample_days)
+    out_sample = pd.Timedelta(days=out_sample_days)
+
+    windows = []
+    is_start = first
+    while is_start + in_sample <= last:
+        is_end = is_start + in_sample
+        oos_end = min(is_end + out_sample, last + pd.Timedelta(days=1))
+        windows.append((is_start, is_end, oos_end))
+        is_start += out_sample
+    return windows
+
+
+def _run_walk_forward_window(window, grid, rank_by):
+    """Optymalizacja na in-sample, zwycięzca uruchomiony na out-of-sample"""
+    is_start, is_end, oos_end = window
+
+    in_sample = pd.DataFrame(_evaluate_combos(grid, (is_start, is_end)))
+    best_row = in_sample.sort_values(rank_by, ascending=False, kind='stable').iloc[0]
+    best = {param: best_row[param] for param in SWEEP_PARAMS}
+
+    oos_df = _sweep_block(best['lookback_days'], (is_end, oos_end))
+    trades_df, final_cap, mc_count = _backtest_combo(oos_df, best)
+
+    return {
+        'params': best,
+        'in_sample': {metric: best_row[metric] for metric in SWEEP_METRICS},
+        'out_of_sample': summarize_trades(trades_df, _SWEEP_STATE['initial_capital'], final_cap, mc_count),
+        'trades': trades_df,
+        'final_capital': final_cap,
+        'exact_only': mc_count > 0 or _hit_capital_floor(trades_df, final_cap)
+    }
+
+
+def _hit_capital_floor(trades_df, final_capital):
+    """Czy kapitał spadł do podłogi 0 (dalej backtest nie otwiera pozycji)"""
+    if final_capital <= 0:
+        return True
+    return len(trades_df) > 0 and trades_df['Capital'].min() <= 0
+
+
+def _rerun_out_of_sample(init_args, params, window, start_capital):
+    """Okno OOS od nowa z kapitałem start_capital (w bieżącym procesie)"""
+    pivot_df, symbol, _, spread_value, trade_direction, costs = init_args
+    _init_sweep_worker(pivot_df, symbol, start_capital, spread_value, trade_direction, costs)
+    _, is_end, oos_end = window
+    oos_df = _sweep_block(params['lookback_days'], (is_end, oos_end))
+    trades_df, final_cap, mc_count = _backtest_combo(oos_df, params)
+    return trades_df, final_cap, summarize_trades(trades_df, start_capital, final_cap, mc_count)
+
+
+def run_walk_forward(df, symbol, grid, in_sample_days=730, out_sample_days=182,
+                     initial_capital=10000, spread_value=0.0002, trade_direction='Both',
+                     rank_by='Sharpe Ratio', max_workers=None, progress_callback=None, costs=None):
+    """
+    Walk-forward: optymalizacja grid na oknie in-sample, zwycięskie parametry
+    na kolejnym oknie out-of-sample, transakcje OOS sklejone w jedną krzywą.
+
+    - pivoty dla wszystkich lookback liczone raz na całej historii; okna to
+      wycinki tych samych tablic (brak przeliczeń i rozgrzewki per okno)
+    - okna liczone równolegle (jedno zadanie = jedno okno)
+    - każde okno OOS startuje z initial_capital i zamyka pozycje na swoim końcu;
+      sklejenie = przeskalowanie okna k przez kapitał końcowy okna k-1 / initial_capital
+      (kolumna 'OOS Stitch' = 'scaled')
+    - skalowanie jest dokładne tylko bez margin calli i bez podłogi kapitału 0
+      (i przy dodatnim kapitale przeniesionym) - takie okna są liczone ponownie,
+      po kolei, z kapitałem końcowym poprzedniego okna ('OOS Stitch' = 'sequential')
+
+    Zwraca (windows_df, stitched_trades_df, final_capital).
+    """
+    windows = walk_forward_windows(df['Date'], in_sample_days, out_sample_days)
+    if len(windows) == 0 or len(grid) == 0:
+        return pd.DataFrame(), pd.DataFrame(), initial_capital
+
+    lookbacks = sorted({combo['lookback_days'] for combo in grid})
+    pivot_df = add_pivot_columns(df, lookbacks)
+    init_args = (pivot_df, symbol, initial_capital, spread_value, trade_direction, costs)
+
+    done_windows = _run_in_pool(
+        _run_walk_forward_window, [(window, grid, rank_by) for window in windows],
+        [1] * len(windows), init_args, max_workers, progress_callback, len(windows)
+    )
+    results = dict(done_windows)
+
+    capital = initial_capital
+    window_rows = []
+    stitched = []
+    for i, window in enumerate(windows):
+        result = results[i]
+        start_capital = capital
+        out_of_sample = result['out_of_sample']
+        trades_df = result['trades']
+
+        sequential = capital != initial_capital and (result['exact_only'] or capital <= 0)
+        if sequential:
+            trades_df, capital, out_of_sample = _rerun_out_of_sample(init_args, result['params'], window, capital)
+        else:
+            scale = capital / initial_capital if initial_capital != 0 else 0
+            if len(trades_df) > 0:
+                trades_df = trades_df.copy()
+                trades_df[CAPITAL_SCALED_COLUMNS] = trades_df[CAPITAL_SCALED_COLUMNS] * scale
+            capital = result['final_capital'] * scale
+
+        if len(trades_df) > 0:
+            trades_df.insert(0, 'Window', i + 1)
+            stitched.append(trades_df)
+
+        is_start, is_end, oos_end = window
+        row = {
+            'Window': i + 1,
+            'IS Start': is_start, 'IS End': is_end,
+            'OOS Start': is_end, 'OOS End': oos_end
+        }
+        row.update(result['params'])
+        row[f'IS {rank_by}'] = result['in_sample'][rank_by]
+        row['OOS Return (%)'] = out_of_sample['Return (%)']
+        row['OOS Max DD (%)'] = out_of_sample['Max DD (%)']
+        row['OOS Trades'] = out_of_sample['Trades']
+        row['OOS Stitch'] = 'sequential' if sequential else 'scaled'
+        row['Start Capital'] = start_capital
+        row['End Capital'] = capital
+        window_rows.append(row)
+
+    stitched_trades = pd.concat(stitched, ignore_index=True) if stitched else pd.DataFrame()
+    return pd.DataFrame(window_rows), stitched_trades, capital
+
+
+# ============================================
+# MONTE CARLO (BOOTSTRAP TRANSAKCJI)
+# ============================================
+
+FAN_PERCENTILES = [5, 25, 50, 75, 95]
+
+
+def trade_returns(trades_df):
+    """
+    Zwroty transakcji względem kapitału przed transakcją.
+
+    Dla portfela ('Portfolio Capital'): Profit (base) / kapitał portfela przed
+    zamknięciem; w przeciwnym razie 'P&L %' / 100.
+    """
+    if 'Portfolio Capital' in trades_df.columns:
+        profit = trades_df['Profit (base)'].to_numpy(dtype=np.float64)
+        before = trades_df['Portfolio Capital'].to_numpy(dtype=np.float64) - profit
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns = np.where(before > 0, profit / before, 0.0)
+    else:
+        returns = trades_df['P&L %'].to_numpy(dtype=np.float64) / 100
+    return np.maximum(returns, -1.0)
+
+
+def _bootstrap_indices(rng, n_returns, n_paths, steps, block_size):
+    """Indeksy zwrotów: iid (block_size=1) albo moving block bootstrap"""
+    if block_size <= 1 or n_returns <= block_size:
+        return rng.integers(0, n_returns, size=(n_paths, steps))
+
+    n_blocks = -(-steps // block_size)
+    starts = rng.integers(0, n_returns - block_size + 1, size=(n_paths, n_blocks))
+    idx = starts[:, :, None] + np.arange(block_size)
+    return idx.reshape(n_paths, -1)[:, :steps]
+
+
+def monte_carlo_projection(trades_df, start_capital, years_ahead=5, n_paths=100_000,
+                           block_size=1, ruin_pct=50.0, chunk_size=10_000, seed=None):
+    """
+    Prognoza Monte Carlo: bootstrap zwrotów z transakcji backtestu.
+
+    - liczba transakcji na rok jak w historii (transakcje / lata danych)
+    - block_size > 1: moving block bootstrap (zachowuje serie zysków/strat)
+    - ścieżki liczone paczkami po chunk_size - w pamięci jest tylko paczka
+      (chunk_size x kroki) + wartości roczne i max DD każdej ścieżki
+    - ruina: kapitał spada do start_capital × (1 - ruin_pct/100) lub niżej
+
+    Zwraca (fan_df, max_dd_pct, prob_ruin):
+      fan_df - Year + percentyle kapitału P5/P25/P50/P75/P95 + Mean na koniec lat
+      max_dd_pct - tablica max drawdown (%) każdej ścieżki
+      prob_ruin - udział ścieżek z ruiną
+    """
+    if len(trades_df) == 0:
+        return None, np.array([]), 0.0
+
+    returns = trade_returns(trades_df)
+
+    span_years = (trades_df['Exit Date'].max() - trades_df['Entry Date'].min()).days / 365.25
+    trades_per_year = len(returns) / span_years if span_years > 0 else len(returns)
+    checkpoints = np.round(np.arange(1, years_ahead + 1) * trades_per_year).astype(int)
+    steps = max(int(checkpoints[-1]), 1)
+    checkpoints = np.clip(checkpoints, 1, steps) - 1
+
+    rng = np.random.default_rng(seed)
+    ruin_level = start_capital * (1 - ruin_pct / 100)
+
+    yearly_capital = np.empty((n_paths, years_ahead))
+    max_dd_pct = np.empty(n_paths)
+    ruined = np.empty(n_paths, dtype=bool)
+
+    for start in range(0, n_paths, chunk_size):
+        stop = min(start + chunk_size, n_paths)
+        idx = _bootstrap_indices(rng, len(returns), stop - start, steps, block_size)
+
+        equity = start_capital * np.cumprod(1 + returns[idx], axis=1)
+        yearly_capital[start:stop] = equity[:, checkpoints]
+
+        running_max = np.maximum(np.maximum.accumulate(equity, axis=1), start_capital)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            drawdown = np.where(running_max > 0, (equity - running_max) / running_max * 100, 0.0)
+        max_dd_pct[start:stop] = drawdown.min(axis=1)
+        ruined[start:stop] = equity.min(axis=1) <= ruin_level
+
+    fan = np.percentile(yearly_capital, FAN_PERCENTILES, axis=0)
+    fan_df = pd.DataFrame({'Year': np.arange(1, years_ahead + 1)})
+    for p, values in zip(FAN_PERCENTILES, fan):
+        fan_df[f'P{p}'] = values
+    fan_df['Mean'] = yearly_capital.mean(axis=0)
+
+    return fan_df, max_dd_pct, ruined.mean()
+
+
+# ============================================
+# STATYSTYKI OKRESOWE I FEES
+# ============================================
+
+FEE_PERIODS = {'Y': 1, 'Q': 4, 'M': 12}  # okresy rozliczenia fees w roku
+
+
+def _period_keys(dates, period):
+    """Numer okresu dla każdej daty (rok, rok×4+kwartał, rok×12+miesiąc)"""
+    dates = pd.DatetimeIndex(dates)
+    years = dates.year.to_numpy()
+    if period == 'Y':
+        return years
+    if period == 'Q':
+        return years * 4 + (dates.quarter.to_numpy() - 1)
+    return years * 12 + (dates.month.to_numpy() - 1)
+
+
+def _period_groups(trades_df, period='Y'):
+    """
+    Transakcje posortowane po Exit Date + granice okresów (rok/kwartał/miesiąc).
+
+    Po sortowaniu każdy okres to ciągły blok wierszy, więc statystyki liczymy
+    na wycinkach [starts[g], ends[g]) w jednym przebiegu, bez filtrowania
+    całej tabeli dla każdego okresu.
+    Zwraca (trades_df, etykiety okresów, starts, ends, numery okresów z _period_keys).
+    """
+    if period not in FEE_PERIODS:
+        raise ValueError(f"Nieznany okres: {period} (dozwolone: {', '.join(FEE_PERIODS)})")
+
+    trades_df = trades_df.sort_values('Exit Date').reset_index(drop=True)
+    keys = _period_keys(trades_df['Exit Date'], period)
+
+    starts = np.r_[0, np.flatnonzero(np.diff(keys)) + 1]
+    ends = np.r_[starts[1:], len(keys)]
+
+    first_keys = keys[starts]
+    if period == 'Y':
+        labels = list(first_keys)
+    elif period == 'Q':
+        labels = [f"{key // 4}-Q{key % 4 + 1}" for key in first_keys]
+    else:
+        labels = [f"{key // 12}-{key % 12 + 1:02d}" for key in first_keys]
+
+    return trades_df, labels, starts, ends, first_keys
+
+
+def _period_capital_bounds(capital, initial_capital, starts, ends):
+    """Kapitał na początku (koniec poprzedniego okresu) i końcu każdego okresu"""
+    end_capital = capital[ends - 1]
+    start_capital = np.r_[initial_capital, end_capital[:-1]]
+    return start_capital, end_capital
+
+
+def period_returns(trades_df, initial_capital, period='Y'):
+    """
+    Zwroty okresowe portfela z kolumny Portfolio Capital (jeden przebieg).
+    Okresy z kapitałem początkowym <= 0 (portfel wyzerowany) są pomijane - zwrot nieokreślony.
+    """
+    trades_df, _, starts, ends, _ = _period_groups(trades_df, period)
+    capital = trades_df['Portfolio Capital'].to_numpy(dtype=np.float64)
+    start_capital, end_capital = _period_capital_bounds(capital, initial_capital, starts, ends)
+    funded = start_capital > 0
+    return (end_capital[funded] - start_capital[funded]) / start_capital[funded]
+
+
+def calculate_period_stats_with_fees(trades_df, initial_capital, management_fee_pct=1.5,
+                                    success_fee_pct=12.0, period='Y', equity_curve=None):
+    """
+    Statystyki okresowe przed i po fees (rok 'Y', kwartał 'Q', miesiąc 'M').
+
+    Management fee (roczny %) pobierany na początku okresu w części
+    management_fee_pct / liczba okresów w roku, success fee na końcu okresu
+    od zysku okresu. Kapitał po fees: start okresu N = koniec okresu N-1.
+
+    Jeden przebieg po transakcjach (wycinki okresów), pętla tylko po okresach.
+    Pierwsza kolumna: 'Year' (int) dla 'Y', 'Period' ('2024-Q1', '2024-03') dla Q/M.
+    equity_curve (mark_to_market_equity): Max DD okresu z equity per bar zamiast
+    z kapitału w chwilach zamknięć transakcji.
+    """
+    if len(trades_df) == 0:
+        return pd.DataFrame(), pd.DataFrame()
+
+    trades_df, labels, starts, ends, period_keys = _period_groups(trades_df, period)
+    label_column = 'Year' if period == 'Y' else 'Period'
+    management_fee_rate = management_fee_pct / FEE_PERIODS[period]
+
+    capital = trades_df['Portfolio Capital'].to_numpy(dtype=np.float64)
+    profits = trades_df['Profit (base)'].to_numpy(dtype=np.float64)
+    pnl_pct = trades_df['P&L %'].to_numpy(dtype=np.float64)
+    pips = trades_df['Pips'].to_numpy(dtype=np.float64)
+
+    start_capital, end_capital = _period_capital_bounds(capital, initial_capital, starts, ends)
+    trade_counts = ends - starts
+
+    if equity_curve is not None and len(equity_curve) > 0:
+        # Bary equity każdego okresu: wycinek [lo, hi) posortowanej osi czasu
+        equity = equity_curve['Equity'].to_numpy(dtype=np.float64)
+        equity_keys = _period_keys(equity_curve['Date'], period)
+        equity_lo = np.searchsorted(equity_keys, period_keys, side='left')
+        equity_hi = np.searchsorted(equity_keys, period_keys, side='right')
+    winning_counts = np.add.reduceat((profits > 0).astype(np.int64), starts)
+
+    stats_before_fees = []
+    stats_after_fees = []
+
+    capital_after_fees_tracking = initial_capital
+
+    for g, label in enumerate(labels):
+        segment = slice(starts[g], ends[g])
+
+        # PRZED FEES
+        start_capital_before = start_capital[g]
+        end_capital_before = end_capital[g]
+        profit_before = end_capital_before - start_capital_before
+        profit_pct_before = (profit_before / start_capital_before) * 100 if start_capital_before != 0 else 0
+
+        # PO FEES
+        start_capital_after = capital_after_fees_tracking
+
+        management_fee = start_capital_after * (management_fee_rate / 100)
+        capital_after_mgmt_fee = start_capital_after - management_fee
+
+        return_pct_this_period = profit_before / start_capital_before if start_capital_before != 0 else 0
+        profit_after_mgmt_fee = capital_after_mgmt_fee * return_pct_this_period
+
+        capital_before_success_fee = capital_after_mgmt_fee + profit_after_mgmt_fee
+
+        if profit_after_mgmt_fee > 0:
+            success_fee = profit_after_mgmt_fee * (success_fee_pct / 100)
+        else:
+            success_fee = 0
+
+        total_fees = management_fee + success_fee
+
+        end_capital_after = capital_before_success_fee - success_fee
+        profit_after = end_capital_after - start_capital_after
+        profit_pct_after = (profit_after / start_capital_after) * 100 if start_capital_after != 0 else 0
+
+        capital_after_fees_tracking = end_capital_after
+
+        # Statystyki
+        total_trades = int(trade_counts[g])
+        win_rate = (winning_counts[g] / total_trades * 100) if total_trades > 0 else 0
+
+        period_capital_series = capital[segment]
+        if equity_curve is not None and len(equity_curve) > 0 and equity_hi[g] > equity_lo[g]:
+            period_capital_series = equity[equity_lo[g]:equity_hi[g]]
+        running_max = np.maximum.accumulate(period_capital_series)
+        drawdown = (period_capital_series - running_max) / running_max * 100
+        max_dd_before = drawdown.min() if len(drawdown) > 0 else 0
+
+        fee_ratio = end_capital_after / end_capital_before if end_capital_before != 0 else 1
+        period_capital_after_fees_sim = period_capital_series * fee_ratio
+        running_max_after = np.maximum.accumulate(period_capital_after_fees_sim)
+        drawdown_after = (period_capital_after_fees_sim - running_max_after) / running_max_after * 100
+        max_dd_after = drawdown_after.min() if len(drawdown_after) > 0 else 0
+
+        if total_trades > 1:
+            returns = pnl_pct[segment] / 100
+            sharpe = (returns.mean() / returns.std()) * np.sqrt(len(returns)) if returns.std() != 0 else 0
+        else:
+            sharpe = 0
+
+        total_pips = pips[segment].sum()
+
+        stats_before_fees.append({
+            label_column: label,
+            'Start Capital': start_capital_before,
+            'End Capital': end_capital_before,
+            'Profit (base)': profit_before,
+            'Profit (%)': profit_pct_before,
+            'Trades': total_trades,
+            'Win Rate (%)': win_rate,
+            'Max DD (%)': max_dd_before,
+            'Sharpe Ratio': sharpe,
+            'Total Pips': total_pips
+        })
+
+        stats_after_fees.append({
+            label_column: label,
+            'Start Capital': start_capital_after,
+            'Management Fee': management_fee,
+            'After Mgmt Fee': capital_after_mgmt_fee,
+            'Trading Profit': profit_after_mgmt_fee,
+            'Before Success Fee': capital_before_success_fee,
+            'Success Fee': success_fee,
+            'End Capital': end_capital_after,
+            'Total Fees': total_fees,
+            'Net Profit (base)': profit_after,
+            'Net Profit (%)': profit_pct_after,
+            'Trades': total_trades,
+            'Win Rate (%)': win_rate,
+            'Max DD (%)': max_dd_after,
+            'Sharpe Ratio': sharpe,
+            'Total Pips': total_pips
+        })
+
+    return pd.DataFrame(stats_before_fees), pd.DataFrame(stats_after_fees)
@@ -2,7 +2,7 @@
 """
 MT5 Pivot Strategy Backtester - Multi-Currency
 Strategia: Poniedziałkowe sygnały + analiza roczna + prognoza
-Multi-currency: Do 5 par jednocześnie (Yahoo Finance lub CSV)
+Multi-currency: wiele par jednocześnie (Yahoo Finance lub CSV), opcjonalnie wspólny margin
 + Management Fee + Success Fee (FULLY CORRECTED P&L IN BASE CURRENCY)
 Pivot Period: 3-21 dni
 Holding: 1-120 dni
@@ -16,13 +16,26 @@ POPRAWKA P&L:
   → profit w EUR = 1,000 / 4.22 = 236.97 EUR (bazowa)
 """
 
+import io
+import os
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
-import yfinance as yf
+from datetime import datetime
 import streamlit as st
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
+from bar_store import BarStore
+from cost_model import CostModel
+from pivot_backtester import (
+    FOREX_SYMBOLS, SYMBOL_WORKERS, PivotBacktester, ResultCache, assemble_portfolio, calculate_projection,
+    calculate_yearly_stats_with_fees, load_symbol_data, portfolio_equity_curve, process_symbol, symbol_cpu_pool
+)
+from pivot_engine import (
+    HAS_PYARROW, TradeLedger, build_parameter_grid, equity_curve_stats, monte_carlo_projection,
+    run_parameter_sweep, run_walk_forward, sweep_heatmap
+)
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 import warnings
 warnings.filterwarnings('ignore')
 
@@ -60,672 +73,111 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Forex symbols mapping
-FOREX_SYMBOLS = {
-    'EURUSD': 'EURUSD=X',
-    'GBPUSD': 'GBPUSD=X',
-    'AUDUSD': 'AUDUSD=X',
-    'NZDUSD': 'NZDUSD=X',
-    'USDCAD': 'USDCAD=X',
-    'USDCHF': 'USDCHF=X',
-    'USDJPY': 'USDJPY=X',
-    'EURJPY': 'EURJPY=X',
-    'GBPJPY': 'GBPJPY=X',
-    'EURGBP': 'EURGBP=X',
-    'CHFPLN': 'CHFPLN=X',
-    'EURPLN': 'EURPLN=X',
-    'USDPLN': 'USDPLN=X',
-    'GBPPLN': 'GBPPLN=X'
-}
-
-
-class PivotBacktester:
-    def __init__(self, lookback_days=7):
-        self.lookback_days = lookback_days
-
-    def load_csv_data(self, uploaded_file):
-        """Załaduj dane z pliku CSV"""
-        try:
-            df = None
-            successful_config = None
-
-            for encoding in ['utf-8', 'latin-1', 'iso-8859-1', 'cp1252']:
-                for sep in [',', ';', '\t']:
-                    try:
-                        uploaded_file.seek(0)
-                        df = pd.read_csv(uploaded_file, sep=sep, encoding=encoding, thousands=',')
-                        if len(df.columns) >= 5:
-                            successful_config = f"{encoding} + sep '{sep}'"
-                            break
-                    except:
-                        continue
-                if df is not None and len(df.columns) >= 5:
-                    break
-
-            if df is None or len(df.columns) < 5:
-                return None, "Nie można odczytać pliku"
-
-            df.columns = df.columns.str.strip().str.lower().str.replace('"', '')
-
-            column_mapping = {}
-
-            date_cols = ['date', 'datetime', 'time', 'timestamp', 'data', 'datum']
-            for col in df.columns:
-                if col in date_cols or any(d in col for d in date_cols):
-                    column_mapping['Date'] = col
-                    break
-
-            ohlc_mapping = {
-                'Open': ['open', 'o', 'opening'],
-                'High': ['high', 'h', 'max', 'hi'],
-                'Low': ['low', 'l', 'min', 'lo'],
-                'Close': ['close', 'c', 'last', 'price', 'closing']
-            }
-
-            for target, possible_names in ohlc_mapping.items():
-                for col in df.columns:
-                    if col in possible_names or any(name in col for name in possible_names):
-                        column_mapping[target] = col
-                        break
-
-            required = ['Date', 'Open', 'High', 'Low', 'Close']
-            missing = [col for col in required if col not in column_mapping]
-
-            if missing:
-                return None, f"Brakujące kolumny: {', '.join(missing)}"
-
-            new_df = pd.DataFrame()
-            for target, source in column_mapping.items():
-                new_df[target] = df[source].copy()
-
-            try:
-                new_df['Date'] = pd.to_datetime(new_df['Date'], errors='coerce')
-
-                if new_df['Date'].isna().sum() > len(new_df) * 0.5:
-                    date_formats = [
-                        '%m/%d/%Y', '%d/%m/%Y', '%b %d, %Y', '%B %d, %Y',
-                        '%Y-%m-%d', '%d.%m.%Y', '%Y/%m/%d', '%d-%m-%Y'
-                    ]
-
-                    for date_format in date_formats:
-                        try:
-                            clean_dates = df[column_mapping['Date']].astype(str).str.strip()
-                            new_df['Date'] = pd.to_datetime(clean_dates, format=date_format, errors='coerce')
-                            if new_df['Date'].notna().sum() > len(new_df) * 0.5:
-                                break
-                        except:
-                            continue
-            except:
-                pass
-
-            new_df = new_df.dropna(subset=['Date'])
-
-            for col in ['Open', 'High', 'Low', 'Close']:
-                try:
-                    if new_df[col].dtype == 'object':
-                        new_df[col] = new_df[col].astype(str).str.strip().str.replace('"', '').str.replace("'", '')
-
-                        sample_val = str(new_df[col].iloc[0]) if len(new_df) > 0 else "0"
-                        comma_count = sample_val.count(',')
-                        dot_count = sample_val.count('.')
-
-                        if comma_count > 0 and dot_count > 0:
-                            last_comma_pos = sample_val.rfind(',')
-                            last_dot_pos = sample_val.rfind('.')
-
-                            if last_comma_pos > last_dot_pos:
-                                new_df[col] = new_df[col].str.replace('.', '').str.replace(',', '.')
-                            else:
-                                new_df[col] = new_df[col].str.replace(',', '')
-                        elif comma_count > 0 and dot_count == 0:
-                            new_df[col] = new_df[col].str.replace(',', '.')
-
-                        new_df[col] = new_df[col].str.replace('%', '').str.replace(' ', '')
+@st.cache_resource
+def get_bar_store():
+    """Wspólny magazyn barów OHLC (data/bars.db)"""
+    return BarStore()
 
-                    new_df[col] = pd.to_numeric(new_df[col], errors='coerce')
-                except Exception as e:
-                    return None, f"Błąd konwersji kolumny {col}"
 
-            new_df = new_df.dropna(subset=['Open', 'High', 'Low', 'Close'])
-            new_df = new_df.sort_values('Date').reset_index(drop=True)
+@st.cache_resource
+def get_result_cache():
+    """Wyniki backtestu per (symbol, fingerprint danych, lookback, parametry strategii)"""
+    return ResultCache()
 
-            if len(new_df) == 0:
-                return None, "Brak prawidłowych danych"
 
-            return new_df, f"OK: {len(new_df)} wierszy"
-
-        except Exception as e:
-            return None, f"Błąd: {str(e)}"
-
-    def get_forex_data(self, symbol, days=365):
-        """Pobierz dane forex"""
-        try:
-            yf_symbol = FOREX_SYMBOLS.get(symbol, f"{symbol}=X")
-            ticker = yf.Ticker(yf_symbol)
-
-            data = ticker.history(period=f"{days}d", interval="1d")
-
-            if data.empty:
-                end_date = datetime.now()
-                start_date = end_date - timedelta(days=days + 5)
-                data = ticker.history(start=start_date, end=end_date, interval="1d")
-
-            if data.empty:
-                return None
-
-            data = data.dropna()
-
-            if hasattr(data.index, 'tz_localize'):
-                try:
-                    if data.index.tz is not None:
-                        data.index = data.index.tz_convert(None)
-                except:
-                    pass
-
-            df = pd.DataFrame({
-                'Date': pd.to_datetime(data.index),
-                'Open': data['Open'].astype(float),
-                'High': data['High'].astype(float),
-                'Low': data['Low'].astype(float),
-                'Close': data['Close'].astype(float)
-            }).reset_index(drop=True)
-
-            df = df.dropna(subset=['Open', 'High', 'Low', 'Close'])
-
-            return df
-
-        except Exception as e:
+@st.cache_resource
+def load_cost_model(spread_bytes, spread_name, swap_bytes, swap_name, default_spread):
+    """CostModel z wgranych plików spreadu / swapów (jeden na zestaw plików i domyślny spread)"""
+    def as_file(data, name):
+        if data is None:
             return None
+        handle = io.BytesIO(data)
+        handle.name = name
+        return handle
 
-    def calculate_pivot_points(self, df):
-        """Oblicz punkty pivot"""
-        if len(df) < self.lookback_days:
-            return df
-
-        df = df.reset_index(drop=True)
-        pivot_data = []
-
-        for i in range(self.lookback_days, len(df)):
-            window = df.iloc[i - self.lookback_days:i]
-            avg_high = window['High'].mean()
-            avg_low = window['Low'].mean()
-            avg_close = window['Close'].mean()
-
-            pivot = (avg_high + avg_low + avg_close) / 3
-            range_val = avg_high - avg_low
-
-            r1 = 2 * pivot - avg_low
-            r2 = pivot + range_val
-            s1 = 2 * pivot - avg_high
-            s2 = pivot - range_val
-
-            r3 = r2 + range_val
-            s3 = s2 - range_val
-
-            pivot_data.append({
-                'Date': df.iloc[i]['Date'],
-                'Pivot': pivot,
-                'R1': r1, 'R2': r2, 'R3': r3,
-                'S1': s1, 'S2': s2, 'S3': s3
-            })
-
-        if pivot_data:
-            pivot_df = pd.DataFrame(pivot_data)
-            df = df.merge(pivot_df, on='Date', how='left')
-
-        return df
-
-    def run_backtest(self, df, symbol, initial_capital=10000,
-                     spread_value=0.0002, holding_days=5, stop_loss_pct=None,
-                     support_level='S3', resistance_level='R3',
-                     trade_direction='Both', leverage=1, capital_usage_pct=100):
-        """
-        Backtest z dynamicznym wolumenem z kapitału + margin check + margin call.
-
-        Logika:
-        - Wolumen = (dostępny_kapitał × capital_usage_pct% × leverage)
-          np. 1M EUR × 100% × x10 = 10M EUR efektywna pozycja
-        - Margin (depozyt) = wolumen / leverage = kapitał × usage%
-        - Margin check: nie otwieraj jeśli margin > wolny kapitał
-        - Margin call: zamknij pozycję jeśli unrealized loss >= margin (depozyt)
-        - P&L w walucie bazowej: profit_quoted / exit_price
-        - Compound: wolumen rośnie/maleje z equity
-        """
-
-        trades = []
-        capital = initial_capital
-        open_positions = []
-        margin_calls = 0
-        skipped_no_margin = 0
-
-        def calc_used_margin():
-            """Suma zablokowanego marginu w otwartych pozycjach"""
-            return sum(pos['margin'] for pos in open_positions)
-
-        def calc_free_margin():
-            """Wolny margin = kapitał - zablokowany margin + unrealized P&L"""
-            used = calc_used_margin()
-            unrealized = 0
-            # Nie liczymy unrealized tutaj dla uproszczenia (conservative)
-            return capital - used
-
-        for i in range(len(df)):
-            row = df.iloc[i]
-
-            if pd.isna(row.get('S3')) or pd.isna(row.get('R3')):
-                continue
-
-            current_date = row['Date']
-            current_price = row['Close']
-            current_high = row['High']
-            current_low = row['Low']
-
-            positions_to_close = []
-
-            for pos_idx, pos in enumerate(open_positions):
-
-                # --- MARGIN CALL CHECK ---
-                # Sprawdź czy unrealized loss >= margin (depozyt)
-                if pos['type'] == 'long':
-                    unrealized_price_diff = current_low - pos['entry_price']
-                else:
-                    unrealized_price_diff = pos['entry_price'] - current_high
+    return CostModel.from_files(as_file(spread_bytes, spread_name), as_file(swap_bytes, swap_name), default_spread)
 
-                # Unrealized P&L w bazowej
-                unrealized_quoted = unrealized_price_diff * pos['eff_volume']
-                check_price = current_low if pos['type'] == 'long' else current_high
-                if check_price != 0:
-                    unrealized_base = unrealized_quoted / check_price
-                else:
-                    unrealized_base = 0
-
-                # Margin call: strata >= margin (tracimy cały depozyt)
-                if unrealized_base <= -pos['margin']:
-                    # Zamknij po cenie margin call (cena przy której strata = margin)
-                    if pos['type'] == 'long':
-                        # margin_base = margin, szukamy ceny gdzie loss_base = margin
-                        # loss_quoted = (entry - mc_price) * eff_vol
-                        # loss_base = loss_quoted / mc_price = margin
-                        # (entry - mc_price) * eff_vol / mc_price = margin
-                        # Przybliżenie: zamykamy po current_low
-                        mc_price = current_low
-                    else:
-                        mc_price = current_high
-                    positions_to_close.append((pos_idx, 'Margin Call', mc_price))
-                    continue
-
-                # --- TIME EXIT ---
-                if current_date >= pos['exit_date']:
-                    positions_to_close.append((pos_idx, 'Time exit', current_price))
-                    continue
-
-                # --- STOP LOSS ---
-                if stop_loss_pct is not None and stop_loss_pct > 0:
-                    if pos['type'] == 'long':
-                        stop_loss_price = pos['entry_price'] * (1 - stop_loss_pct / 100)
-                        if current_low <= stop_loss_price:
-                            positions_to_close.append((pos_idx, 'Stop Loss', stop_loss_price))
-                            continue
-                    else:
-                        stop_loss_price = pos['entry_price'] * (1 + stop_loss_pct / 100)
-                        if current_high >= stop_loss_price:
-                            positions_to_close.append((pos_idx, 'Stop Loss', stop_loss_price))
-                            continue
-
-            # Zamykanie pozycji
-            for pos_idx, exit_reason, exit_price_raw in sorted(positions_to_close, reverse=True, key=lambda x: x[0]):
-                pos = open_positions.pop(pos_idx)
-
-                if pos['type'] == 'long':
-                    exit_price = exit_price_raw - spread_value
-                    price_diff = exit_price - pos['entry_price']
-                else:
-                    exit_price = exit_price_raw + spread_value
-                    price_diff = pos['entry_price'] - exit_price
 
-                # P&L w kwotowanej
-                profit_quoted = price_diff * pos['eff_volume']
+def symbol_sources(data_source, csv_files, selected_symbols):
+    """Lista (symbol, plik CSV lub None dla Yahoo) dla wybranego źródła danych"""
+    if data_source == "📥 Upload CSV":
+        return list(csv_files.items())
+    return [(symbol, None) for symbol in selected_symbols]
 
-                # P&L w bazowej
-                if exit_price != 0:
-                    profit_base = profit_quoted / exit_price
-                else:
-                    profit_base = 0
 
-                # Przy margin call: strata ograniczona do marginu
-                if exit_reason == 'Margin Call':
-                    profit_base = max(profit_base, -pos['margin'])
-                    margin_calls += 1
+# ============================================
+# TABELE WYNIKÓW (FORMATOWANIE W PRZEGLĄDARCE)
+# ============================================
 
-                pnl_pct = (profit_base / capital) * 100 if capital != 0 else 0
-                roi_on_margin = (profit_base / pos['margin']) * 100 if pos['margin'] != 0 else 0
+# Formaty printf dla st.column_config.NumberColumn - kolumny zostają liczbami,
+# przeglądarka formatuje je przy wyświetlaniu (sortowanie liczbowe, brak .apply)
+SUMMARY_FORMATS = {
+    'Initial Capital': '%.2f', 'Final Capital': '%.2f', 'Profit (base)': '%+.2f', 'Profit (%)': '%+.2f%%',
+    'Total P&L (quoted)': '%+.2f', 'Total P&L (base)': '%+.2f', 'Win Rate (%)': '%.1f%%',
+    'Total Pips': '%.1f', 'Avg Holding (days)': '%.1f'
+}
 
-                pip_value = 0.0001
-                if 'JPY' in symbol:
-                    pip_value = 0.01
-                pips_gained = price_diff / pip_value
+PERIOD_FORMATS_BEFORE = {
+    'Start Capital': '%.2f', 'End Capital': '%.2f', 'Profit (base)': '%+.2f', 'Profit (%)': '%+.2f%%',
+    'Win Rate (%)': '%.1f%%', 'Max DD (%)': '%.2f%%', 'Sharpe Ratio': '%.2f', 'Total Pips': '%.1f'
+}
 
-                capital += profit_base
+PERIOD_FORMATS_AFTER = {
+    'Start Capital': '%.2f', 'Management Fee': '%.2f', 'After Mgmt Fee': '%.2f', 'Trading Profit': '%+.2f',
+    'Before Success Fee': '%.2f', 'Success Fee': '%.2f', 'End Capital': '%.2f', 'Total Fees': '%.2f',
+    'Net Profit (base)': '%+.2f', 'Net Profit (%)': '%+.2f%%', 'Win Rate (%)': '%.1f%%',
+    'Max DD (%)': '%.2f%%', 'Sharpe Ratio': '%.2f', 'Total Pips': '%.1f'
+}
 
-                # Zabezpieczenie: kapitał nie spada poniżej 0
-                if capital < 0:
-                    capital = 0
+TRADE_FORMATS = {
+    'Entry Price': '%.5f', 'Exit Price': '%.5f', 'Entry Level Value': '%.5f', 'Price Diff': '%.5f',
+    'Pips': '%.1f', 'Profit (quoted)': '%.2f', 'Profit (base)': '%.2f', 'P&L %': '%.2f',
+    'ROI Margin %': '%.2f', 'Margin Used': '%.2f', 'Eff. Volume': '%.0f', 'Capital': '%.2f',
+    'Portfolio Capital': '%.2f'
+}
 
-                days_held = (current_date - pos['entry_date']).days
+TRADE_PAGE_SIZE = 1000  # wierszy transakcji wysyłanych do przeglądarki naraz
 
-                trades.append({
-                    'Symbol': symbol,
-                    'Entry Date': pos['entry_date'],
-                    'Exit Date': current_date,
-                    'Type': pos['type'].upper(),
-                    'Entry Price': pos['entry_price'],
-                    'Exit Price': exit_price,
-                    'Entry Level': pos['entry_level_name'],
-                    'Entry Level Value': pos['entry_level_value'],
-                    'Price Diff': price_diff,
-                    'Pips': pips_gained,
-                    'Profit (quoted)': profit_quoted,
-                    'Profit (base)': profit_base,
-                    'P&L %': pnl_pct,
-                    'ROI Margin %': roi_on_margin,
-                    'Margin Used': pos['margin'],
-                    'Eff. Volume': pos['eff_volume'],
-                    'Capital': capital,
-                    'Leverage': leverage,
-                    'Duration': days_held,
-                    'Exit Reason': exit_reason
-                })
 
-            # ============================================
-            # OTWIERANIE POZYCJI W PONIEDZIAŁEK
-            # Wolumen = wolny_kapitał × usage% × leverage (COMPOUND)
-            # ============================================
-            if current_date.weekday() == 0 and capital > 0:
-
-                support_value = row[support_level]
-                resistance_value = row[resistance_level]
-
-                free_margin = calc_free_margin()
-
-                if free_margin <= 0:
-                    continue
-
-                # Margin na pozycję = wolny kapitał × usage%
-                position_margin = free_margin * (capital_usage_pct / 100)
-
-                if position_margin <= 0:
-                    continue
-
-                # Efektywny wolumen = margin × leverage
-                eff_volume = position_margin * leverage
-
-                if trade_direction in ['Both', 'Long Only']:
-                    if current_price < support_value:
-                        # Margin check
-                        required_margin = position_margin
-                        if required_margin > free_margin:
-                            skipped_no_margin += 1
-                        else:
-                            entry_price = current_price + spread_value
-                            exit_date = current_date + timedelta(days=holding_days)
-
-                            open_positions.append({
-                                'type': 'long',
-                                'entry_date': current_date,
-                                'exit_date': exit_date,
-                                'entry_price': entry_price,
-                                'entry_level_name': support_level,
-                                'entry_level_value': support_value,
-                                'margin': position_margin,
-                                'eff_volume': eff_volume
-                            })
-
-                            # Odśwież wolny margin po otwarciu
-                            free_margin = calc_free_margin()
-
-                if trade_direction in ['Both', 'Short Only']:
-                    if current_price > resistance_value:
-                        # Recalc margin jeśli otworzyliśmy long powyżej
-                        if free_margin <= 0:
-                            skipped_no_margin += 1
-                        else:
-                            position_margin_short = min(position_margin, free_margin * (capital_usage_pct / 100))
-                            if position_margin_short <= 0:
-                                skipped_no_margin += 1
-                            else:
-                                eff_volume_short = position_margin_short * leverage
-
-                                entry_price = current_price - spread_value
-                                exit_date = current_date + timedelta(days=holding_days)
-
-                                open_positions.append({
-                                    'type': 'short',
-                                    'entry_date': current_date,
-                                    'exit_date': exit_date,
-                                    'entry_price': entry_price,
-                                    'entry_level_name': resistance_level,
-                                    'entry_level_value': resistance_value,
-                                    'margin': position_margin_short,
-                                    'eff_volume': eff_volume_short
-                                })
-
-        # Zamknij otwarte pozycje na końcu danych
-        last_row = df.iloc[-1]
-        for pos in open_positions:
-
-            if pos['type'] == 'long':
-                exit_price = last_row['Close'] - spread_value
-                price_diff = exit_price - pos['entry_price']
-            else:
-                exit_price = last_row['Close'] + spread_value
-                price_diff = pos['entry_price'] - exit_price
-
-            profit_quoted = price_diff * pos['eff_volume']
-            if exit_price != 0:
-                profit_base = profit_quoted / exit_price
-            else:
-                profit_base = 0
-
-            pnl_pct = (profit_base / capital) * 100 if capital != 0 else 0
-            roi_on_margin = (profit_base / pos['margin']) * 100 if pos['margin'] != 0 else 0
-
-            pip_value = 0.0001
-            if 'JPY' in symbol:
-                pip_value = 0.01
-            pips_gained = price_diff / pip_value
-
-            capital += profit_base
-            if capital < 0:
-                capital = 0
-
-            days_held = (last_row['Date'] - pos['entry_date']).days
-
-            trades.append({
-                'Symbol': symbol,
-                'Entry Date': pos['entry_date'],
-                'Exit Date': last_row['Date'],
-                'Type': pos['type'].upper(),
-                'Entry Price': pos['entry_price'],
-                'Exit Price': exit_price,
-                'Entry Level': pos['entry_level_name'],
-                'Entry Level Value': pos['entry_level_value'],
-                'Price Diff': price_diff,
-                'Pips': pips_gained,
-                'Profit (quoted)': profit_quoted,
-                'Profit (base)': profit_base,
-                'P&L %': pnl_pct,
-                'ROI Margin %': roi_on_margin,
-                'Margin Used': pos['margin'],
-                'Eff. Volume': pos['eff_volume'],
-                'Capital': capital,
-                'Leverage': leverage,
-                'Duration': days_held,
-                'Exit Reason': 'End of data'
-            })
-
-        return pd.DataFrame(trades), capital, margin_calls, skipped_no_margin
-
-
-def calculate_yearly_stats_with_fees(trades_df, initial_capital, management_fee_pct=1.5, success_fee_pct=12.0):
-    """Oblicz statystyki roczne Z FEES"""
-    if len(trades_df) == 0:
-        return pd.DataFrame(), pd.DataFrame()
-
-    trades_df = trades_df.sort_values('Exit Date').reset_index(drop=True)
-    trades_df['Year'] = trades_df['Exit Date'].dt.year
-
-    yearly_stats_before_fees = []
-    yearly_stats_after_fees = []
-
-    capital_after_fees_tracking = initial_capital
-
-    for year in sorted(trades_df['Year'].unique()):
-        year_trades = trades_df[trades_df['Year'] == year]
-
-        # PRZED FEES
-        if year == trades_df['Year'].min():
-            start_capital_before = initial_capital
-        else:
-            prev_year_trades = trades_df[trades_df['Year'] < year]
-            if len(prev_year_trades) > 0:
-                start_capital_before = prev_year_trades.iloc[-1]['Portfolio Capital']
-            else:
-                start_capital_before = initial_capital
-
-        end_capital_before = year_trades.iloc[-1]['Portfolio Capital']
-        profit_before = end_capital_before - start_capital_before
-        profit_pct_before = (profit_before / start_capital_before) * 100 if start_capital_before != 0 else 0
-
-        # PO FEES
-        start_capital_after = capital_after_fees_tracking
-
-        management_fee = start_capital_after * (management_fee_pct / 100)
-        capital_after_mgmt_fee = start_capital_after - management_fee
-
-        return_pct_this_year = profit_before / start_capital_before if start_capital_before != 0 else 0
-        profit_after_mgmt_fee = capital_after_mgmt_fee * return_pct_this_year
-
-        capital_before_success_fee = capital_after_mgmt_fee + profit_after_mgmt_fee
-
-        if profit_after_mgmt_fee > 0:
-            success_fee = profit_after_mgmt_fee * (success_fee_pct / 100)
-        else:
-            success_fee = 0
-
-        total_fees = management_fee + success_fee
-
-        end_capital_after = capital_before_success_fee - success_fee
-        profit_after = end_capital_after - start_capital_after
-        profit_pct_after = (profit_after / start_capital_after) * 100 if start_capital_after != 0 else 0
-
-        capital_after_fees_tracking = end_capital_after
-
-        # Statystyki
-        total_trades = len(year_trades)
-        winning_trades = len(year_trades[year_trades['Profit (base)'] > 0])
-        win_rate = (winning_trades / total_trades * 100) if total_trades > 0 else 0
-
-        year_capital_series = year_trades['Portfolio Capital'].values
-        running_max = np.maximum.accumulate(year_capital_series)
-        drawdown = (year_capital_series - running_max) / running_max * 100
-        max_dd_before = drawdown.min() if len(drawdown) > 0 else 0
-
-        fee_ratio = end_capital_after / end_capital_before if end_capital_before != 0 else 1
-        year_capital_after_fees_sim = year_capital_series * fee_ratio
-        running_max_after = np.maximum.accumulate(year_capital_after_fees_sim)
-        drawdown_after = (year_capital_after_fees_sim - running_max_after) / running_max_after * 100
-        max_dd_after = drawdown_after.min() if len(drawdown_after) > 0 else 0
-
-        if len(year_trades) > 1:
-            returns = year_trades['P&L %'].values / 100
-            if len(returns) > 0 and returns.std() != 0:
-                sharpe = (returns.mean() / returns.std()) * np.sqrt(len(returns))
-            else:
-                sharpe = 0
-        else:
-            sharpe = 0
-
-        yearly_stats_before_fees.append({
-            'Year': year,
-            'Start Capital': start_capital_before,
-            'End Capital': end_capital_before,
-            'Profit (base)': profit_before,
-            'Profit (%)': profit_pct_before,
-            'Trades': total_trades,
-            'Win Rate (%)': win_rate,
-            'Max DD (%)': max_dd_before,
-            'Sharpe Ratio': sharpe,
-            'Total Pips': year_trades['Pips'].sum()
-        })
-
-        yearly_stats_after_fees.append({
-            'Year': year,
-            'Start Capital': start_capital_after,
-            'Management Fee': management_fee,
-            'After Mgmt Fee': capital_after_mgmt_fee,
-            'Trading Profit': profit_after_mgmt_fee,
-            'Before Success Fee': capital_before_success_fee,
-            'Success Fee': success_fee,
-            'End Capital': end_capital_after,
-            'Total Fees': total_fees,
-            'Net Profit (base)': profit_after,
-            'Net Profit (%)': profit_pct_after,
-            'Trades': total_trades,
-            'Win Rate (%)': win_rate,
-            'Max DD (%)': max_dd_after,
-            'Sharpe Ratio': sharpe,
-            'Total Pips': year_trades['Pips'].sum()
-        })
-
-    return pd.DataFrame(yearly_stats_before_fees), pd.DataFrame(yearly_stats_after_fees)
-
-
-def calculate_projection(trades_df, initial_capital, years_ahead=5):
-    """Prognoza na kolejne lata"""
-    if len(trades_df) == 0:
-        return None, 0, 0
-
-    trades_df = trades_df.sort_values('Exit Date').reset_index(drop=True)
-    trades_df['Year'] = trades_df['Exit Date'].dt.year
-
-    yearly_returns = []
-
-    for year in sorted(trades_df['Year'].unique()):
-        year_trades = trades_df[trades_df['Year'] == year]
-
-        if year == trades_df['Year'].min():
-            start_cap = initial_capital
-        else:
-            prev_trades = trades_df[trades_df['Year'] < year]
-            start_cap = prev_trades.iloc[-1]['Portfolio Capital'] if len(prev_trades) > 0 else initial_capital
-
-        end_cap = year_trades.iloc[-1]['Portfolio Capital']
-        annual_return = (end_cap - start_cap) / start_cap
-        yearly_returns.append(annual_return)
-
-    avg_annual_return = np.mean(yearly_returns)
-    std_annual_return = np.std(yearly_returns) if len(yearly_returns) > 1 else 0
-
-    current_capital = trades_df.iloc[-1]['Portfolio Capital']
-    projections = []
-
-    for year in range(1, years_ahead + 1):
-        pessimistic_return = avg_annual_return - std_annual_return
-        pessimistic_capital = current_capital * ((1 + pessimistic_return) ** year)
-
-        base_capital = current_capital * ((1 + avg_annual_return) ** year)
-
-        optimistic_return = avg_annual_return + std_annual_return
-        optimistic_capital = current_capital * ((1 + optimistic_return) ** year)
-
-        projections.append({
-            'Year': datetime.now().year + year,
-            'Pessimistic': pessimistic_capital,
-            'Base': base_capital,
-            'Optimistic': optimistic_capital
-        })
-
-    return pd.DataFrame(projections), avg_annual_return, std_annual_return
+def show_table(df, formats, hide_index=True):
+    """st.dataframe z liczbami jako liczby; formaty i daty formatowane po stronie klienta"""
+    column_config = {
+        col: st.column_config.NumberColumn(format=fmt) for col, fmt in formats.items() if col in df.columns
+    }
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            column_config[col] = st.column_config.DateColumn(format='YYYY-MM-DD')
+    st.dataframe(df, column_config=column_config, use_container_width=True, hide_index=hide_index)
+
+
+def show_paged_table(df, formats, key, page_size=TRADE_PAGE_SIZE):
+    """
+    Duża tabela stronami: do przeglądarki trafia tylko bieżąca strona.
+    Sortowanie po kolumnie na całej tabeli (po stronie serwera, stabilne).
+    """
+    if len(df) <= page_size:
+        show_table(df, formats)
+        return
+
+    n_pages = (len(df) + page_size - 1) // page_size
+    col_sort, col_order, col_page = st.columns([2, 1, 1])
+    with col_sort:
+        sort_by = st.selectbox("Sortuj wg", ['(chronologicznie)'] + list(df.columns), key=f"{key}_sort")
+    with col_order:
+        descending = st.checkbox("Malejąco", value=False, key=f"{key}_desc")
+    with col_page:
+        page = st.number_input(f"Strona (z {n_pages:,})", min_value=1, max_value=n_pages, value=1, step=1,
+                               key=f"{key}_page")
+
+    if sort_by != '(chronologicznie)':
+        df = df.sort_values(sort_by, ascending=not descending, kind='stable')
+    elif descending:
+        df = df.iloc[::-1]
+
+    start = (int(page) - 1) * page_size
+    end = min(start + page_size, len(df))
+    show_table(df.iloc[start:end], formats, hide_index=False)
+    st.caption(f"Transakcje {start + 1:,}–{end:,} z {len(df):,}")
 
 
 # ============================================
@@ -740,16 +192,18 @@ st.sidebar.header("⚙️ Konfiguracja")
 
 data_source = st.sidebar.radio(
     "📂 Źródło danych:",
-    ["🌐 Yahoo Finance", "📥 Upload CSV (do 5 plików)"]
+    ["🌐 Yahoo Finance", "📥 Upload CSV"]
 )
 
 selected_symbols = []
 csv_files = {}
+offline_mode = False
+intraday_stream = False
 
-if data_source == "📥 Upload CSV (do 5 plików)":
+if data_source == "📥 Upload CSV":
     st.sidebar.markdown("### 📤 Upload plików CSV")
 
-    num_files = st.sidebar.number_input("Liczba par", min_value=1, max_value=5, value=1, step=1)
+    num_files = st.sidebar.number_input("Liczba par", min_value=1, max_value=50, value=1, step=1)
 
     for i in range(num_files):
         st.sidebar.markdown(f"**Para #{i + 1}:**")
@@ -780,23 +234,52 @@ if data_source == "📥 Upload CSV (do 5 plików)":
     else:
         st.sidebar.warning("⚠️ Wgraj co najmniej 1 plik CSV")
 
+    intraday_stream = st.sidebar.checkbox(
+        "⏱️ Intraday out-of-core (M1/M5/H1)",
+        value=False,
+        help="Plik czytany paczkami, bez ładowania całości do RAM. Okres pivot liczony w barach pliku, "
+             "holding w dniach kalendarzowych. Nie dotyczy trybu wspólnego marginu."
+    )
+
 else:
     st.sidebar.markdown("### 💱 Wybór par walutowych")
 
     available_pairs = list(FOREX_SYMBOLS.keys())
 
     selected_symbols = st.sidebar.multiselect(
-        "Wybierz pary (max 5):",
+        "Wybierz pary:",
         available_pairs,
-        default=['EURUSD'],
-        max_selections=5
+        default=['EURUSD']
     )
 
+    extra_pairs = st.sidebar.text_input(
+        "Dodatkowe pary (Yahoo, po przecinku)",
+        value="",
+        help="Np. AUDJPY, NZDCAD, EURNOK — symbol Yahoo: PARA=X"
+    )
+    for pair in extra_pairs.replace(';', ',').split(','):
+        pair = pair.strip().upper()
+        if pair and pair not in selected_symbols:
+            selected_symbols.append(pair)
+
     if len(selected_symbols) > 0:
         st.sidebar.success(f"✅ Wybrano: {len(selected_symbols)} par")
     else:
         st.sidebar.warning("⚠️ Wybierz co najmniej 1 parę")
 
+    offline_mode = st.sidebar.checkbox(
+        "📴 Offline (tylko lokalny magazyn barów)",
+        value=False,
+        help="Bez zapytań do Yahoo — dane wyłącznie z data/bars.db (powtarzalne wyniki)"
+    )
+
+shared_margin = st.sidebar.checkbox(
+    "💼 Wspólny kapitał i margin (portfel)",
+    value=False,
+    help="Wszystkie pary w jednym strumieniu zdarzeń z jedną pulą kapitału i marginu. "
+         "Bez tej opcji każda para dostaje kapitał / liczba par."
+)
+
 st.sidebar.markdown("### 💰 Parametry")
 
 initial_capital = st.sidebar.number_input(
@@ -853,6 +336,25 @@ spread_value = st.sidebar.number_input(
     format="%.4f"
 )
 
+with st.sidebar.expander("📈 Model kosztów (spread w czasie + swap)"):
+    st.caption("CSV/Parquet w układzie długim. Spread: Date, Symbol, Spread (w cenie). "
+               "Swap: Date, Symbol, Long, Short (pipsy za noc). Bez pliku: stały spread powyżej, bez swapów.")
+    spread_upload = st.file_uploader("Seria spreadów", type=['csv', 'parquet'], key='spread_file')
+    swap_upload = st.file_uploader("Tabela swapów", type=['csv', 'parquet'], key='swap_file')
+
+cost_model = None
+if spread_upload is not None or swap_upload is not None:
+    try:
+        cost_model = load_cost_model(
+            spread_upload.getvalue() if spread_upload is not None else None,
+            spread_upload.name if spread_upload is not None else None,
+            swap_upload.getvalue() if swap_upload is not None else None,
+            swap_upload.name if swap_upload is not None else None,
+            spread_value
+        )
+    except (ValueError, KeyError) as e:
+        st.sidebar.error(f"❌ Model kosztów: {e}")
+
 st.sidebar.markdown("### 💸 Fee Structure")
 management_fee_pct = st.sidebar.number_input(
     "Management Fee (%/rok)",
@@ -872,11 +374,42 @@ success_fee_pct = st.sidebar.number_input(
     help="Pobierany NA KOŃCU roku tylko od wygenerowanego zysku"
 )
 
-st.sidebar.info(f"💡 Mgmt: {management_fee_pct}% (start) + Success: {success_fee_pct}% (end)")
+fee_schedule = st.sidebar.selectbox(
+    "Rozliczanie fees",
+    ["Roczne", "Kwartalne", "Miesięczne"],
+    help="Management fee (%/rok) dzielony na okresy; success fee od zysku każdego okresu"
+)
+fee_period = {"Roczne": 'Y', "Kwartalne": 'Q', "Miesięczne": 'M'}[fee_schedule]
+
+st.sidebar.info(f"💡 Mgmt: {management_fee_pct}% (start) + Success: {success_fee_pct}% (end) — "
+                f"{fee_schedule.lower()}")
+
+st.sidebar.markdown("### 🔮 Prognoza Monte Carlo")
+mc_paths = st.sidebar.select_slider(
+    "Liczba ścieżek",
+    options=[10_000, 50_000, 100_000, 250_000, 500_000, 1_000_000],
+    value=100_000
+)
+mc_block_size = st.sidebar.slider(
+    "Blok bootstrap (transakcje)",
+    min_value=1,
+    max_value=20,
+    value=1,
+    help="1 = losowanie niezależnych transakcji; >1 = bloki kolejnych transakcji (serie zysków/strat)"
+)
+mc_ruin_pct = st.sidebar.slider(
+    "Próg ruiny (% straty)",
+    min_value=10,
+    max_value=100,
+    value=50,
+    step=10
+)
 
 st.sidebar.markdown("### 📅 Strategia")
 if data_source == "🌐 Yahoo Finance":
     backtest_days = st.sidebar.slider("Dni historii", 365, 3650, 1825)
+else:
+    backtest_days = None
 
 lookback_days = st.sidebar.slider(
     "Okres pivot (dni)",
@@ -923,100 +456,263 @@ if use_stop_loss:
 else:
     stop_loss_pct = None
 
+st.sidebar.markdown("### 🧪 Tryb")
+run_mode = st.sidebar.radio(
+    "Tryb uruchomienia:",
+    ["Pojedynczy backtest", "Sweep parametrów", "Walk-forward"],
+    index=0,
+    help="Sweep: pełna siatka parametrów liczona równolegle w puli procesów. "
+         "Walk-forward: optymalizacja siatki in-sample → test out-of-sample, okno po oknie"
+)
+sweep_mode = run_mode == "Sweep parametrów"
+walk_forward_mode = run_mode == "Walk-forward"
+
+if sweep_mode or walk_forward_mode:
+    with st.sidebar.expander("📐 Siatka sweep", expanded=True):
+        sweep_lookbacks = st.multiselect("Okres pivot (dni)", list(range(3, 22)), default=[5, 7, 10, 14])
+        sweep_holdings = st.multiselect("Holding (dni)", [1, 2, 3, 5, 7, 10, 14, 20, 30, 60, 90, 120],
+                                        default=[3, 5, 10, 20])
+        sweep_levels = st.multiselect("Poziomy (support/resistance)", ["S3/R3", "S2/R2"], default=["S3/R3", "S2/R2"])
+        sweep_stop_losses = st.multiselect("Stop Loss (%) — 0 = brak", [0.0, 0.5, 1.0, 1.5, 2.0, 2.5, 3.0],
+                                           default=[0.0, 1.0])
+        sweep_leverages = st.multiselect("Leverage", [1, 5, 10, 15, 20], default=[leverage])
+        sweep_usages = st.multiselect("Alokacja (%)", list(range(10, 101, 10)), default=[capital_usage_pct])
+        sweep_workers = st.number_input("Procesy", min_value=1, max_value=os.cpu_count() or 1,
+                                        value=os.cpu_count() or 1, step=1)
+
+    sweep_grid = build_parameter_grid(
+        sweep_lookbacks, sweep_holdings,
+        [tuple(level.split('/')) for level in sweep_levels],
+        sweep_stop_losses, sweep_leverages, sweep_usages
+    )
+    st.sidebar.info(f"🔢 Kombinacji na parę: {len(sweep_grid):,}")
+
+if walk_forward_mode:
+    with st.sidebar.expander("🔁 Okna walk-forward", expanded=True):
+        wf_in_sample_days = st.slider("In-sample (dni)", 180, 1825, 730, step=30)
+        wf_out_sample_days = st.slider("Out-of-sample (dni)", 30, 730, 182, step=30)
+        wf_rank_by = st.selectbox("Kryterium wyboru", ['Sharpe Ratio', 'Return (%)', 'Max DD (%)'])
+
 can_run = len(selected_symbols) > 0
 
-if st.sidebar.button("🚀 URUCHOM BACKTEST", type="primary", disabled=not can_run):
+# Dane + parametry strategii pojedynczego backtestu (bez fees, prognozy i wyświetlania):
+# przy tym samym kluczu wyniki ostatniego uruchomienia są pokazywane bez ponownego liczenia
+single_run_key = (
+    data_source, tuple(selected_symbols),
+    tuple((symbol, getattr(file, 'file_id', file.name)) for symbol, file in csv_files.items()),
+    backtest_days, offline_mode, intraday_stream, shared_margin, lookback_days, initial_capital,
+    spread_value, holding_days, stop_loss_pct, support_level, resistance_level, trade_direction_value,
+    leverage, capital_usage_pct, None if cost_model is None else cost_model.fingerprint
+)
+run_single = run_mode == "Pojedynczy backtest" and st.sidebar.button("🚀 URUCHOM BACKTEST", type="primary",
+                                                                     disabled=not can_run)
+last_single_run = st.session_state.get('last_single_run')
+if last_single_run is not None and last_single_run['key'] != single_run_key:
+    last_single_run = None
 
-    backtester = PivotBacktester(lookback_days=lookback_days)
+if sweep_mode and st.sidebar.button("🚀 URUCHOM SWEEP", type="primary", disabled=not can_run or not sweep_grid):
 
-    capital_per_pair = initial_capital / len(selected_symbols)
+    backtester = PivotBacktester(bar_store=get_bar_store(), offline=offline_mode)
 
-    all_trades = []
-    results_per_symbol = {}
+    st.markdown(f"## 🧪 Sweep parametrów — {len(sweep_grid):,} kombinacji na parę")
 
-    if data_source == "📥 Upload CSV (do 5 plików)":
-        progress_bar = st.progress(0)
-        status_text = st.empty()
+    sweep_results = {}
 
-        for idx, (symbol, uploaded_file) in enumerate(csv_files.items()):
-            status_text.text(f"Przetwarzam {symbol}... ({idx + 1}/{len(csv_files)})")
+    for symbol, uploaded_file in symbol_sources(data_source, csv_files, selected_symbols):
+        df, load_status = load_symbol_data(backtester, symbol, uploaded_file, backtest_days)
 
-            df, load_status = backtester.load_csv_data(uploaded_file)
+        if df is None or len(df) == 0:
+            st.error(f"❌ {symbol}: {load_status}")
+            continue
 
-            if df is not None and len(df) > 0:
-                st.info(f"✅ {symbol}: {load_status}")
+        progress_bar = st.progress(0, text=f"{symbol}: 0/{len(sweep_grid)}")
 
-                df = backtester.calculate_pivot_points(df)
+        def update_progress(done, total, symbol=symbol, progress_bar=progress_bar):
+            progress_bar.progress(done / total, text=f"{symbol}: {done:,}/{total:,}")
 
-                trades_df, final_cap, mc_count, skip_count = backtester.run_backtest(
-                    df, symbol, capital_per_pair, spread_value,
-                    holding_days, stop_loss_pct, support_level, resistance_level, trade_direction_value,
-                    leverage, capital_usage_pct
-                )
+        sweep_results[symbol] = run_parameter_sweep(
+            df, symbol, sweep_grid, initial_capital, spread_value, trade_direction_value,
+            max_workers=int(sweep_workers), progress_callback=update_progress, costs=cost_model
+        )
+        progress_bar.empty()
 
-                all_trades.append(trades_df)
-                results_per_symbol[symbol] = {
-                    'trades': trades_df,
-                    'final_capital': final_cap,
-                    'initial_capital': capital_per_pair,
-                    'margin_calls': mc_count,
-                    'skipped_no_margin': skip_count
-                }
-            else:
-                st.error(f"❌ {symbol}: {load_status}")
+    for symbol, results in sweep_results.items():
+        st.markdown(f"### 💱 {symbol}")
 
-            progress_bar.progress((idx + 1) / len(csv_files))
+        st.markdown("**🏆 Ranking (wg zwrotu %)**")
+        st.dataframe(results.head(50), use_container_width=True, hide_index=True)
 
-        status_text.empty()
+        heat_cols = st.columns(3)
+        for heat_col, metric in zip(heat_cols, ['Return (%)', 'Max DD (%)', 'Sharpe Ratio']):
+            heat = sweep_heatmap(results, metric)
+            fig_heat = go.Figure(go.Heatmap(
+                z=heat.values, x=heat.columns.astype(str), y=heat.index.astype(str),
+                colorscale='RdYlGn', colorbar=dict(title=metric)
+            ))
+            fig_heat.update_layout(
+                title=f"{metric} (max po pozostałych parametrach)",
+                xaxis_title="Okres pivot (dni)",
+                yaxis_title="Holding (dni)",
+                height=400
+            )
+            with heat_col:
+                st.plotly_chart(fig_heat, use_container_width=True)
+
+        st.download_button(
+            f"📥 Pobierz sweep {symbol} (CSV)",
+            results.to_csv(index=False),
+            f"sweep_{symbol}_{datetime.now().strftime('%Y%m%d')}.csv",
+            "text/csv",
+            key=f"sweep_download_{symbol}"
+        )
+
+elif walk_forward_mode and st.sidebar.button("🚀 URUCHOM WALK-FORWARD", type="primary",
+                                             disabled=not can_run or not sweep_grid):
+
+    backtester = PivotBacktester(bar_store=get_bar_store(), offline=offline_mode)
+    capital_per_pair = initial_capital / len(selected_symbols)
+
+    st.markdown(f"## 🔁 Walk-forward — IS {wf_in_sample_days}d → OOS {wf_out_sample_days}d, "
+                f"{len(sweep_grid):,} kombinacji, wybór wg {wf_rank_by}")
+
+    fig_wf = go.Figure()
+
+    for symbol, uploaded_file in symbol_sources(data_source, csv_files, selected_symbols):
+        df, load_status = load_symbol_data(backtester, symbol, uploaded_file, backtest_days)
+
+        if df is None or len(df) == 0:
+            st.error(f"❌ {symbol}: {load_status}")
+            continue
+
+        progress_bar = st.progress(0, text=f"{symbol}: okna 0")
+
+        def update_progress(done, total, symbol=symbol, progress_bar=progress_bar):
+            progress_bar.progress(done / total, text=f"{symbol}: okna {done}/{total}")
+
+        windows_df, wf_trades, wf_final_capital = run_walk_forward(
+            df, symbol, sweep_grid, wf_in_sample_days, wf_out_sample_days,
+            capital_per_pair, spread_value, trade_direction_value, wf_rank_by,
+            max_workers=int(sweep_workers), progress_callback=update_progress, costs=cost_model
+        )
         progress_bar.empty()
 
-    else:
-        progress_bar = st.progress(0)
-        status_text = st.empty()
+        st.markdown(f"### 💱 {symbol}")
 
-        for idx, symbol in enumerate(selected_symbols):
-            status_text.text(f"Przetwarzam {symbol}... ({idx + 1}/{len(selected_symbols)})")
+        if len(windows_df) == 0:
+            st.warning(f"⚠️ {symbol}: za krótka historia na okno in-sample {wf_in_sample_days}d")
+            continue
 
-            df = backtester.get_forex_data(symbol, backtest_days)
+        wf_return = (wf_final_capital - capital_per_pair) / capital_per_pair * 100
 
-            if df is not None and len(df) > 0:
-                df = backtester.calculate_pivot_points(df)
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Kapitał końcowy OOS", f"{wf_final_capital:,.2f}", f"{wf_return:+.2f}%")
+        with col2:
+            st.metric("Okna", len(windows_df))
+        with col3:
+            st.metric("Transakcje OOS", len(wf_trades))
+
+        st.dataframe(windows_df, use_container_width=True, hide_index=True)
+        sequential_windows = int((windows_df['OOS Stitch'] == 'sequential').sum())
+        st.caption("Okna OOS liczone od kapitału startowego i przeskalowane kapitałem końcowym poprzedniego okna; "
+                   "okna z margin callem albo kapitałem spadającym do 0 liczone ponownie po kolei z przeniesionym "
+                   f"kapitałem (kolumna OOS Stitch: {sequential_windows} z {len(windows_df)}).")
+
+        if len(wf_trades) > 0:
+            fig_wf.add_trace(go.Scatter(
+                x=wf_trades['Exit Date'], y=wf_trades['Capital'],
+                mode='lines', name=symbol
+            ))
 
-                trades_df, final_cap, mc_count, skip_count = backtester.run_backtest(
-                    df, symbol, capital_per_pair, spread_value,
-                    holding_days, stop_loss_pct, support_level, resistance_level, trade_direction_value,
-                    leverage, capital_usage_pct
-                )
+            st.download_button(
+                f"📥 Pobierz transakcje OOS {symbol} (CSV)",
+                wf_trades.to_csv(index=False),
+                f"walkforward_{symbol}_{datetime.now().strftime('%Y%m%d')}.csv",
+                "text/csv",
+                key=f"wf_download_{symbol}"
+            )
 
-                all_trades.append(trades_df)
-                results_per_symbol[symbol] = {
-                    'trades': trades_df,
-                    'final_capital': final_cap,
-                    'initial_capital': capital_per_pair,
-                    'margin_calls': mc_count,
-                    'skipped_no_margin': skip_count
-                }
-            else:
-                st.warning(f"⚠️ Nie udało się pobrać danych dla {symbol}")
+    if len(fig_wf.data) > 0:
+        fig_wf.add_hline(y=capital_per_pair, line_dash='dash', line_color='gray', annotation_text='Start')
+        fig_wf.update_layout(
+            title="Sklejona krzywa kapitału out-of-sample (per para)",
+            xaxis_title="Data",
+            yaxis_title="Kapitał (waluta bazowa)",
+            height=500,
+            hovermode='x unified'
+        )
+        st.plotly_chart(fig_wf, use_container_width=True)
+
+elif run_mode == "Pojedynczy backtest" and (run_single or last_single_run is not None):
+    if run_single:
+        backtester = PivotBacktester(lookback_days=lookback_days, bar_store=get_bar_store(),
+                                     offline=offline_mode, costs=cost_model)
 
-            progress_bar.progress((idx + 1) / len(selected_symbols))
+        capital_per_pair = initial_capital / len(selected_symbols)
+
+        sources = symbol_sources(data_source, csv_files, selected_symbols)
+        backtest_params = (
+            capital_per_pair, spread_value, holding_days, stop_loss_pct, support_level, resistance_level,
+            trade_direction_value, leverage, capital_usage_pct
+        )
+
+        progress_bar = st.progress(0)
+        status_text = st.empty()
+        outcomes = {}
+        result_cache = get_result_cache()
+
+        # Pobranie/wczytanie per para w puli wątków, pivoty i backtest w puli procesów;
+        # UI aktualizowane w wątku skryptu w kolejności ukończenia
+        with symbol_cpu_pool(len(sources)) or nullcontext() as cpu_pool, \
+                ThreadPoolExecutor(max_workers=min(SYMBOL_WORKERS, len(sources))) as pool:
+            futures = {
+                pool.submit(process_symbol, backtester, symbol, uploaded_file, backtest_days,
+                            backtest_params, shared_margin, intraday_stream, result_cache,
+                            cpu_pool=cpu_pool): symbol
+                for symbol, uploaded_file in sources
+            }
+            for done, future in enumerate(as_completed(futures), start=1):
+                symbol = futures[future]
+                outcome = outcomes[symbol] = future.result()
+
+                if outcome['ok']:
+                    cache_note = " (♻️ z cache)" if outcome['cached'] else ""
+                    st.info(f"✅ {symbol}: {outcome['status']}{cache_note}")
+                elif data_source == "📥 Upload CSV":
+                    st.error(f"❌ {symbol}: {outcome['status']}")
+                else:
+                    st.warning(f"⚠️ Nie udało się pobrać danych dla {symbol}")
+
+                status_text.text(f"Ukończono {symbol} ({done}/{len(sources)})")
+                progress_bar.progress(done / len(sources))
 
         status_text.empty()
         progress_bar.empty()
 
-    if len(all_trades) > 0:
-        combined_trades = pd.concat(all_trades, ignore_index=True)
-        combined_trades = combined_trades.sort_values('Exit Date').reset_index(drop=True)
+        # Składanie wyników w kolejności wyboru par (deterministyczna krzywa portfela)
+        combined_trades, results_per_symbol = assemble_portfolio(
+            [symbol for symbol, _ in sources], outcomes, initial_capital, backtest_params, shared_margin,
+            result_cache, cost_model
+        )
 
-        # Portfolio capital tracking
-        combined_trades['Portfolio Capital'] = initial_capital
-        for i in range(len(combined_trades)):
-            if i > 0:
-                combined_trades.at[i, 'Portfolio Capital'] = combined_trades.at[i - 1, 'Portfolio Capital'] + \
-                                                              combined_trades.at[i, 'Profit (base)']
-            else:
-                combined_trades.at[0, 'Portfolio Capital'] = initial_capital + combined_trades.at[0, 'Profit (base)']
+        # Equity per bar (mark-to-market otwartych pozycji) - DD, Sharpe i ekspozycja
+        equity_mtm = portfolio_equity_curve(combined_trades, outcomes, initial_capital, spread_value, cost_model)
 
+        st.session_state['last_single_run'] = {
+            'key': single_run_key,
+            'combined_trades': combined_trades,
+            'results_per_symbol': results_per_symbol,
+            'equity_mtm': equity_mtm
+        }
+    else:
+        # Zmiana fees / prognozy / wyświetlania: backtest z ostatniego uruchomienia
+        combined_trades = last_single_run['combined_trades']
+        results_per_symbol = last_single_run['results_per_symbol']
+        equity_mtm = last_single_run['equity_mtm']
+        st.caption("♻️ Wyniki ostatniego backtestu (te same dane i parametry strategii) — "
+                   "przeliczone tylko fees, prognoza i wykresy")
+
+    if len(combined_trades) > 0:
         final_portfolio_capital = combined_trades.iloc[-1]['Portfolio Capital']
 
         # ============================================
@@ -1075,8 +771,9 @@ if st.sidebar.button("🚀 URUCHOM BACKTEST", type="primary", disabled=not can_r
         st.markdown("## 💸 Analiza Fees")
 
         yearly_before, yearly_after = calculate_yearly_stats_with_fees(
-            combined_trades, initial_capital, management_fee_pct, success_fee_pct
+            combined_trades, initial_capital, management_fee_pct, success_fee_pct, fee_period, equity_mtm
         )
+        period_column = 'Year' if fee_period == 'Y' else 'Period'
 
         if len(yearly_after) > 0:
             total_management_fees = yearly_after['Management Fee'].sum()
@@ -1122,7 +819,7 @@ if st.sidebar.button("🚀 URUCHOM BACKTEST", type="primary", disabled=not can_r
 
             # Fee Flow
             if len(yearly_after) > 0:
-                st.markdown("### 💸 Fee Flow (przykład pierwszego roku)")
+                st.markdown(f"### 💸 Fee Flow (przykład pierwszego okresu: {yearly_after[period_column].iloc[0]})")
                 example_year = yearly_after.iloc[0]
 
                 col1, col2, col3, col4, col5 = st.columns(5)
@@ -1178,19 +875,7 @@ if st.sidebar.button("🚀 URUCHOM BACKTEST", type="primary", disabled=not can_r
         summary_df = pd.DataFrame(summary_data)
 
         if len(summary_df) > 0:
-            display_summary = summary_df.copy()
-            display_summary['Initial Capital'] = display_summary['Initial Capital'].apply(lambda x: f"{x:,.2f}")
-            display_summary['Final Capital'] = display_summary['Final Capital'].apply(lambda x: f"{x:,.2f}")
-            display_summary['Profit (base)'] = display_summary['Profit (base)'].apply(lambda x: f"{x:+,.2f}")
-            display_summary['Profit (%)'] = display_summary['Profit (%)'].apply(lambda x: f"{x:+.2f}%")
-            display_summary['Total P&L (quoted)'] = display_summary['Total P&L (quoted)'].apply(
-                lambda x: f"{x:+,.2f}")
-            display_summary['Total P&L (base)'] = display_summary['Total P&L (base)'].apply(lambda x: f"{x:+,.2f}")
-            display_summary['Win Rate (%)'] = display_summary['Win Rate (%)'].apply(lambda x: f"{x:.1f}%")
-            display_summary['Total Pips'] = display_summary['Total Pips'].apply(lambda x: f"{x:.1f}")
-            display_summary['Avg Holding (days)'] = display_summary['Avg Holding (days)'].apply(lambda x: f"{x:.1f}")
-
-            st.dataframe(display_summary, use_container_width=True, hide_index=True)
+            show_table(summary_df, SUMMARY_FORMATS)
 
             # Wykres porównawczy
             st.markdown("### 📊 Porównanie zwrotów per para")
@@ -1203,7 +888,7 @@ if st.sidebar.button("🚀 URUCHOM BACKTEST", type="primary", disabled=not can_r
                 x=summary_df['Symbol'],
                 y=summary_df['Profit (%)'],
                 marker_color=colors,
-                text=summary_df['Profit (%)'].apply(lambda x: f"{x:+.1f}%"),
+                texttemplate='%{y:+.1f}%',
                 textposition='outside'
             ))
 
@@ -1245,43 +930,65 @@ if st.sidebar.button("🚀 URUCHOM BACKTEST", type="primary", disabled=not can_r
 
             st.plotly_chart(fig_portfolio, use_container_width=True)
 
+            # Equity mark-to-market per bar
+            if len(equity_mtm) > 0:
+                st.markdown("### 📉 Equity mark-to-market (per bar)")
+
+                mtm_stats = equity_curve_stats(equity_mtm)
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    st.metric("Max DD (MTM)", f"{mtm_stats['Max DD (%)']:.2f}%")
+                with col2:
+                    st.metric("Sharpe (per bar)", f"{mtm_stats['Sharpe Ratio']:.2f}")
+                with col3:
+                    st.metric("Śr. ekspozycja", f"x{mtm_stats['Avg Exposure (x)']:.2f}")
+                with col4:
+                    st.metric("Czas w rynku", f"{mtm_stats['Time in Market (%)']:.1f}%")
+
+                fig_mtm = make_subplots(rows=3, cols=1, shared_xaxes=True, vertical_spacing=0.04,
+                                        row_heights=[0.5, 0.25, 0.25])
+                fig_mtm.add_trace(go.Scatter(
+                    x=equity_mtm['Date'], y=equity_mtm['Equity'], mode='lines',
+                    name='Equity (MTM)', line=dict(color='blue', width=1.5)
+                ), row=1, col=1)
+                fig_mtm.add_trace(go.Scatter(
+                    x=equity_mtm['Date'], y=equity_mtm['Realized'], mode='lines',
+                    name='Kapitał zrealizowany', line=dict(color='gray', width=1, dash='dot')
+                ), row=1, col=1)
+                fig_mtm.add_trace(go.Scatter(
+                    x=equity_mtm['Date'], y=equity_mtm['Drawdown (%)'], mode='lines',
+                    name='Drawdown (%)', line=dict(color='red', width=1), fill='tozeroy'
+                ), row=2, col=1)
+                fig_mtm.add_trace(go.Scatter(
+                    x=equity_mtm['Date'], y=equity_mtm['Gross Exposure'], mode='lines',
+                    name='Ekspozycja brutto', line=dict(color='orange', width=1)
+                ), row=3, col=1)
+                fig_mtm.update_yaxes(title_text="Kapitał", row=1, col=1)
+                fig_mtm.update_yaxes(title_text="DD (%)", row=2, col=1)
+                fig_mtm.update_yaxes(title_text="Ekspozycja", row=3, col=1)
+                fig_mtm.update_layout(height=700, hovermode='x unified')
+
+                st.plotly_chart(fig_mtm, use_container_width=True)
+
             # ANALIZA ROCZNA
             st.markdown("## 📅 Analiza roczna portfolio")
 
             tab1, tab2 = st.tabs(["🟢 Przed Fees", "🔴 Po Fees"])
 
             with tab1:
-                st.markdown("### Statystyki roczne (przed fees)")
+                st.markdown(f"### Statystyki okresowe — {fee_schedule.lower()} (przed fees)")
 
                 if len(yearly_before) > 0:
-                    display_yearly_before = yearly_before.copy()
-                    display_yearly_before['Start Capital'] = display_yearly_before['Start Capital'].apply(
-                        lambda x: f"{x:,.2f}")
-                    display_yearly_before['End Capital'] = display_yearly_before['End Capital'].apply(
-                        lambda x: f"{x:,.2f}")
-                    display_yearly_before['Profit (base)'] = display_yearly_before['Profit (base)'].apply(
-                        lambda x: f"{x:+,.2f}")
-                    display_yearly_before['Profit (%)'] = display_yearly_before['Profit (%)'].apply(
-                        lambda x: f"{x:+.2f}%")
-                    display_yearly_before['Win Rate (%)'] = display_yearly_before['Win Rate (%)'].apply(
-                        lambda x: f"{x:.1f}%")
-                    display_yearly_before['Max DD (%)'] = display_yearly_before['Max DD (%)'].apply(
-                        lambda x: f"{x:.2f}%")
-                    display_yearly_before['Sharpe Ratio'] = display_yearly_before['Sharpe Ratio'].apply(
-                        lambda x: f"{x:.2f}")
-                    display_yearly_before['Total Pips'] = display_yearly_before['Total Pips'].apply(
-                        lambda x: f"{x:.1f}")
-
-                    st.dataframe(display_yearly_before, use_container_width=True, hide_index=True)
+                    show_table(yearly_before, PERIOD_FORMATS_BEFORE)
 
                     fig_yearly_before = go.Figure()
                     colors_before = ['green' if x > 0 else 'red' for x in yearly_before['Profit (%)']]
 
                     fig_yearly_before.add_trace(go.Bar(
-                        x=yearly_before['Year'],
+                        x=yearly_before[period_column],
                         y=yearly_before['Profit (%)'],
                         marker_color=colors_before,
-                        text=yearly_before['Profit (%)'].apply(lambda x: f"{x:+.1f}%"),
+                        texttemplate='%{y:+.1f}%',
                         textposition='outside'
                     ))
 
@@ -1295,51 +1002,21 @@ if st.sidebar.button("🚀 URUCHOM BACKTEST", type="primary", disabled=not can_r
                     st.plotly_chart(fig_yearly_before, use_container_width=True)
 
             with tab2:
-                st.markdown("### Statystyki roczne (po fees)")
+                st.markdown(f"### Statystyki okresowe — {fee_schedule.lower()} (po fees)")
 
                 if len(yearly_after) > 0:
-                    display_yearly_after = yearly_after.copy()
-                    display_yearly_after['Start Capital'] = display_yearly_after['Start Capital'].apply(
-                        lambda x: f"{x:,.2f}")
-                    display_yearly_after['Management Fee'] = display_yearly_after['Management Fee'].apply(
-                        lambda x: f"{x:,.2f}")
-                    display_yearly_after['After Mgmt Fee'] = display_yearly_after['After Mgmt Fee'].apply(
-                        lambda x: f"{x:,.2f}")
-                    display_yearly_after['Trading Profit'] = display_yearly_after['Trading Profit'].apply(
-                        lambda x: f"{x:+,.2f}")
-                    display_yearly_after['Before Success Fee'] = display_yearly_after['Before Success Fee'].apply(
-                        lambda x: f"{x:,.2f}")
-                    display_yearly_after['Success Fee'] = display_yearly_after['Success Fee'].apply(
-                        lambda x: f"{x:,.2f}")
-                    display_yearly_after['End Capital'] = display_yearly_after['End Capital'].apply(
-                        lambda x: f"{x:,.2f}")
-                    display_yearly_after['Total Fees'] = display_yearly_after['Total Fees'].apply(
-                        lambda x: f"{x:,.2f}")
-                    display_yearly_after['Net Profit (base)'] = display_yearly_after['Net Profit (base)'].apply(
-                        lambda x: f"{x:+,.2f}")
-                    display_yearly_after['Net Profit (%)'] = display_yearly_after['Net Profit (%)'].apply(
-                        lambda x: f"{x:+.2f}%")
-                    display_yearly_after['Win Rate (%)'] = display_yearly_after['Win Rate (%)'].apply(
-                        lambda x: f"{x:.1f}%")
-                    display_yearly_after['Max DD (%)'] = display_yearly_after['Max DD (%)'].apply(
-                        lambda x: f"{x:.2f}%")
-                    display_yearly_after['Sharpe Ratio'] = display_yearly_after['Sharpe Ratio'].apply(
-                        lambda x: f"{x:.2f}")
-                    display_yearly_after['Total Pips'] = display_yearly_after['Total Pips'].apply(
-                        lambda x: f"{x:.1f}")
-
-                    st.dataframe(display_yearly_after, use_container_width=True, hide_index=True)
-
-                    st.success("✅ **Start Capital w roku N = End Capital z roku N-1** (fees odejmowane!)")
+                    show_table(yearly_after, PERIOD_FORMATS_AFTER)
+
+                    st.success("✅ **Start Capital w okresie N = End Capital z okresu N-1** (fees odejmowane!)")
 
                     fig_yearly_after = go.Figure()
                     colors_after = ['green' if x > 0 else 'red' for x in yearly_after['Net Profit (%)']]
 
                     fig_yearly_after.add_trace(go.Bar(
-                        x=yearly_after['Year'],
+                        x=yearly_after[period_column],
                         y=yearly_after['Net Profit (%)'],
                         marker_color=colors_after,
-                        text=yearly_after['Net Profit (%)'].apply(lambda x: f"{x:+.1f}%"),
+                        texttemplate='%{y:+.1f}%',
                         textposition='outside'
                     ))
 
@@ -1358,21 +1035,21 @@ if st.sidebar.button("🚀 URUCHOM BACKTEST", type="primary", disabled=not can_r
                     fig_fees = go.Figure()
 
                     fig_fees.add_trace(go.Bar(
-                        x=yearly_after['Year'],
+                        x=yearly_after[period_column],
                         y=yearly_after['Management Fee'],
                         name='Management Fee (start)',
                         marker_color='orange'
                     ))
 
                     fig_fees.add_trace(go.Bar(
-                        x=yearly_after['Year'],
+                        x=yearly_after[period_column],
                         y=yearly_after['Success Fee'],
                         name='Success Fee (end)',
                         marker_color='red'
                     ))
 
                     fig_fees.update_layout(
-                        title="Breakdown fees per rok",
+                        title=f"Breakdown fees ({fee_schedule.lower()})",
                         xaxis_title="Rok",
                         yaxis_title="Fees (waluta bazowa)",
                         barmode='stack',
@@ -1382,63 +1059,86 @@ if st.sidebar.button("🚀 URUCHOM BACKTEST", type="primary", disabled=not can_r
                     st.plotly_chart(fig_fees, use_container_width=True)
 
             # PROGNOZA
-            st.markdown("## 🔮 Prognoza 5-letnia (przed fees)")
+            st.markdown("## 🔮 Prognoza 5-letnia Monte Carlo (przed fees)")
 
             projection_df, avg_return, std_return = calculate_projection(combined_trades, initial_capital, 5)
+            fan_df, mc_max_dd, prob_ruin = monte_carlo_projection(
+                combined_trades, final_portfolio_capital, 5, mc_paths, mc_block_size, mc_ruin_pct
+            )
 
-            if projection_df is not None:
+            if fan_df is not None:
 
-                col1, col2, col3 = st.columns(3)
+                col1, col2, col3, col4 = st.columns(4)
 
                 with col1:
-                    st.metric("Średni roczny zwrot", f"{avg_return * 100:.2f}%")
+                    st.metric("Średni roczny zwrot", f"{avg_return * 100:.2f}%",
+                              f"± {std_return * 100:.2f}% std")
                 with col2:
-                    st.metric("Odchylenie std", f"{std_return * 100:.2f}%")
-                with col3:
-                    final_projected = projection_df.iloc[-1]['Base']
+                    final_projected = fan_df.iloc[-1]['P50']
                     projected_gain = final_projected - final_portfolio_capital
-                    st.metric("Prognoza za 5 lat", f"{final_projected:,.0f}", f"+{projected_gain:,.0f}")
+                    st.metric("Mediana za 5 lat", f"{final_projected:,.0f}", f"{projected_gain:+,.0f}")
+                with col3:
+                    st.metric(f"P(ruiny: -{mc_ruin_pct:.0f}%)", f"{prob_ruin * 100:.2f}%")
+                with col4:
+                    st.metric("Mediana max DD", f"{np.median(mc_max_dd):.1f}%")
 
-                st.warning("⚠️ **Prognoza pokazuje zwroty PRZED fees.**")
+                block_info = "iid" if mc_block_size <= 1 else f"bloki po {mc_block_size} transakcji"
+                st.warning(f"⚠️ **Prognoza pokazuje zwroty PRZED fees.** "
+                           f"Bootstrap {mc_paths:,} ścieżek ({block_info}) z historycznych transakcji.")
 
                 fig_proj = go.Figure()
 
-                if len(yearly_before) > 0:
+                yearly_history = yearly_before if fee_period == 'Y' else \
+                    calculate_yearly_stats_with_fees(combined_trades, initial_capital)[0]
+                if len(yearly_history) > 0:
                     fig_proj.add_trace(go.Scatter(
-                        x=yearly_before['Year'],
-                        y=yearly_before['End Capital'],
+                        x=yearly_history['Year'],
+                        y=yearly_history['End Capital'],
                         mode='lines+markers',
                         name='Historia (przed fees)',
                         line=dict(color='blue', width=3)
                     ))
 
                 current_year = datetime.now().year
-                proj_years = [current_year] + projection_df['Year'].tolist()
-                proj_base = [final_portfolio_capital] + projection_df['Base'].tolist()
-                proj_pess = [final_portfolio_capital] + projection_df['Pessimistic'].tolist()
-                proj_opt = [final_portfolio_capital] + projection_df['Optimistic'].tolist()
+                proj_years = [current_year] + (current_year + fan_df['Year']).tolist()
+
+                def fan_series(column):
+                    return [final_portfolio_capital] + fan_df[column].tolist()
 
                 fig_proj.add_trace(go.Scatter(
-                    x=proj_years, y=proj_base,
-                    mode='lines+markers', name='Prognoza bazowa',
-                    line=dict(color='green', width=2, dash='dash')
+                    x=proj_years, y=fan_series('P95'),
+                    mode='lines', name='P95',
+                    line=dict(color='lightgreen', width=1, dash='dot')
+                ))
+
+                fig_proj.add_trace(go.Scatter(
+                    x=proj_years, y=fan_series('P5'),
+                    mode='lines', name='P5',
+                    line=dict(color='salmon', width=1, dash='dot'),
+                    fill='tonexty', fillcolor='rgba(44, 160, 44, 0.1)'
                 ))
 
                 fig_proj.add_trace(go.Scatter(
-                    x=proj_years, y=proj_opt,
-                    mode='lines', name='Optymistyczna',
-                    line=dict(color='lightgreen', width=1, dash='dot'),
-                    fill='tonexty'
+                    x=proj_years, y=fan_series('P75'),
+                    mode='lines', name='P75',
+                    line=dict(color='green', width=1)
                 ))
 
                 fig_proj.add_trace(go.Scatter(
-                    x=proj_years, y=proj_pess,
-                    mode='lines', name='Pesymistyczna',
-                    line=dict(color='salmon', width=1, dash='dot')
+                    x=proj_years, y=fan_series('P25'),
+                    mode='lines', name='P25',
+                    line=dict(color='orange', width=1),
+                    fill='tonexty', fillcolor='rgba(44, 160, 44, 0.25)'
+                ))
+
+                fig_proj.add_trace(go.Scatter(
+                    x=proj_years, y=fan_series('P50'),
+                    mode='lines+markers', name='Mediana (P50)',
+                    line=dict(color='green', width=2, dash='dash')
                 ))
 
                 fig_proj.update_layout(
-                    title="Prognoza kapitału (przed fees)",
+                    title="Prognoza kapitału - percentyle Monte Carlo (przed fees)",
                     xaxis_title="Rok",
                     yaxis_title="Kapitał (waluta bazowa)",
                     height=500,
@@ -1447,6 +1147,15 @@ if st.sidebar.button("🚀 URUCHOM BACKTEST", type="primary", disabled=not can_r
 
                 st.plotly_chart(fig_proj, use_container_width=True)
 
+                fig_dd = go.Figure(go.Histogram(x=mc_max_dd, nbinsx=60, marker_color='salmon'))
+                fig_dd.update_layout(
+                    title="Rozkład max drawdown ścieżek (5 lat)",
+                    xaxis_title="Max DD (%)",
+                    yaxis_title="Liczba ścieżek",
+                    height=350
+                )
+                st.plotly_chart(fig_dd, use_container_width=True)
+
             # STATYSTYKI SZCZEGÓŁOWE
             st.markdown("## 📊 Statystyki szczegółowe portfolio")
 
@@ -1482,21 +1191,7 @@ if st.sidebar.button("🚀 URUCHOM BACKTEST", type="primary", disabled=not can_r
             # Historia transakcji
             st.markdown("### 📝 Historia transakcji portfolio")
 
-            display = combined_trades.copy()
-            display['Entry Date'] = display['Entry Date'].dt.strftime('%Y-%m-%d')
-            display['Exit Date'] = display['Exit Date'].dt.strftime('%Y-%m-%d')
-            for col in ['Entry Price', 'Exit Price', 'Entry Level Value', 'Price Diff']:
-                display[col] = display[col].round(5)
-            display['Pips'] = display['Pips'].round(1)
-            display['Profit (quoted)'] = display['Profit (quoted)'].round(2)
-            display['Profit (base)'] = display['Profit (base)'].round(2)
-            display['P&L %'] = display['P&L %'].round(2)
-            display['ROI Margin %'] = display['ROI Margin %'].round(2)
-            display['Margin Used'] = display['Margin Used'].round(2)
-            display['Eff. Volume'] = display['Eff. Volume'].round(0)
-            display['Portfolio Capital'] = display['Portfolio Capital'].round(2)
-
-            st.dataframe(display, use_container_width=True)
+            show_paged_table(combined_trades, TRADE_FORMATS, key='portfolio_trades')
 
             # Download
             csv = combined_trades.to_csv(index=False)
@@ -1504,13 +1199,25 @@ if st.sidebar.button("🚀 URUCHOM BACKTEST", type="primary", disabled=not can_r
             if len(results_per_symbol) > 3:
                 symbols_str += f"_plus{len(results_per_symbol) - 3}"
 
+            file_stem = f"portfolio_{symbols_str}_P{lookback_days}d_H{holding_days}d_{datetime.now().strftime('%Y%m%d')}"
             st.download_button(
                 "📥 Pobierz wyniki portfolio (CSV)",
                 csv,
-                f"portfolio_{symbols_str}_P{lookback_days}d_H{holding_days}d_{datetime.now().strftime('%Y%m%d')}.csv",
+                f"{file_stem}.csv",
                 "text/csv"
             )
 
+            if HAS_PYARROW:
+                # Parquet z kolumnowego ledgera: kategorie zamiast stringów, typy zachowane
+                parquet_buffer = io.BytesIO()
+                TradeLedger.from_dataframe(combined_trades).to_parquet(parquet_buffer)
+                st.download_button(
+                    "📥 Pobierz wyniki portfolio (Parquet)",
+                    parquet_buffer.getvalue(),
+                    f"{file_stem}.parquet",
+                    "application/vnd.apache.parquet"
+                )
+
     else:
         st.error("❌ Nie udało się wykonać backtestingu")
 
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Moduły repozytorium leżą w katalogu głównym (bez pakietu)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
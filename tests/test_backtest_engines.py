@@ -0,0 +1,338 @@
+"""
+Silnik tablicowy (run_backtest_arrays) kontra oryginalna pętla bar po barze.
+
+loop_backtest to zamrożona referencja - dawna gałąź engine='loop' z
+PivotBacktester.run_backtest (stały spread_value, bez modelu kosztów).
+Oba silniki mają dać te same transakcje, margin calle i kapitał końcowy.
+"""
+
+import itertools
+from datetime import timedelta
+
+import pandas as pd
+import pytest
+
+from bench_pivot import iter_synthetic_ohlc
+from pivot_backtester import PivotBacktester
+from pivot_engine import run_backtest_arrays
+
+
+def loop_backtest(df, symbol, initial_capital=10000,
+                  spread_value=0.0002, holding_days=5, stop_loss_pct=None,
+                  support_level='S3', resistance_level='R3',
+                  trade_direction='Both', leverage=1, capital_usage_pct=100):
+    """Oryginalny backtest bar po barze (referencja, nie zmieniać)"""
+    trades = []
+    capital = initial_capital
+    open_positions = []
+    margin_calls = 0
+    skipped_no_margin = 0
+
+    def calc_used_margin():
+        """Suma zablokowanego marginu w otwartych pozycjach"""
+        return sum(pos['margin'] for pos in open_positions)
+
+    def calc_free_margin():
+        """Wolny margin = kapitał - zablokowany margin + unrealized P&L"""
+        used = calc_used_margin()
+        unrealized = 0
+        # Nie liczymy unrealized tutaj dla uproszczenia (conservative)
+        return capital - used
+
+    for i in range(len(df)):
+        row = df.iloc[i]
+
+        if pd.isna(row.get('S3')) or pd.isna(row.get('R3')):
+            continue
+
+        current_date = row['Date']
+        current_price = row['Close']
+        current_high = row['High']
+        current_low = row['Low']
+
+        positions_to_close = []
+
+        for pos_idx, pos in enumerate(open_positions):
+
+            # --- MARGIN CALL CHECK ---
+            # Sprawdź czy unrealized loss >= margin (depozyt)
+            if pos['type'] == 'long':
+                unrealized_price_diff = current_low - pos['entry_price']
+            else:
+                unrealized_price_diff = pos['entry_price'] - current_high
+
+            # Unrealized P&L w bazowej
+            unrealized_quoted = unrealized_price_diff * pos['eff_volume']
+            check_price = current_low if pos['type'] == 'long' else current_high
+            if check_price != 0:
+                unrealized_base = unrealized_quoted / check_price
+            else:
+                unrealized_base = 0
+
+            # Margin call: strata >= margin (tracimy cały depozyt)
+            if unrealized_base <= -pos['margin']:
+                # Zamknij po cenie margin call (cena przy której strata = margin)
+                if pos['type'] == 'long':
+                    # margin_base = margin, szukamy ceny gdzie loss_base = margin
+                    # loss_quoted = (entry - mc_price) * eff_vol
+                    # loss_base = loss_quoted / mc_price = margin
+                    # (entry - mc_price) * eff_vol / mc_price = margin
+                    # Przybliżenie: zamykamy po current_low
+                    mc_price = current_low
+                else:
+                    mc_price = current_high
+                positions_to_close.append((pos_idx, 'Margin Call', mc_price))
+                continue
+
+            # --- TIME EXIT ---
+            if current_date >= pos['exit_date']:
+                positions_to_close.append((pos_idx, 'Time exit', current_price))
+                continue
+
+            # --- STOP LOSS ---
+            if stop_loss_pct is not None and stop_loss_pct > 0:
+                if pos['type'] == 'long':
+                    stop_loss_price = pos['entry_price'] * (1 - stop_loss_pct / 100)
+                    if current_low <= stop_loss_price:
+                        positions_to_close.append((pos_idx, 'Stop Loss', stop_loss_price))
+                        continue
+                else:
+                    stop_loss_price = pos['entry_price'] * (1 + stop_loss_pct / 100)
+                    if current_high >= stop_loss_price:
+                        positions_to_close.append((pos_idx, 'Stop Loss', stop_loss_price))
+                        continue
+
+        # Zamykanie pozycji
+        for pos_idx, exit_reason, exit_price_raw in sorted(positions_to_close, reverse=True, key=lambda x: x[0]):
+            pos = open_positions.pop(pos_idx)
+
+            if pos['type'] == 'long':
+                exit_price = exit_price_raw - spread_value
+                price_diff = exit_price - pos['entry_price']
+            else:
+                exit_price = exit_price_raw + spread_value
+                price_diff = pos['entry_price'] - exit_price
+
+            # P&L w kwotowanej
+            profit_quoted = price_diff * pos['eff_volume']
+
+            # P&L w bazowej
+            if exit_price != 0:
+                profit_base = profit_quoted / exit_price
+            else:
+                profit_base = 0
+
+            # Przy margin call: strata ograniczona do marginu
+            if exit_reason == 'Margin Call':
+                profit_base = max(profit_base, -pos['margin'])
+                margin_calls += 1
+
+            pnl_pct = (profit_base / capital) * 100 if capital != 0 else 0
+            roi_on_margin = (profit_base / pos['margin']) * 100 if pos['margin'] != 0 else 0
+
+            pip_value = 0.0001
+            if 'JPY' in symbol:
+                pip_value = 0.01
+            pips_gained = price_diff / pip_value
+
+            capital += profit_base
+
+            # Zabezpieczenie: kapitał nie spada poniżej 0
+            if capital < 0:
+                capital = 0
+
+            days_held = (current_date - pos['entry_date']).days
+
+            trades.append({
+                'Symbol': symbol,
+                'Entry Date': pos['entry_date'],
+                'Exit Date': current_date,
+                'Type': pos['type'].upper(),
+                'Entry Price': pos['entry_price'],
+                'Exit Price': exit_price,
+                'Entry Level': pos['entry_level_name'],
+                'Entry Level Value': pos['entry_level_value'],
+                'Price Diff': price_diff,
+                'Pips': pips_gained,
+                'Profit (quoted)': profit_quoted,
+                'Profit (base)': profit_base,
+                'P&L %': pnl_pct,
+                'ROI Margin %': roi_on_margin,
+                'Margin Used': pos['margin'],
+                'Eff. Volume': pos['eff_volume'],
+                'Capital': capital,
+                'Leverage': leverage,
+                'Duration': days_held,
+                'Exit Reason': exit_reason
+            })
+
+        # ============================================
+        # OTWIERANIE POZYCJI W PONIEDZIAŁEK
+        # Wolumen = wolny_kapitał × usage% × leverage (COMPOUND)
+        # ============================================
+        if current_date.weekday() == 0 and capital > 0:
+
+            support_value = row[support_level]
+            resistance_value = row[resistance_level]
+
+            free_margin = calc_free_margin()
+
+            if free_margin <= 0:
+                continue
+
+            # Margin na pozycję = wolny kapitał × usage%
+            position_margin = free_margin * (capital_usage_pct / 100)
+
+            if position_margin <= 0:
+                continue
+
+            # Efektywny wolumen = margin × leverage
+            eff_volume = position_margin * leverage
+
+            if trade_direction in ['Both', 'Long Only']:
+                if current_price < support_value:
+                    # Margin check
+                    required_margin = position_margin
+                    if required_margin > free_margin:
+                        skipped_no_margin += 1
+                    else:
+                        entry_price = current_price + spread_value
+                        exit_date = current_date + timedelta(days=holding_days)
+
+                        open_positions.append({
+                            'type': 'long',
+                            'entry_date': current_date,
+                            'exit_date': exit_date,
+                            'entry_price': entry_price,
+                            'entry_level_name': support_level,
+                            'entry_level_value': support_value,
+                            'margin': position_margin,
+                            'eff_volume': eff_volume
+                        })
+
+                        # Odśwież wolny margin po otwarciu
+                        free_margin = calc_free_margin()
+
+            if trade_direction in ['Both', 'Short Only']:
+                if current_price > resistance_value:
+                    # Recalc margin jeśli otworzyliśmy long powyżej
+                    if free_margin <= 0:
+                        skipped_no_margin += 1
+                    else:
+                        position_margin_short = min(position_margin, free_margin * (capital_usage_pct / 100))
+                        if position_margin_short <= 0:
+                            skipped_no_margin += 1
+                        else:
+                            eff_volume_short = position_margin_short * leverage
+
+                            entry_price = current_price - spread_value
+                            exit_date = current_date + timedelta(days=holding_days)
+
+                            open_positions.append({
+                                'type': 'short',
+                                'entry_date': current_date,
+                                'exit_date': exit_date,
+                                'entry_price': entry_price,
+                                'entry_level_name': resistance_level,
+                                'entry_level_value': resistance_value,
+                                'margin': position_margin_short,
+                                'eff_volume': eff_volume_short
+                            })
+
+    # Zamknij otwarte pozycje na końcu danych
+    last_row = df.iloc[-1]
+    for pos in open_positions:
+
+        if pos['type'] == 'long':
+            exit_price = last_row['Close'] - spread_value
+            price_diff = exit_price - pos['entry_price']
+        else:
+            exit_price = last_row['Close'] + spread_value
+            price_diff = pos['entry_price'] - exit_price
+
+        profit_quoted = price_diff * pos['eff_volume']
+        if exit_price != 0:
+            profit_base = profit_quoted / exit_price
+        else:
+            profit_base = 0
+
+        pnl_pct = (profit_base / capital) * 100 if capital != 0 else 0
+        roi_on_margin = (profit_base / pos['margin']) * 100 if pos['margin'] != 0 else 0
+
+        pip_value = 0.0001
+        if 'JPY' in symbol:
+            pip_value = 0.01
+        pips_gained = price_diff / pip_value
+
+        capital += profit_base
+        if capital < 0:
+            capital = 0
+
+        days_held = (last_row['Date'] - pos['entry_date']).days
+
+        trades.append({
+            'Symbol': symbol,
+            'Entry Date': pos['entry_date'],
+            'Exit Date': last_row['Date'],
+            'Type': pos['type'].upper(),
+            'Entry Price': pos['entry_price'],
+            'Exit Price': exit_price,
+            'Entry Level': pos['entry_level_name'],
+            'Entry Level Value': pos['entry_level_value'],
+            'Price Diff': price_diff,
+            'Pips': pips_gained,
+            'Profit (quoted)': profit_quoted,
+            'Profit (base)': profit_base,
+            'P&L %': pnl_pct,
+            'ROI Margin %': roi_on_margin,
+            'Margin Used': pos['margin'],
+            'Eff. Volume': pos['eff_volume'],
+            'Capital': capital,
+            'Leverage': leverage,
+            'Duration': days_held,
+            'Exit Reason': 'End of data'
+        })
+
+    return pd.DataFrame(trades), capital, margin_calls, skipped_no_margin
+
+
+def synthetic_pivot_frame(n_bars, seed, lookback, s0=1.10, annual_vol=0.12):
+    df = pd.concat(list(iter_synthetic_ohlc(n_bars, seed, 'D', s0=s0, annual_vol=annual_vol)), ignore_index=True)
+    return PivotBacktester(lookback_days=lookback).calculate_pivot_points(df)
+
+
+LOOKBACKS = [5, 14]
+HOLDINGS = [3, 10]
+STOP_LOSSES = [None, 1.0]
+LEVERAGES = [1, 30]
+USAGES = [50, 100]
+LEVELS = [('S3', 'R3'), ('S2', 'R2')]
+DIRECTIONS = ['Both', 'Long Only', 'Short Only']
+
+GRID = list(itertools.product(LOOKBACKS, HOLDINGS, STOP_LOSSES, LEVERAGES, USAGES, LEVELS, DIRECTIONS))
+
+
+@pytest.fixture(scope='module')
+def frames():
+    return {
+        (symbol, lookback): synthetic_pivot_frame(500, seed, lookback, s0)
+        for seed, (symbol, s0) in enumerate([('EURUSD', 1.10), ('USDJPY', 145.0)])
+        for lookback in LOOKBACKS
+    }
+
+
+@pytest.mark.parametrize('symbol', ['EURUSD', 'USDJPY'])
+@pytest.mark.parametrize('lookback, holding, stop_loss, leverage, usage, levels, direction', GRID)
+def test_array_engine_matches_loop(frames, symbol, lookback, holding, stop_loss, leverage, usage, levels,
+                                   direction):
+    df = frames[(symbol, lookback)]
+    args = (df, symbol, 10000, 0.0002, holding, stop_loss, levels[0], levels[1], direction, leverage, usage)
+
+    expected_trades, expected_capital, expected_mc, expected_skipped = loop_backtest(*args)
+    trades, capital, margin_calls, skipped = run_backtest_arrays(*args)
+
+    assert len(expected_trades) > 0
+    pd.testing.assert_frame_equal(trades, expected_trades, check_dtype=False, check_exact=True)
+    assert capital == expected_capital
+    assert margin_calls == expected_mc
+    assert skipped == expected_skipped
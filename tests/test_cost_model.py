@@ -0,0 +1,70 @@
+"""CostModel: skok spreadu w czasie i naliczanie swapu przez weekend (wynik liczony ręcznie)"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from cost_model import CostModel
+from pivot_engine import run_backtest_arrays
+
+SPREADS = {'EURUSD': pd.DataFrame({
+    'Date': pd.to_datetime(['2024-01-01', '2024-01-05']),
+    'Spread': [0.0001, 0.0003]
+})}
+SWAPS = {'EURUSD': pd.DataFrame({
+    'Date': pd.to_datetime(['2024-01-01']),
+    'Long': [-2.0],
+    'Short': [0.5]
+})}
+
+
+@pytest.fixture
+def costs():
+    return CostModel(SPREADS, SWAPS, default_spread=0.0002)
+
+
+def test_spread_step(costs):
+    assert costs.spread_at('EURUSD', np.datetime64('2023-12-29', 'ns')) == 0.0002
+    assert costs.spread_at('EURUSD', np.datetime64('2024-01-04T23:00', 'ns')) == 0.0001
+    assert costs.spread_at('EURUSD', np.datetime64('2024-01-05', 'ns')) == 0.0003
+    assert costs.spread_at('GBPUSD', np.datetime64('2024-01-05', 'ns')) == 0.0002
+    np.testing.assert_array_equal(
+        costs.spread_series('EURUSD', pd.to_datetime(['2023-12-29', '2024-01-04', '2024-01-08'])),
+        [0.0002, 0.0001, 0.0003]
+    )
+
+
+def test_friday_to_monday_swap_is_three_nights(costs):
+    friday, monday = np.datetime64('2024-01-05', 'ns'), np.datetime64('2024-01-08', 'ns')
+    assert costs.swap_price('EURUSD', True, friday, monday) == pytest.approx(3 * -2.0 * 0.0001)
+    assert costs.swap_price('EURUSD', False, friday, monday) == pytest.approx(3 * 0.5 * 0.0001)
+    assert costs.swap_price('GBPUSD', True, friday, monday) == 0.0
+
+
+def test_trade_profit_with_spread_step_and_weekend_swap(costs):
+    # Sygnał LONG tylko w poniedziałek 2024-01-01 (Close < S3), wyjście po 7 dniach - poniedziałek 01-08
+    dates = pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-03', '2024-01-04', '2024-01-05',
+                            '2024-01-08', '2024-01-09'])
+    close = np.array([1.1000, 1.1010, 1.1020, 1.1030, 1.1040, 1.1050, 1.1060])
+    df = pd.DataFrame({
+        'Date': dates, 'Open': close, 'High': close + 0.0005, 'Low': close - 0.0005, 'Close': close,
+        'S3': [1.2] + [0.5] * 6, 'R3': [2.0] * 7
+    })
+
+    trades, capital, margin_calls, _ = run_backtest_arrays(
+        df, 'EURUSD', 10000, 0.0002, holding_days=7, trade_direction='Long Only', costs=costs
+    )
+
+    entry_price = 1.1000 + 0.0001  # spread z 01-01
+    exit_price = 1.1050 - 0.0003  # spread od 01-05
+    swap = 7 * -2.0 * 0.0001  # 7 nocy, w tym piątek -> poniedziałek
+    profit_base = ((exit_price - entry_price) + swap) * 10000 / exit_price
+
+    assert len(trades) == 1 and margin_calls == 0
+    trade = trades.iloc[0]
+    assert trade['Exit Date'] == pd.Timestamp('2024-01-08')
+    assert trade['Entry Price'] == pytest.approx(entry_price, abs=1e-12)
+    assert trade['Exit Price'] == pytest.approx(exit_price, abs=1e-12)
+    assert trade['Pips'] == pytest.approx((exit_price - entry_price) / 0.0001)
+    assert trade['Profit (base)'] == pytest.approx(profit_base, rel=1e-12)
+    assert capital == pytest.approx(10000 + profit_base, rel=1e-12)
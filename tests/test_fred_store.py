@@ -0,0 +1,76 @@
+"""FredStore.refresh na zrzucie fredgraph.csv z tests/fred (LocalFredSource, bez sieci)"""
+
+import os
+
+import pandas as pd
+import pytest
+
+from fred_store import FredStore, LocalFredSource, parse_fred_csv
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fred')
+START = '2024-01-01'
+
+
+class RecordingSource:
+    """LocalFredSource z zapisem wywołań fetch (series_id, start, end)"""
+
+    def __init__(self, directory=FIXTURE_DIR):
+        self.local = LocalFredSource(directory)
+        self.calls = []
+
+    def fetch(self, series_id, start=None, end=None):
+        self.calls.append((series_id, start, end))
+        return self.local.fetch(series_id, start, end)
+
+
+def fixture_series(series_id):
+    df = parse_fred_csv(os.path.join(FIXTURE_DIR, f"{series_id}.csv"))
+    df['Date'] = df['Date'].astype('datetime64[ns]')  # magazyn zwraca ns
+    return df
+
+
+@pytest.fixture
+def store(tmp_path):
+    return FredStore(str(tmp_path / 'fred.db'))
+
+
+def test_refresh_appends_only_after_last_stored_date(store, tmp_path):
+    full = fixture_series('DGS10')
+    cutoff = full['Date'].iloc[20]
+
+    # Magazyn z pierwszymi 21 obserwacjami (stan sprzed kilku tygodni)
+    partial = LocalFredSource(str(tmp_path / 'partial'))
+    partial.write('DGS10', full[full['Date'] <= cutoff])
+    store.refresh('DGS10', partial, START, max_age=0)
+
+    source = RecordingSource()
+    written = store.refresh('DGS10', source, START, max_age=0)
+
+    assert source.calls == [('DGS10', cutoff, None)]
+    # Ostatnia zapisana obserwacja pobierana ponownie, reszta to nowe dni
+    assert written == int((full['Date'] >= cutoff).sum())
+    pd.testing.assert_frame_equal(store.read('DGS10', START), full)
+
+
+def test_fresh_series_is_read_from_disk(store):
+    store.refresh('DGS10', RecordingSource(), START)
+
+    source = RecordingSource()
+    df = store.get('DGS10', source, START)
+
+    assert source.calls == []
+    pd.testing.assert_frame_equal(df, fixture_series('DGS10'))
+
+
+def test_forced_refresh_touches_only_one_series(store):
+    for series_id in ['DGS10', 'DGS30']:
+        store.refresh(series_id, RecordingSource(), START)
+    refreshed_before = {series_id: store.status(series_id)[2] for series_id in ['DGS10', 'DGS30']}
+
+    source = RecordingSource()
+    store.refresh('DGS10', source, START, max_age=0)
+    store.refresh('DGS30', source, START)
+
+    assert [call[0] for call in source.calls] == ['DGS10']
+    assert store.status('DGS10')[2] > refreshed_before['DGS10']
+    assert store.status('DGS30')[2] == refreshed_before['DGS30']
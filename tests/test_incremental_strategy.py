@@ -0,0 +1,60 @@
+"""IncrementalPivotStrategy bar po barze kontra run_backtest_arrays na całej historii"""
+
+import pandas as pd
+import pytest
+
+from bench_pivot import synthetic_costs, synthetic_ohlc
+from pivot_engine import PIVOT_LEVELS, IncrementalPivotStrategy, add_pivot_columns, run_backtest_arrays
+
+PARAM_SETS = [
+    {},
+    {'holding_days': 3, 'stop_loss_pct': 0.5, 'support_level': 'S2', 'resistance_level': 'R2'},
+    {'holding_days': 10, 'trade_direction': 'Long Only', 'leverage': 30, 'capital_usage_pct': 50},
+    {'stop_loss_pct': 1.0, 'trade_direction': 'Short Only', 'leverage': 100, 'support_level': 'S1',
+     'resistance_level': 'R1'},
+]
+
+
+@pytest.fixture(scope='module')
+def bars():
+    return synthetic_ohlc(800, seed=3, freq='D', annual_vol=0.12)
+
+
+# 150 > 128: sumy okna przechodzą przez blokowe sumowanie NumPy
+@pytest.mark.parametrize('lookback', [1, 7, 14, 150])
+@pytest.mark.parametrize('params', PARAM_SETS)
+@pytest.mark.parametrize('with_costs', [False, True])
+def test_bar_by_bar_matches_backtest(bars, lookback, params, with_costs):
+    costs = synthetic_costs({'EURUSD': bars}) if with_costs else None
+    pivot_df = add_pivot_columns(bars, lookback, suffixed=False)
+    trades, capital, margin_calls, skipped = run_backtest_arrays(pivot_df, 'EURUSD', costs=costs, **params)
+
+    strategy = IncrementalPivotStrategy('EURUSD', lookback_days=lookback, costs=costs, **params)
+    strategy.date_dtype = bars['Date'].dtype  # jak update_frame - typ dat w trades()
+    for row in bars.itertuples(index=False):
+        strategy.update(row.Date, row.Open, row.High, row.Low, row.Close)
+    strategy.finish()
+
+    assert strategy.levels == {level: pivot_df[level].iloc[-1] for level in PIVOT_LEVELS}
+    pd.testing.assert_frame_equal(strategy.trades(), trades, check_exact=True)
+    assert strategy.capital == capital
+    assert strategy.stats == {'margin_calls': margin_calls, 'skipped_no_margin': skipped}
+
+
+def test_update_frame_in_chunks_matches_single_pass(bars):
+    whole = IncrementalPivotStrategy('EURUSD', lookback_days=7)
+    whole.update_frame(bars)
+
+    chunked = IncrementalPivotStrategy('EURUSD', lookback_days=7)
+    for start in range(0, len(bars), 97):
+        chunked.update_frame(bars.iloc[start:start + 97])
+
+    assert chunked.finish() == whole.finish()
+    pd.testing.assert_frame_equal(chunked.trades(), whole.trades(), check_exact=True)
+
+
+def test_bars_must_be_increasing(bars):
+    strategy = IncrementalPivotStrategy('EURUSD')
+    strategy.update_frame(bars.iloc[:3])
+    with pytest.raises(ValueError):
+        strategy.update(*bars.iloc[1][['Date', 'Open', 'High', 'Low', 'Close']])
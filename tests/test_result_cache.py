@@ -0,0 +1,80 @@
+"""Klucze ResultCache w process_symbol / assemble_portfolio: co trafia w cache, a co liczy się od nowa"""
+
+import io
+
+import pandas as pd
+import pytest
+
+from bench_pivot import synthetic_ohlc
+from cost_model import CostModel
+from pivot_backtester import PivotBacktester, ResultCache, assemble_portfolio, process_symbol
+
+SYMBOL = 'EURUSD'
+LOOKBACK = 7
+PARAMS = (10000, 0.0002, 5, None, 'S3', 'R3', 'Both', 1, 100)
+COSTS = CostModel(default_spread=0.0002)
+
+# (indeks w PARAMS, nowa wartość) - każdy parametr strategii
+PARAM_CHANGES = [
+    (0, 12000), (1, 0.0003), (2, 3), (3, 1.0), (4, 'S2'), (5, 'R2'), (6, 'Long Only'), (7, 5), (8, 50)
+]
+
+
+@pytest.fixture(scope='module')
+def bars():
+    return synthetic_ohlc(600, seed=7, freq='D')
+
+
+def run(cache, bars, shared_margin, lookback=LOOKBACK, params=PARAMS, costs=COSTS):
+    """process_symbol + assemble_portfolio jednej pary; zwraca (outcome, combined_trades, nowe chybienia)"""
+    misses = cache.misses if cache is not None else 0
+    backtester = PivotBacktester(lookback_days=lookback, costs=costs)
+    outcome = process_symbol(backtester, SYMBOL, io.StringIO(bars.to_csv(index=False)), None, params,
+                             shared_margin, result_cache=cache)
+    trades, _ = assemble_portfolio([SYMBOL], {SYMBOL: outcome}, params[0], params, shared_margin, cache, costs)
+    return outcome, trades, (cache.misses - misses if cache is not None else 0)
+
+
+def changes(bars):
+    """(opis, kwargs run, czy zmiana unieważnia pivoty) - wszystko, co musi ominąć cache"""
+    modified = bars.copy()
+    modified.loc[len(modified) - 1, 'Close'] *= 1.001
+    yield 'lookback', {'lookback': 14}, True
+    yield 'data', {'bars': modified}, True
+    yield 'costs', {'costs': CostModel(default_spread=0.0003)}, False
+    for index, value in PARAM_CHANGES:
+        params = list(PARAMS)
+        params[index] = value
+        yield f"params[{index}]={value}", {'params': tuple(params)}, False
+
+
+@pytest.mark.parametrize('shared_margin', [False, True])
+def test_identical_call_hits_cache(bars, shared_margin):
+    cache = ResultCache()
+    outcome, first, misses = run(cache, bars, shared_margin)
+    assert not outcome['cached'] and misses == 2
+
+    hits = cache.hits
+    outcome, second, misses = run(cache, bars, shared_margin)
+
+    assert outcome['cached']
+    assert misses == 0 and cache.hits == hits + 2
+    pd.testing.assert_frame_equal(second, first)
+
+
+@pytest.mark.parametrize('shared_margin', [False, True])
+def test_changed_input_misses_cache(bars, shared_margin):
+    for name, kwargs, changes_pivots in changes(bars):
+        cache = ResultCache()
+        run(cache, bars, shared_margin)
+
+        kwargs = {'bars': bars, **kwargs}
+        outcome, trades, misses = run(cache, shared_margin=shared_margin, **kwargs)
+        _, expected, _ = run(None, shared_margin=shared_margin, **kwargs)
+
+        # Bez wspólnego marginu klucz barów zawiera parametry i koszty; przy wspólnym
+        # marginie ramki pivot zależą tylko od danych i lookback - parametry idą do klucza portfela
+        bars_missed = changes_pivots or not shared_margin
+        assert outcome['cached'] is not bars_missed, name
+        assert misses == 1 + bars_missed, name
+        pd.testing.assert_frame_equal(trades, expected, obj=name)
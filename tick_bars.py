@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Agregacja ticków brokera do barów OHLC w lokalnym magazynie barów (BarStore).
+
+Plik ticków (CSV: Dukascopy, eksport ticków MT5 itp.) czytany paczkami - w pamięci
+jest jedna paczka i ostatni, niedomknięty bar, więc rozmiar pliku nie ma znaczenia.
+Cena baru: bid, ask, mid ((bid + ask) / 2) albo last. Bary wyrównane do epoki (UTC):
+'1d' zaczyna się o północy, '4h' o 0:00, 4:00, ... Puste pola bid/ask (MT5 zapisuje
+tylko zmienioną stronę) uzupełniane ostatnią znaną ceną, także między paczkami.
+
+    python tick_bars.py ticks/EURUSD.csv --symbol EURUSD --bar-size 5min --price mid
+
+Interwał w magazynie: '<bar_size>:<price>' (np. '5min:mid'), obok barów '1d' z Yahoo.
+Backtest na tych barach: parametr bar_interval w pivot_backtester.
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from bar_store import BAR_DB, BarStore
+from cost_model import SPREAD_COLUMNS
+from ohlc_csv import (
+    CHUNK_ROWS, DATE_COLUMNS, DATE_FORMATS, SEPARATORS, _clean_numeric, _detect_date_format, _detect_encoding,
+    _detect_number_format, _normalize_name, _read_sample, iter_raw_chunks
+)
+
+TICK_NAMES = {
+    'Bid': ['bid'],
+    'Ask': ['ask', 'offer'],
+    'Last': ['last', 'price']
+}
+
+PRICE_SIDES = {
+    'bid': ['Bid'],
+    'ask': ['Ask'],
+    'mid': ['Bid', 'Ask'],
+    'last': ['Last']
+}
+
+BAR_SIZES = ['1min', '5min', '15min', '30min', '1h', '4h', '1d']
+
+# Ticki mają zwykle milisekundy: najpierw warianty z częścią ułamkową sekund
+TICK_DATE_FORMATS = [f"{date_format}.%f" for date_format in DATE_FORMATS if date_format.endswith('%S')] + DATE_FORMATS
+
+# Znaczniki epoki: liczba cyfr -> jednostka
+EPOCH_UNITS = {10: 's', 13: 'ms', 16: 'us', 19: 'ns'}
+
+
+def bar_interval(bar_size, price='mid'):
+    """Nazwa interwału w BarStore dla barów z ticków"""
+    return f"{bar_size}:{price}"
+
+
+def _bar_ns(bar_size):
+    try:
+        bar_ns = pd.Timedelta(bar_size).value
+    except ValueError:
+        bar_ns = 0
+    if bar_ns <= 0:
+        raise ValueError(f"Nieprawidłowy rozmiar baru: {bar_size}")
+    return bar_ns
+
+
+def _match_tick_columns(header):
+    """{Date/Bid/Ask/Last: znormalizowana nazwa} z nagłówka (wolumeny pomijane)"""
+    names = [_normalize_name(name) for name in header]
+
+    columns = {}
+    for name in names:
+        if name in DATE_COLUMNS or any(d in name for d in DATE_COLUMNS):
+            columns['Date'] = name
+            break
+
+    for target, possible_names in TICK_NAMES.items():
+        candidates = [name for name in names if name != columns.get('Date') and 'vol' not in name]
+        exact = [name for name in candidates if name.strip('<>') in possible_names]
+        partial = [name for name in candidates if any(possible in name for possible in possible_names)]
+        if exact or partial:
+            columns[target] = (exact or partial)[0]
+    return columns
+
+
+def sniff_tick_format(source):
+    """
+    Wykryj format pliku ticków z próbki (jak sniff_csv_format dla OHLC).
+
+    Zwraca dict: encoding, sep, decimal, thousands, columns (Date/Bid/Ask/Last -> nazwa w pliku),
+    time_column, date_format, date_unit (znaczniki epoki: 's'/'ms'/'us'/'ns', inaczej None).
+    ValueError z opisem, jeśli pliku nie da się odczytać.
+    """
+    sample, complete = _read_sample(source)
+    encoding = _detect_encoding(sample)
+    text = sample.decode(encoding, errors='ignore')
+
+    lines = text.splitlines()
+    if not complete:
+        lines = lines[:-1]
+    lines = [line for line in lines if line.strip()]
+    if not lines:
+        raise ValueError("Nie można odczytać pliku")
+
+    sep = None
+    for candidate in SEPARATORS:
+        header = next(csv.reader([lines[0]], delimiter=candidate))
+        columns = _match_tick_columns(header)
+        if len(header) >= 2 and 'Date' in columns and len(columns) > 1:
+            sep = candidate
+            break
+
+    if sep is None:
+        raise ValueError("Brakujące kolumny: Date oraz Bid/Ask albo Last")
+
+    names = {_normalize_name(name): name for name in header}
+    rows = [row for row in csv.reader(lines[1:], delimiter=sep) if len(row) == len(header)]
+    positions = {_normalize_name(name): i for i, name in enumerate(header)}
+
+    def sample_values(name):
+        return [row[positions[name]] for row in rows if row[positions[name]].strip()]
+
+    price_values = [value for target in TICK_NAMES if target in columns for value in sample_values(columns[target])]
+    decimal, thousands = _detect_number_format(price_values)
+    if sep == ',' and thousands == ',':
+        thousands = None
+
+    date_values = sample_values(columns['Date'])
+    time_column = None
+    if date_values and not any(':' in value for value in date_values):
+        for name in names:
+            if name != columns['Date'] and 'time' in name:
+                time_column = name
+                break
+
+    if time_column is not None:
+        date_values = [
+            f"{row[positions[columns['Date']]].strip()} {row[positions[time_column]].strip()}"
+            for row in rows if row[positions[columns['Date']]].strip()
+        ]
+
+    date_unit = None
+    lengths = {len(value.strip()) for value in date_values}
+    if date_values and all(value.strip().isdigit() for value in date_values) and len(lengths) == 1:
+        date_unit = EPOCH_UNITS.get(lengths.pop())
+
+    return {
+        'encoding': encoding,
+        'sep': sep,
+        'decimal': decimal,
+        'thousands': thousands,
+        'columns': {target: names[name] for target, name in columns.items()},
+        'time_column': names[time_column] if time_column is not None else None,
+        'date_format': None if date_unit or not date_values else _detect_date_format(date_values, TICK_DATE_FORMATS),
+        'date_unit': date_unit
+    }
+
+
+def _tick_times(raw, fmt):
+    """Czas ticków jako int64 ns + maska poprawnych dat"""
+    dates = raw[fmt['columns']['Date']]
+    if fmt['date_unit'] is not None:
+        parsed = pd.to_datetime(pd.to_numeric(dates, errors='coerce'), unit=fmt['date_unit'])
+    else:
+        dates = dates.astype(str).str.strip()
+        if fmt['time_column'] is not None:
+            dates = dates + ' ' + raw[fmt['time_column']].astype(str).str.strip()
+        parsed = pd.to_datetime(dates, format=fmt['date_format'], errors='coerce')
+
+    valid = parsed.notna().to_numpy().copy()
+    return parsed.to_numpy(dtype='datetime64[ns]').view(np.int64), valid
+
+
+def _group_bars(keys, prices, spreads):
+    """Bary z posortowanych ticków: kolumny jako tablice (jedno reduceat na kolumnę)"""
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    ends = np.r_[starts[1:], len(keys)]
+    bars = {
+        'key': keys[starts],
+        'Open': prices[starts],
+        'High': np.maximum.reduceat(prices, starts),
+        'Low': np.minimum.reduceat(prices, starts),
+        'Close': prices[ends - 1],
+        'Ticks': ends - starts
+    }
+    if spreads is not None:
+        bars['spread_sum'] = np.add.reduceat(spreads, starts)
+    return bars
+
+
+def _merge_pending(pending, bars):
+    """Doklej niedomknięty bar z poprzedniej paczki na początek bieżących"""
+    if bars['key'][0] == pending['key'][0]:
+        bars['Open'][0] = pending['Open'][0]
+        bars['High'][0] = max(bars['High'][0], pending['High'][0])
+        bars['Low'][0] = min(bars['Low'][0], pending['Low'][0])
+        bars['Ticks'][0] += pending['Ticks'][0]
+        if 'spread_sum' in bars:
+            bars['spread_sum'][0] += pending['spread_sum'][0]
+        return bars
+    return {col: np.concatenate([pending[col], values]) for col, values in bars.items()}
+
+
+def _bars_frame(bars, bar_ns):
+    df = pd.DataFrame({
+        'Date': (bars['key'] * bar_ns).astype('datetime64[ns]'),
+        'Open': bars['Open'],
+        'High': bars['High'],
+        'Low': bars['Low'],
+        'Close': bars['Close'],
+        'Ticks': bars['Ticks']
+    })
+    if 'spread_sum' in bars:
+        df['Spread'] = bars['spread_sum'] / bars['Ticks']
+    return df
+
+
+def iter_tick_bars(source, bar_size='1min', price='mid', fmt=None, chunksize=CHUNK_ROWS):
+    """
+    Domknięte bary Date/Open/High/Low/Close/Ticks(/Spread) z pliku ticków, paczka po paczce.
+
+    Spread (średni ask - bid w barze) gdy plik ma obie strony, a cena nie jest 'last'.
+    Ticki w obrębie paczki mogą być lekko nieuporządkowane; tick wcześniejszy niż
+    niedomknięty bar z poprzedniej paczki to ValueError (bar byłby już zapisany).
+    """
+    if price not in PRICE_SIDES:
+        raise ValueError(f"Nieznana cena: {price} (dostępne: {', '.join(PRICE_SIDES)})")
+    bar_ns = _bar_ns(bar_size)
+    if fmt is None:
+        fmt = sniff_tick_format(source)
+
+    missing = [side for side in PRICE_SIDES[price] if side not in fmt['columns']]
+    if missing:
+        raise ValueError(f"Brak kolumn dla ceny {price}: {', '.join(missing)}")
+
+    with_spread = price != 'last' and 'Bid' in fmt['columns'] and 'Ask' in fmt['columns']
+    sides = [side for side in ['Bid', 'Ask', 'Last']
+             if side in PRICE_SIDES[price] or (with_spread and side in ('Bid', 'Ask'))]
+
+    usecols = [fmt['columns']['Date']] + [fmt['columns'][side] for side in sides]
+    text_columns = [fmt['columns']['Date']]
+    if fmt['time_column'] is not None:
+        usecols.append(fmt['time_column'])
+        text_columns.append(fmt['time_column'])
+
+    last_quote = {side: np.nan for side in sides}
+    pending = None
+
+    for raw in iter_raw_chunks(source, fmt, usecols, text_columns, chunksize):
+        ts, valid = _tick_times(raw, fmt)
+
+        quotes = {}
+        for side in sides:
+            values = raw[fmt['columns'][side]]
+            if not pd.api.types.is_numeric_dtype(values):
+                values = _clean_numeric(values, fmt['decimal'])
+            values = values.astype(float)
+            if values.isna().any():
+                values = values.ffill().fillna(last_quote[side])
+            quotes[side] = values.to_numpy()
+            if len(values) > 0 and not np.isnan(quotes[side][-1]):
+                last_quote[side] = quotes[side][-1]
+
+        if price == 'mid':
+            prices = (quotes['Bid'] + quotes['Ask']) / 2
+        else:
+            prices = quotes[PRICE_SIDES[price][0]]
+        valid &= ~np.isnan(prices)
+        if with_spread:
+            valid &= ~np.isnan(quotes['Bid']) & ~np.isnan(quotes['Ask'])
+
+        if not valid.all():
+            ts, prices = ts[valid], prices[valid]
+            quotes = {side: values[valid] for side, values in quotes.items()}
+        if len(ts) == 0:
+            continue
+
+        if (ts[1:] < ts[:-1]).any():
+            order = np.argsort(ts, kind='stable')
+            ts, prices = ts[order], prices[order]
+            quotes = {side: values[order] for side, values in quotes.items()}
+
+        keys = ts // bar_ns
+        if pending is not None and keys[0] < pending['key'][0]:
+            raise ValueError(
+                f"Ticki nie są posortowane po czasie: {pd.Timestamp(int(ts[0]))} "
+                f"przed barem {pd.Timestamp(int(pending['key'][0] * bar_ns))}"
+            )
+
+        bars = _group_bars(keys, prices, quotes['Ask'] - quotes['Bid'] if with_spread else None)
+        if pending is not None:
+            bars = _merge_pending(pending, bars)
+
+        pending = {col: values[-1:].copy() for col, values in bars.items()}
+        if len(bars['key']) > 1:
+            yield _bars_frame({col: values[:-1] for col, values in bars.items()}, bar_ns)
+
+    if pending is not None:
+        yield _bars_frame(pending, bar_ns)
+
+
+def ticks_to_store(source, symbol, bar_store, bar_size='1min', price='mid', fmt=None,
+                   chunksize=CHUNK_ROWS, spread_path=None, progress_callback=None):
+    """
+    Zagreguj plik ticków i zapisz bary w bar_store pod interwałem bar_interval(bar_size, price).
+
+    Zapis paczkami (INSERT OR REPLACE - ponowny import tego samego pliku nadpisuje bary).
+    spread_path: dodatkowo średni spread per bar jako CSV w układzie cost_model (Date/Symbol/Spread).
+    progress_callback(summary) po każdej zapisanej paczce.
+    Zwraca dict: symbol, interval, bars, ticks, start, end.
+    """
+    interval = bar_interval(bar_size, price)
+    summary = {'symbol': symbol, 'interval': interval, 'bars': 0, 'ticks': 0, 'start': None, 'end': None}
+
+    for bars in iter_tick_bars(source, bar_size, price, fmt, chunksize):
+        bar_store.write(symbol, interval, bars)
+
+        if spread_path is not None and 'Spread' in bars:
+            spreads = bars[['Date', 'Spread']].assign(Symbol=symbol)[SPREAD_COLUMNS]
+            first = summary['bars'] == 0
+            spreads.to_csv(spread_path, mode='w' if first else 'a', header=first, index=False)
+
+        summary['bars'] += len(bars)
+        summary['ticks'] += int(bars['Ticks'].sum())
+        if summary['start'] is None:
+            summary['start'] = bars['Date'].iloc[0]
+        summary['end'] = bars['Date'].iloc[-1]
+        if progress_callback is not None:
+            progress_callback(summary)
+
+    if summary['bars'] > 0:
+        bar_store.mark_fetched(symbol, interval, summary['start'], summary['end'])
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ticki -> bary OHLC w magazynie barów")
+    parser.add_argument('source', help="plik CSV z tickami")
+    parser.add_argument('--symbol', help="symbol w magazynie (domyślnie nazwa pliku)")
+    parser.add_argument('--bar-size', default='1min', help=f"rozmiar baru, np. {', '.join(BAR_SIZES)}")
+    parser.add_argument('--price', choices=list(PRICE_SIDES), default='mid')
+    parser.add_argument('--bar-db', default=BAR_DB, help="magazyn barów SQLite")
+    parser.add_argument('--chunksize', type=int, default=CHUNK_ROWS, help="ticków na paczkę")
+    parser.add_argument('--spread-out', help="CSV ze średnim spreadem per bar (plik spreadów dla cost_model)")
+    args = parser.parse_args(argv)
+
+    symbol = (args.symbol or os.path.splitext(os.path.basename(args.source))[0]).upper()
+
+    def report(summary):
+        print(f"{summary['bars']:,} barów z {summary['ticks']:,} ticków (do {summary['end']})", file=sys.stderr)
+
+    started = time.perf_counter()
+    try:
+        summary = ticks_to_store(args.source, symbol, BarStore(args.bar_db), args.bar_size, args.price,
+                                 chunksize=args.chunksize, spread_path=args.spread_out, progress_callback=report)
+    except (OSError, ValueError) as e:
+        print(f"Błąd: {e}", file=sys.stderr)
+        return 2
+
+    print(f"{symbol} {summary['interval']}: {summary['bars']:,} barów, {summary['ticks']:,} ticków, "
+          f"{summary['start']} - {summary['end']} ({time.perf_counter() - started:.1f} s)")
+    print(f"Backtest: \"bar_interval\": \"{summary['interval']}\" w pliku parametrów pivot_backtester")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())